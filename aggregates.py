@@ -0,0 +1,139 @@
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import reviews_io
+import time_buckets
+
+# bump this whenever the layout of the aggregate artifact changes
+AGGREGATES_VERSION = 4
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+aggregates_file = 'Dataset/Aggregates/aggregates.pkl'
+
+
+def chunk_aggregates(df):
+    """
+    Full (untrimmed) counts for one chunk of cleaned reviews. Partial results
+    from several chunks are combined with merge_aggregates.
+    """
+    sentiment = df['sentiment'].astype(object)
+    comments = df['cleaned_comments']
+
+    return {
+        'n_rows': len(df),
+        'n_comments': int(comments.count()),
+        # 64-bit hashes stand in for the comments when counting unique ones
+        'comment_hashes': np.unique(pd.util.hash_pandas_object(comments, index=False).to_numpy()),
+        'reviewer_counts': df['reviewer_name'].astype(object).value_counts(),
+        'sentiment_counts': sentiment.value_counts(),
+        'daily': time_buckets.bucket_counts(df, 'day'),
+    }
+
+
+def _add_counts(left, right):
+    return left.add(right, fill_value=0).astype('int64')
+
+
+def merge_aggregates(left, right):
+    # combine the partial aggregates of two chunks
+    return {
+        'n_rows': left['n_rows'] + right['n_rows'],
+        'n_comments': left['n_comments'] + right['n_comments'],
+        'comment_hashes': np.union1d(left['comment_hashes'], right['comment_hashes']),
+        'reviewer_counts': _add_counts(left['reviewer_counts'], right['reviewer_counts']),
+        'sentiment_counts': _add_counts(left['sentiment_counts'], right['sentiment_counts']),
+        'daily': _add_counts(left['daily'], right['daily']),
+    }
+
+
+def finalize_aggregates(partial, top_n=100):
+    # trim the merged counts down to what the dashboard needs
+    def top(counts):
+        return counts.sort_values(ascending=False, kind='stable').head(top_n)
+
+    return {
+        'version': AGGREGATES_VERSION,
+        'n_rows': partial['n_rows'],
+        'n_comments': partial['n_comments'],
+        'n_unique_comments': len(partial['comment_hashes']),
+        'reviewer_counts': top(partial['reviewer_counts']),
+        'sentiment_counts': partial['sentiment_counts'].sort_values(ascending=False),
+        # per-day counts, roll up with time_buckets.rollup for coarser charts
+        'daily': partial['daily'].sort_index(),
+    }
+
+
+def build_aggregates(chunks, top_n=100):
+    """
+    Fold an iterable of review chunks (or a single DataFrame) into the small
+    set of numbers the dashboard charts and indicator cards are drawn from.
+    Only one chunk is held in memory at a time.
+    """
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    partial = None
+    for chunk in chunks:
+        aggs = chunk_aggregates(chunk)
+        partial = aggs if partial is None else merge_aggregates(partial, aggs)
+    if partial is None:
+        raise ValueError('no reviews to aggregate')
+    return finalize_aggregates(partial, top_n)
+
+
+def save_aggregates(aggs, path=aggregates_file):
+    # write to a temporary file first so readers never see a half-written artifact,
+    # one per process so concurrent builds never write into the same file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    joblib.dump(aggs, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_aggregates(path=aggregates_file):
+    # returns None when there is no usable artifact at path
+    if not os.path.exists(path):
+        return None
+    aggs = joblib.load(path)
+    if aggs.get('version') != AGGREGATES_VERSION:
+        return None
+    return aggs
+
+
+def build(source=csv_file, path=aggregates_file, top_n=100, chunksize=reviews_io.DEFAULT_CHUNKSIZE):
+    # offline aggregate build: stream the csv once and store the result
+    fingerprint = reviews_io.file_fingerprint(source)
+    stats = reviews_io.LoadStats()
+    chunks = reviews_io.iter_review_chunks(
+        source, chunksize, columns=['date', 'reviewer_name', 'cleaned_comments', 'sentiment'], stats=stats)
+    aggs = build_aggregates(chunks, top_n=top_n)
+    aggs['fingerprint'] = fingerprint
+    save_aggregates(aggs, path)
+    print('aggregate build: ' + stats.report())
+    return aggs
+
+
+def load_or_build(source=csv_file, path=aggregates_file, top_n=100):
+    """
+    Load the aggregate artifact, rebuilding it only when it is missing, was
+    written by another version or the source csv fingerprint has changed.
+    """
+    aggs = load_aggregates(path)
+    if aggs is not None and aggs.get('fingerprint') == reviews_io.file_fingerprint(source):
+        return aggs
+    return build(source, path, top_n)
+
+
+if __name__ == '__main__':
+    # python aggregates.py [reviews.csv] [--force]
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    source = args[0] if args else csv_file
+    if '--force' in sys.argv:
+        aggs = build(source)
+    else:
+        aggs = load_or_build(source)
+    print('aggregates for {} rows written to {} ({})'.format(
+        aggs['n_rows'], aggregates_file, aggs['fingerprint']))
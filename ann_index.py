@@ -0,0 +1,298 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+
+knn_file = 'Models/k_neighbors_model.pkl'
+index_file = 'Models/k_neighbors_ann.pkl'
+
+# recall/speed knobs: query terms looked up, postings read per term
+DEFAULT_MAX_TERMS = 8
+DEFAULT_MAX_POSTINGS = 2000
+# queries scored together by kneighbors, bounds the candidate pairs in memory
+QUERY_BATCH = 64
+# largest queries x rows distance matrix scored at once by brute force
+DENSE_CELLS = 1 << 22
+# measured cost of reranking a candidate, in multiply-adds of its row: the
+# gather and deduplication dominate the product itself
+RERANK_COST = 8
+
+
+def _ranges(starts, ends):
+    # the concatenation of range(start, end) for each pair, vectorized
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class InvertedIndex:
+    """
+    Approximate KNeighborsClassifier over sparse TF-IDF rows. The training
+    rows are stored term by term, each posting list ordered by weight so its
+    head holds the rows where the term matters most. A query reads the
+    postings of its heaviest terms, reranks that candidate set by exact
+    euclidean distance and takes a majority vote, like the brute-force
+    model it replaces.
+
+    max_terms and max_postings trade recall for speed at query time. With
+    both set to None every row sharing a term with the query is a
+    candidate, which gives the exact neighbours.
+    """
+
+    def __init__(self, n_neighbors=5, max_terms=DEFAULT_MAX_TERMS, max_postings=DEFAULT_MAX_POSTINGS):
+        self.n_neighbors = n_neighbors
+        self.max_terms = max_terms
+        self.max_postings = max_postings
+
+    def fit(self, X, y, classes=None):
+        """
+        Index the rows of X. y holds class labels, or indices into classes
+        when classes is given (as stored by a fitted KNeighborsClassifier).
+        """
+        X = sp.csr_matrix(X, dtype=np.float32)
+        if classes is None:
+            self.classes_, self._y = np.unique(np.asarray(y), return_inverse=True)
+        else:
+            self.classes_, self._y = np.asarray(classes), np.asarray(y)
+        self._fit_X = X
+        self._sq_norms = np.asarray(X.multiply(X).sum(axis=1), dtype=np.float32).ravel()
+
+        # postings per term, heaviest first
+        postings = X.tocsc()
+        terms = np.repeat(np.arange(postings.shape[1]), np.diff(postings.indptr))
+        order = np.lexsort((-postings.data, terms))
+        self.posting_ptr = postings.indptr.astype(np.int64)
+        self.posting_rows = postings.indices[order].astype(np.int32)
+        # rows sharing no term with a query are ranked by their own norm,
+        # so the k shortest ones (empty reviews) are always candidates and
+        # every query has at least k of them, whatever k it asks for
+        self.shortest_rows = np.argsort(self._sq_norms, kind='stable').astype(np.int32)
+        return self
+
+    @classmethod
+    def from_knn(cls, model, **kwargs):
+        # index the training rows of a fitted KNeighborsClassifier; only the
+        # uniform vote over euclidean distances is reimplemented
+        euclidean = model.metric in ('euclidean', 'l2') or (model.metric == 'minkowski' and model.p == 2)
+        if not euclidean or model.metric_params:
+            raise ValueError('cannot index a model with metric={!r}, p={!r}, only euclidean distances'.format(
+                model.metric, model.p))
+        if model.weights != 'uniform':
+            raise ValueError('cannot index a model with weights={!r}, only uniform'.format(model.weights))
+        kwargs.setdefault('n_neighbors', model.n_neighbors)
+        return cls(**kwargs).fit(model._fit_X, model._y, model.classes_)
+
+    def _scanned(self, X, max_terms, max_postings):
+        # (query, start, length) of each posting list head a csr batch of queries reads
+        queries = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+        # the query terms, heaviest first within each query
+        order = np.lexsort((-X.data, queries))
+        terms = X.indices[order]
+        if max_terms:
+            rank = np.arange(len(order)) - X.indptr[queries]
+            queries, terms = queries[rank < max_terms], terms[rank < max_terms]
+        starts = self.posting_ptr[terms]
+        lengths = self.posting_ptr[terms + 1] - starts
+        if max_postings:
+            lengths = np.minimum(lengths, max_postings)
+        return queries, starts, lengths
+
+    def candidates(self, X, max_terms=None, max_postings=None, k=None):
+        """
+        Candidate (query, training row) pairs for the rows of a csr batch of
+        queries, sorted and unique, at least k rows (n_neighbors by default)
+        for each query.
+        """
+        k = k or self.n_neighbors
+        n_queries, n_rows = X.shape[0], self._fit_X.shape[0]
+        queries, starts, lengths = self._scanned(X, max_terms, max_postings)
+        rows = np.asarray(self.posting_rows)[_ranges(starts, starts + lengths)]
+        pair_queries = np.concatenate([np.repeat(queries, lengths), np.repeat(np.arange(n_queries), k)])
+        pair_rows = np.concatenate([rows, np.tile(self.shortest_rows[:k], n_queries)])
+        keys = np.unique(pair_queries.astype(np.int64) * n_rows + pair_rows)
+        return keys // n_rows, keys % n_rows
+
+    def kneighbors(self, X, n_neighbors=None, max_terms=-1, max_postings=-1):
+        """
+        (distances, indices) of the approximate nearest training rows, like
+        KNeighborsClassifier.kneighbors. max_terms and max_postings default
+        to the index settings.
+
+        Queries are scored QUERY_BATCH at a time. When reranking the
+        candidates would cost as much as scoring every training row (small
+        indexes, or many postings per query), the batch gets the exact
+        neighbours instead.
+        """
+        k = n_neighbors or self.n_neighbors
+        n_rows = self._fit_X.shape[0]
+        if k > n_rows:
+            raise ValueError('n_neighbors={} is more than the {} indexed rows'.format(k, n_rows))
+        max_terms = self.max_terms if max_terms == -1 else max_terms
+        max_postings = self.max_postings if max_postings == -1 else max_postings
+        X = sp.csr_matrix(X, dtype=np.float32)
+        row_nnz = self._fit_X.nnz / n_rows
+        distances = np.empty((X.shape[0], k), dtype=np.float64)
+        indices = np.empty((X.shape[0], k), dtype=np.intp)
+        for start in range(0, X.shape[0], QUERY_BATCH):
+            batch = X[start:start + QUERY_BATCH]
+            # reranking costs RERANK_COST * row_nnz per candidate, the exact
+            # a pass over every stored weight and row for each query
+            _, _, lengths = self._scanned(batch, max_terms, max_postings)
+            exact_cost = batch.shape[0] * (self._fit_X.nnz + n_rows)
+            if lengths.sum() * row_nnz * RERANK_COST < exact_cost:
+                result = self._nearest(batch, *self._candidate_dots(batch, max_terms, max_postings, k), k)
+            else:
+                result = self._exact_nearest(batch, k)
+            distances[start:start + QUERY_BATCH], indices[start:start + QUERY_BATCH] = result
+        return distances, indices
+
+    def _candidate_dots(self, X, max_terms, max_postings, k):
+        # (queries, rows, dots) of the candidates, from one sparse product:
+        # the candidate rows, each shifted to its query's columns, times the
+        # batch's queries laid end to end
+        queries, rows = self.candidates(X, max_terms, max_postings, k)
+        gathered = self._fit_X[rows]
+        n_features = X.shape[1]
+        shifted = sp.csr_matrix(
+            (gathered.data, gathered.indices + np.repeat(queries * n_features, np.diff(gathered.indptr)),
+             gathered.indptr), shape=(len(rows), X.shape[0] * n_features))
+        return queries, rows, shifted @ X.toarray().ravel()
+
+    def _nearest(self, X, queries, rows, dots, k):
+        # the k closest rows of each query, from pairs grouped by query
+        query_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        squared = np.maximum(self._sq_norms[rows] + query_norms[queries] - 2 * dots, 0)
+        # one partition over all pairs: offset by query, the distances keep
+        # their groups, so splitting at each group start and k-th position
+        # leaves the k smallest of every query in front of its group
+        first = np.searchsorted(queries, np.arange(X.shape[0]))
+        keys = queries * (squared.max() + 1) + squared
+        nearest = np.argpartition(keys, np.unique(np.concatenate([first, first + k - 1])))
+        nearest = nearest[first[:, None] + np.arange(k)]
+        nearest = np.take_along_axis(nearest, np.argsort(squared[nearest], axis=1, kind='stable'), axis=1)
+        return np.sqrt(squared[nearest]), rows[nearest]
+
+    def _exact_nearest(self, X, k):
+        # brute force: the training rows times dense query columns, a chunk
+        # of queries at a time (sparse by sparse is far slower here, the
+        # common terms make the product nearly dense anyway)
+        n_rows = self._fit_X.shape[0]
+        query_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        distances = np.empty((X.shape[0], k), dtype=np.float64)
+        indices = np.empty((X.shape[0], k), dtype=np.intp)
+        step = max(1, DENSE_CELLS // n_rows)
+        for start in range(0, X.shape[0], step):
+            squared = (self._fit_X @ X[start:start + step].T.toarray()).T
+            squared *= -2
+            squared += self._sq_norms
+            squared += query_norms[start:start + step, None]
+            np.maximum(squared, 0, out=squared)
+            nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            nearest = np.take_along_axis(
+                nearest, np.argsort(np.take_along_axis(squared, nearest, axis=1), axis=1, kind='stable'), axis=1)
+            distances[start:start + step] = np.sqrt(np.take_along_axis(squared, nearest, axis=1))
+            indices[start:start + step] = nearest
+        return distances, indices
+
+    def predict_proba(self, X, **kwargs):
+        _, indices = self.kneighbors(X, **kwargs)
+        votes = self._y[indices]
+        counts = np.stack([(votes == label).sum(axis=1) for label in range(len(self.classes_))], axis=1)
+        return counts / votes.shape[1]
+
+    def predict(self, X, **kwargs):
+        # majority vote, ties go to the first class as in KNeighborsClassifier
+        return self.classes_[self.predict_proba(X, **kwargs).argmax(axis=1)]
+
+    def save(self, path=index_file):
+        # written atomically, workers may be loading the index
+        tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+        joblib.dump(self, tmp_file)
+        os.replace(tmp_file, path)
+
+    @staticmethod
+    def load(path=index_file):
+        # arrays are memory-mapped, workers share the pages
+        return joblib.load(path, mmap_mode='r')
+
+
+def synthetic_tfidf(n_rows, idf, mean_length=12, random_state=0):
+    """
+    L2-normalized TF-IDF rows with Zipf-distributed terms, for benchmarking
+    at sizes beyond the real corpus. Low-idf (common) terms are drawn most.
+    """
+    rng = np.random.default_rng(random_state)
+    by_frequency = np.argsort(idf, kind='stable')
+    lengths = np.maximum(rng.poisson(mean_length, n_rows), 1)
+    ranks = np.minimum(rng.zipf(1.3, lengths.sum()) - 1, len(idf) - 1)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    X = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, by_frequency[ranks])),
+                      shape=(n_rows, len(idf)))
+    X.sum_duplicates()
+    X = sp.csr_matrix(X.multiply(idf.astype(np.float32)), dtype=np.float32)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    X.data /= np.repeat(np.maximum(norms, 1e-12), np.diff(X.indptr)).astype(np.float32)
+    return X
+
+
+def benchmark(sizes, idf, n_queries=1000, k=5,
+              settings=((4, 500), (8, 2000), (16, 10000), (None, None))):
+    """
+    recall@k and queries/sec of the index against brute-force
+    NearestNeighbors.kneighbors, for each (max_terms, max_postings) setting.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    rows = []
+    for size in sizes:
+        X = synthetic_tfidf(size + n_queries, idf, random_state=size)
+        X_train, X_query = X[:size], X[size:]
+
+        start = time.perf_counter()
+        index = InvertedIndex(n_neighbors=k).fit(X_train, np.zeros(size, dtype=int), classes=np.array(['_']))
+        build_sec = time.perf_counter() - start
+
+        exact = NearestNeighbors(n_neighbors=k, algorithm='brute').fit(X_train)
+        start = time.perf_counter()
+        expected_distances, _ = exact.kneighbors(X_query)
+        exact_qps = n_queries / (time.perf_counter() - start)
+
+        for max_terms, max_postings in settings:
+            start = time.perf_counter()
+            distances, _ = index.kneighbors(X_query, max_terms=max_terms, max_postings=max_postings)
+            qps = n_queries / (time.perf_counter() - start)
+            # a neighbour counts as found when it is at least as close as the
+            # exact k-th one, so ties at equal distance are not misses
+            kth = expected_distances[:, -1:] + 1e-6
+            recall = float((distances <= kth).mean())
+            rows.append({'rows': size, 'max_terms': max_terms, 'max_postings': max_postings,
+                         'recall_at_k': recall, 'qps': qps, 'exact_qps': exact_qps,
+                         'build_sec': build_sec})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Approximate index for the k-neighbors sentiment model')
+    parser.add_argument('command', choices=['build', 'benchmark'])
+    parser.add_argument('--max-terms', type=int, default=DEFAULT_MAX_TERMS)
+    parser.add_argument('--max-postings', type=int, default=DEFAULT_MAX_POSTINGS)
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated training sizes for benchmark')
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        index = InvertedIndex.from_knn(joblib.load(knn_file), max_terms=args.max_terms,
+                                       max_postings=args.max_postings)
+        index.save()
+        print('indexed {} rows into {} in {:.2f}s'.format(index._fit_X.shape[0], index_file,
+                                                          time.perf_counter() - start))
+    else:
+        import pandas as pd
+        idf = joblib.load('Models/tfidf_vectorizer.pkl').idf_
+        sizes = [int(size) for size in args.sizes.split(',')]
+        table = pd.DataFrame(benchmark(sizes, idf, args.queries))
+        print(table.round(3).to_string(index=False))
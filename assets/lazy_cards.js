@@ -0,0 +1,35 @@
+// Cards wrapped in a .lazy-card div (test.py) load their figure once they
+// scroll into view: the observer sets data on the card's dcc.Store, which
+// fires that card's callback. Without IntersectionObserver every card loads
+// as soon as it is rendered.
+(function () {
+    function show(card) {
+        window.dash_clientside.set_props(card.getAttribute('data-card') + '_visible', {data: true});
+    }
+
+    var observer = null;
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    show(entry.target);
+                }
+            });
+        }, {rootMargin: '200px'});
+    }
+
+    // the layout is rendered by a callback, so watch for cards being added
+    function scan() {
+        document.querySelectorAll('.lazy-card:not([data-observed])').forEach(function (card) {
+            card.setAttribute('data-observed', '1');
+            if (observer) {
+                observer.observe(card);
+            } else {
+                show(card);
+            }
+        });
+    }
+
+    new MutationObserver(scan).observe(document.documentElement, {childList: true, subtree: true});
+})();
@@ -0,0 +1,370 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import reviews_io
+from sentiment_labeler import DEFAULT_EDGES, LABELS
+
+cache_dir = 'Dataset/Cache/bench'
+history_file = 'Dataset/Benchmarks/charts_history.json'
+
+# chart builders timed by the suite, all take a reviews DataFrame
+BUILDERS = ['create_graph', 'create_graph2', 'wordcloud', 'time_series', 'time_sentiment']
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+
+GENERATOR_VERSION = 1
+CHUNKSIZE = 250000
+VOCAB_SIZE = 20000
+FIRST_DATE = '2010-01-01'
+LAST_DATE = '2023-12-31'
+
+# a slowdown is flagged when it is above both the relative and the absolute
+# threshold, so small timings do not flag on noise
+DEFAULT_TIME_TOLERANCE = 0.2
+DEFAULT_MEMORY_TOLERANCE = 0.15
+MIN_SEC_DIFF = 0.05
+MIN_MB_DIFF = 5.0
+
+# frequent words of real reviews take the top ranks of the vocabulary, the
+# rest is made of generated words
+COMMON_WORDS = ['great', 'place', 'stay', 'host', 'clean', 'location', 'apartment', 'nice', 'recommend',
+                'comfortable', 'room', 'good', 'everything', 'easy', 'perfect', 'house', 'helpful',
+                'beautiful', 'lovely', 'friendly', 'bed', 'kitchen', 'quiet', 'neighborhood', 'walk',
+                'restaurants', 'close', 'home', 'time', 'amazing', 'space', 'well', 'check', 'would',
+                'again', 'view', 'bathroom', 'small', 'noise', 'dirty']
+# stopwords interleaved with the content words of the raw comments, removed
+# from cleaned_comments (all of them are NLTK English stopwords)
+STOPWORDS = ['the', 'and', 'a', 'to', 'was', 'is', 'in', 'of', 'we', 'for', 'very', 'it', 'with', 'our',
+             'i', 'you', 'my', 'this', 'at', 'were', 'had', 'are', 'be', 'from', 'all', 'so', 'there']
+STOPWORD_SHARE = 0.4
+
+
+def _zipf_cdf(n, exponent):
+    # cumulative probabilities of ranks 1..n under a Zipf law
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def _vocabulary(size, rng):
+    # pronounceable generated words, distinct and ordered by rank
+    syllables = np.array([c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou'])
+    words = list(COMMON_WORDS)
+    seen = set(words) | set(STOPWORDS)
+    while len(words) < size:
+        for n in rng.integers(2, 5, size - len(words)):
+            word = ''.join(syllables[rng.integers(0, len(syllables), n)])
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+    return np.array(words[:size], dtype=object)
+
+
+def _join_rows(tokens, lengths):
+    # one string per row from consecutive runs of tokens
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    tokens = tokens.tolist()
+    return [' '.join(tokens[start:end]) for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+def iter_synthetic_chunks(n_rows, seed=0, chunksize=CHUNKSIZE):
+    """
+    Synthetic reviews with the reviews.csv columns used by the charts, in
+    chunks of chunksize rows. Deterministic for a given (n_rows, seed):
+    every chunk has its own generator seeded from seed and its position.
+
+    - comment lengths are log-normal (median ~27 words), words follow a
+      Zipf law over a VOCAB_SIZE vocabulary, with stopwords mixed in
+    - reviewer frequency is a power law: a few reviewers write many
+      reviews, most write one
+    - dates cover FIRST_DATE..LAST_DATE with yearly growth and a summer peak
+    - polarity is skewed positive (about 45/45/10% positive, neutral and
+      negative), sentiment is its DEFAULT_EDGES bin
+    """
+    setup = np.random.default_rng([seed, 0])
+    vocabulary = _vocabulary(VOCAB_SIZE, setup)
+    word_cdf = _zipf_cdf(VOCAB_SIZE, 1.07)
+    stopword_cdf = _zipf_cdf(len(STOPWORDS), 0.8)
+    stopwords = np.array(STOPWORDS, dtype=object)
+
+    n_reviewers = max(n_rows // 3, 10)
+    reviewer_cdf = _zipf_cdf(n_reviewers, 0.9)
+    # reviewer names are shuffled so rank does not show in the name
+    reviewer_ids = setup.permutation(n_reviewers)
+
+    days = pd.date_range(FIRST_DATE, LAST_DATE, freq='D')
+    years = (days - days[0]).days.to_numpy() / 365.25
+    day_weights = np.exp(years / 3) * (1 + 0.5 * np.cos((days.dayofyear.to_numpy() - 200) / 365.25 * 2 * np.pi))
+    day_cdf = np.cumsum(day_weights) / day_weights.sum()
+    day_labels = np.array(days.strftime('%Y-%m-%d'), dtype=object)
+
+    for chunk_index, start in enumerate(range(0, n_rows, chunksize), 1):
+        rng = np.random.default_rng([seed, chunk_index])
+        n = min(chunksize, n_rows - start)
+
+        lengths = np.clip(rng.lognormal(3.3, 0.7, n).astype(int), 1, 400)
+        is_stopword = rng.random(lengths.sum()) < STOPWORD_SHARE
+        tokens = vocabulary[np.searchsorted(word_cdf, rng.random(lengths.sum()))]
+        tokens[is_stopword] = stopwords[np.searchsorted(stopword_cdf, rng.random(is_stopword.sum()))]
+        comments = _join_rows(tokens, lengths)
+        rows = np.repeat(np.arange(n), lengths)
+        cleaned = _join_rows(tokens[~is_stopword], np.bincount(rows[~is_stopword], minlength=n))
+
+        polarity = rng.beta(3, 1.8, n) * 2 - 1
+        reviewers = reviewer_ids[np.searchsorted(reviewer_cdf, rng.random(n))]
+        yield pd.DataFrame({
+            'date': day_labels[np.searchsorted(day_cdf, rng.random(n))],
+            'reviewer_name': ['Guest{}'.format(i) for i in reviewers.tolist()],
+            'comments': [text[:1].upper() + text[1:] + '.' for text in comments],
+            'cleaned_comments': cleaned,
+            'polarity': polarity,
+            'sentiment': pd.cut(polarity, DEFAULT_EDGES, labels=LABELS, include_lowest=True).astype(str),
+        })
+
+
+def synthetic_reviews(n_rows, seed=0):
+    return pd.concat(iter_synthetic_chunks(n_rows, seed), ignore_index=True)
+
+
+def dataset_file(n_rows, seed=0):
+    return os.path.join(cache_dir, 'reviews_{}_{}_v{}.parquet'.format(n_rows, seed, GENERATOR_VERSION))
+
+
+def ensure_dataset(n_rows, seed=0):
+    """
+    Path of the synthetic dataset of n_rows rows, generated chunk by chunk
+    into a parquet file the first time it is asked for.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = dataset_file(n_rows, seed)
+    if os.path.exists(path):
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    writer = None
+    for chunk in iter_synthetic_chunks(n_rows, seed):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(tmp_file, table.schema)
+        writer.write_table(table)
+    writer.close()
+    os.replace(tmp_file, path)
+    return path
+
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets the peak RSS (VmHWM)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def measure(builder, path, repeat=1):
+    """
+    Time one chart builder on the dataset at path, in this process. Returns
+    the best wall time over repeat runs and the peak memory the builder
+    needed on top of the loaded data.
+    """
+    import charts
+
+    build = getattr(charts, builder)
+    df = pd.read_parquet(path)
+    exact_peak = _reset_peak_rss()
+    baseline = _status_mb('VmRSS') if exact_peak else reviews_io.peak_rss_mb()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(df)
+        times.append(time.perf_counter() - start)
+    peak = _status_mb('VmHWM') if exact_peak else reviews_io.peak_rss_mb()
+    return {'builder': builder, 'rows': len(df), 'wall_sec': min(times),
+            'peak_mb': max(peak - baseline, 0.0), 'data_mb': baseline}
+
+
+def run_suite(sizes, builders=BUILDERS, seed=0, repeat=1, timeout=None):
+    """
+    measure() every builder at every size, each in a fresh interpreter so
+    peak memory is not shared between runs. A run that crashes or exceeds
+    timeout seconds is recorded with its status instead of timings.
+    """
+    results = []
+    for size in sizes:
+        path = ensure_dataset(size, seed)
+        for builder in builders:
+            command = [sys.executable, os.path.abspath(__file__), 'measure', '--builder', builder,
+                       '--data', path, '--repeat', str(repeat)]
+            try:
+                result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                row = {'builder': builder, 'rows': size, 'status': 'timeout'}
+            else:
+                if result.returncode:
+                    row = {'builder': builder, 'rows': size, 'status': 'failed',
+                           'error': result.stderr.strip().splitlines()[-1:]}
+                else:
+                    row = dict(json.loads(result.stdout.strip().splitlines()[-1]), status='ok')
+            results.append(row)
+            print('{rows:>10,} {builder:<16} {status:<8} {wall}'.format(
+                wall='{:.3f}s {:.1f} MB'.format(row['wall_sec'], row['peak_mb']) if row['status'] == 'ok' else '',
+                **row), flush=True)
+    return results
+
+
+def code_version():
+    # git commit of the working tree, marked dirty when it has local changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_history(path=history_file):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_history(history, path=history_file):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp_file, path)
+
+
+def find_regressions(results, baseline, time_tolerance=DEFAULT_TIME_TOLERANCE,
+                     memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """
+    Rows of results slower or hungrier than the same builder and size in
+    the baseline run, beyond the tolerances (relative) and MIN_SEC_DIFF /
+    MIN_MB_DIFF (absolute).
+    """
+    before = {(row['builder'], row['rows']): row for row in baseline['results'] if row['status'] == 'ok'}
+    flagged = []
+    for row in results:
+        old = before.get((row['builder'], row['rows']))
+        if old is None:
+            continue
+        if row['status'] != 'ok':
+            flagged.append(dict(row, reason=row['status']))
+            continue
+        reasons = []
+        if (row['wall_sec'] > old['wall_sec'] * (1 + time_tolerance)
+                and row['wall_sec'] - old['wall_sec'] > MIN_SEC_DIFF):
+            reasons.append('time {:.3f}s -> {:.3f}s'.format(old['wall_sec'], row['wall_sec']))
+        if (row['peak_mb'] > old['peak_mb'] * (1 + memory_tolerance)
+                and row['peak_mb'] - old['peak_mb'] > MIN_MB_DIFF):
+            reasons.append('memory {:.1f} MB -> {:.1f} MB'.format(old['peak_mb'], row['peak_mb']))
+        if reasons:
+            flagged.append(dict(row, reason=', '.join(reasons)))
+    return flagged
+
+
+def scaling_exponents(results):
+    # slope of log(time) against log(rows) per builder, 1.0 is linear
+    table = pd.DataFrame([row for row in results if row['status'] == 'ok'])
+    exponents = {}
+    if table.empty:
+        return exponents
+    for builder, rows in table.groupby('builder'):
+        rows = rows[rows['wall_sec'] > 0]
+        if rows['rows'].nunique() > 1:
+            exponents[builder] = float(np.polyfit(np.log(rows['rows']), np.log(rows['wall_sec']), 1)[0])
+    return exponents
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the charts.py builders on synthetic reviews')
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'generate', 'measure'])
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument('--builders', default=','.join(BUILDERS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per builder, the fastest is kept')
+    parser.add_argument('--timeout', type=float, default=1800, help='seconds per builder run')
+    parser.add_argument('--baseline', help='compare with the latest history entry of this version '
+                                           '(default: the latest entry from this machine)')
+    parser.add_argument('--time-tolerance', type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE)
+    parser.add_argument('--no-history', action='store_true', help='do not append this run to the history')
+    parser.add_argument('--rows', type=int, help='rows for generate')
+    parser.add_argument('--out', help='csv written by generate')
+    # used by run_suite for the per-builder processes
+    parser.add_argument('--builder', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.command == 'measure':
+        print(json.dumps(measure(args.builder, args.data, args.repeat)))
+    elif args.command == 'generate':
+        # the same synthetic reviews as a csv, e.g. to load test the dashboards
+        out = args.out or 'Dataset/Cleaned Data/synthetic_{}.csv'.format(args.rows)
+        for i, chunk in enumerate(iter_synthetic_chunks(args.rows, args.seed)):
+            chunk.to_csv(out, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        print('wrote {:,} synthetic reviews to {}'.format(args.rows, out))
+    else:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        builders = args.builders.split(',')
+        results = run_suite(sizes, builders, args.seed, args.repeat, args.timeout)
+        run = {'version': code_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': platform.node(), 'python': platform.python_version(), 'seed': args.seed,
+               'generator_version': GENERATOR_VERSION, 'results': results}
+
+        history = load_history()
+        candidates = [entry for entry in history if entry.get('generator_version') == GENERATOR_VERSION
+                      and entry.get('seed') == args.seed]
+        if args.baseline:
+            candidates = [entry for entry in candidates if entry['version'] == args.baseline]
+        else:
+            candidates = [entry for entry in candidates if entry['host'] == run['host']]
+
+        for builder, exponent in sorted(scaling_exponents(results).items()):
+            print('{:<16} time ~ rows^{:.2f}'.format(builder, exponent))
+
+        flagged = []
+        if candidates:
+            baseline = candidates[-1]
+            flagged = find_regressions(results, baseline, args.time_tolerance, args.memory_tolerance)
+            print('compared with {} ({}): {} regression(s)'.format(baseline['version'], baseline['timestamp'],
+                                                                  len(flagged)))
+            for row in flagged:
+                print('  REGRESSION {builder} at {rows:,} rows: {reason}'.format(**row))
+        else:
+            print('no baseline run in {} yet'.format(history_file))
+
+        if not args.no_history:
+            history.append(run)
+            save_history(history)
+        raise SystemExit(1 if flagged else 0)
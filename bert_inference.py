@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+import reviews_io
+
+model_dir = 'Models/bert'
+quantized_file = 'Models/bert/model_int8.tflite'
+cache_dir = 'Dataset/Cache/bert'
+
+MAX_LENGTH = 128
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_THREADS = os.cpu_count() or 1
+# texts read ahead by the streaming scorer, sorted by length together
+WINDOW_BATCHES = 16
+CACHE_VERSION = 1
+
+
+def load_tokenizer(path=model_dir):
+    from transformers import BertTokenizerFast
+    return BertTokenizerFast.from_pretrained(path)
+
+
+def encode(tokenizer, texts):
+    # token ids without padding, truncated like the notebook's batch_encode_plus
+    return tokenizer(list(texts), max_length=MAX_LENGTH, truncation=True,
+                     add_special_tokens=True)['input_ids']
+
+
+def pad_batch(sequences, pad_id=0, width=None):
+    """
+    input_ids and attention_mask padded to width, by default the longest
+    sequence of the batch.
+    """
+    lengths = np.array([len(sequence) for sequence in sequences])
+    width = width or max(1, lengths.max(initial=0))
+    input_ids = np.full((len(sequences), width), pad_id, dtype=np.int32)
+    for row, sequence in enumerate(sequences):
+        input_ids[row, :len(sequence)] = sequence
+    attention_mask = (np.arange(input_ids.shape[1]) < lengths[:, None]).astype(np.int32)
+    return input_ids, attention_mask
+
+
+def length_sorted_batches(lengths, batch_size=DEFAULT_BATCH_SIZE):
+    # index batches of similar length, so padding stays close to zero
+    order = np.argsort(lengths, kind='stable')
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class TokenIdCache:
+    """
+    WordPiece ids of every review, back to back in one flat uint16 array
+    plus offsets, memory-mapped so repeated scoring runs skip tokenization.
+    """
+
+    def __init__(self, path=cache_dir):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.ids = np.memmap(os.path.join(path, 'ids.bin'), dtype=np.uint16, mode='r')
+        self.offsets = np.fromfile(os.path.join(path, 'offsets.bin'), dtype=np.int64)
+        self.labels = np.fromfile(os.path.join(path, 'labels.bin'), dtype=np.int8)
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def sequences(self, rows):
+        return [self.ids[self.offsets[i]:self.offsets[i + 1]] for i in rows]
+
+    @staticmethod
+    def build(tokenizer, source=reviews_io.csv_file, path=cache_dir, chunksize=reviews_io.DEFAULT_CHUNKSIZE):
+        """
+        Tokenize the csv chunk by chunk. Labels are the category codes the
+        notebook trained on (sorted sentiment names).
+        """
+        classes = ['negative', 'neutral', 'positive']
+        os.makedirs(path, exist_ok=True)
+        offset = 0
+        with open(os.path.join(path, 'ids.bin'), 'wb') as ids_out, \
+                open(os.path.join(path, 'offsets.bin'), 'wb') as offsets_out, \
+                open(os.path.join(path, 'labels.bin'), 'wb') as labels_out:
+            offsets_out.write(np.zeros(1, dtype=np.int64).tobytes())
+            for chunk in reviews_io.iter_review_chunks(source, chunksize, ['cleaned_comments', 'sentiment']):
+                chunk = chunk.dropna()
+                sequences = encode(tokenizer, chunk['cleaned_comments'].astype(str))
+                lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+                ids_out.write(np.concatenate([np.asarray(s, dtype=np.uint16) for s in sequences]).tobytes()
+                              if sequences else b'')
+                offsets_out.write((offset + np.cumsum(lengths)).tobytes())
+                offset += int(lengths.sum())
+                labels = chunk['sentiment'].astype(str).map({label: i for i, label in enumerate(classes)})
+                labels_out.write(labels.fillna(-1).to_numpy(np.int8).tobytes())
+
+        meta = {'version': CACHE_VERSION, 'fingerprint': reviews_io.file_fingerprint(source),
+                'tokenizer': tokenizer.name_or_path, 'max_length': MAX_LENGTH}
+        # meta.json last, its presence marks a complete cache
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+        return TokenIdCache(path)
+
+    @staticmethod
+    def load_or_build(tokenizer, source=reviews_io.csv_file, path=cache_dir):
+        try:
+            cache = TokenIdCache(path)
+        except (OSError, ValueError):
+            cache = None
+        if (cache is None or cache.meta.get('version') != CACHE_VERSION
+                or cache.meta.get('tokenizer') != tokenizer.name_or_path
+                or cache.meta.get('max_length') != MAX_LENGTH
+                or cache.meta.get('fingerprint') != reviews_io.file_fingerprint(source)):
+            cache = TokenIdCache.build(tokenizer, source, path)
+        return cache
+
+
+class KerasBackend:
+    """The fine-tuned TFBertForSequenceClassification, unquantized."""
+
+    def __init__(self, path=model_dir):
+        from transformers import TFBertForSequenceClassification
+        self.model = TFBertForSequenceClassification.from_pretrained(path)
+
+    def logits(self, input_ids, attention_mask):
+        output = self.model(input_ids=input_ids, attention_mask=attention_mask, training=False)
+        return output.logits.numpy()
+
+
+class TFLiteBackend:
+    """
+    The int8 dynamic-range quantized export. TFLite interpreters are not
+    thread-safe, so every scoring thread gets its own.
+    """
+
+    def __init__(self, path=quantized_file):
+        self.path = path
+        self._local = threading.local()
+
+    def _runner(self):
+        runner = getattr(self._local, 'runner', None)
+        if runner is None:
+            import tensorflow as tf
+            interpreter = tf.lite.Interpreter(model_path=self.path, num_threads=1)
+            # the signature runner resizes its inputs to every batch shape
+            runner = interpreter.get_signature_runner()
+            self._local.runner = runner
+        return runner
+
+    def logits(self, input_ids, attention_mask):
+        return self._runner()(input_ids=input_ids, attention_mask=attention_mask)['logits']
+
+
+def export_quantized(path=model_dir, output=quantized_file):
+    """
+    Convert the fine-tuned model to TFLite with dynamic-range quantization:
+    weights stored as int8, activations quantized on the fly, for CPU-only
+    serving. Batch size and sequence length stay dynamic.
+    """
+    import tensorflow as tf
+    from transformers import TFBertForSequenceClassification
+
+    model = TFBertForSequenceClassification.from_pretrained(path)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int32, name='input_ids'),
+                                  tf.TensorSpec([None, None], tf.int32, name='attention_mask')])
+    def serve(input_ids, attention_mask):
+        return {'logits': model(input_ids=input_ids, attention_mask=attention_mask, training=False).logits}
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    flatbuffer = converter.convert()
+    tmp_file = output + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_file, output)
+    return len(flatbuffer)
+
+
+class StreamingScorer:
+    """
+    Scores an iterable of reviews with a pool of threads, yielding one
+    probability row per review in input order. Reviews are read a window at
+    a time, so memory stays bounded however long the input is; within a
+    window they are sorted by length and padded per batch.
+    """
+
+    def __init__(self, backend, tokenizer, batch_size=DEFAULT_BATCH_SIZE, n_threads=DEFAULT_THREADS):
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+
+    def _score_batch(self, sequences):
+        logits = self.backend.logits(*pad_batch(sequences, self.tokenizer.pad_token_id))
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def score_sequences(self, sequences, executor):
+        # probabilities for already tokenized sequences, in their order
+        lengths = np.array([len(sequence) for sequence in sequences])
+        batches = length_sorted_batches(lengths, self.batch_size)
+        futures = [executor.submit(self._score_batch, [sequences[i] for i in batch]) for batch in batches]
+        probabilities = None
+        for batch, future in zip(batches, futures):
+            result = future.result()
+            if probabilities is None:
+                probabilities = np.empty((len(sequences), result.shape[1]), dtype=np.float32)
+            probabilities[batch] = result
+        return probabilities
+
+    def score(self, texts):
+        window = self.batch_size * self.n_threads * WINDOW_BATCHES
+        texts = iter(texts)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            while True:
+                chunk = list(islice(texts, window))
+                if not chunk:
+                    break
+                yield from self.score_sequences(encode(self.tokenizer, chunk), executor)
+
+    def score_cache(self, cache, rows=None):
+        # probabilities for cached token ids, skipping tokenization entirely
+        rows = np.arange(len(cache)) if rows is None else np.asarray(rows)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            return self.score_sequences(cache.sequences(rows), executor)
+
+
+def held_out_rows(source=reviews_io.csv_file, chunksize=reviews_io.DEFAULT_CHUNKSIZE):
+    """
+    Cache rows of the notebook's test split. 4_LLM drops the csv rows
+    missing any column and holds out 20% of the rest with
+    train_test_split(test_size=0.2, random_state=42); the others were
+    trained on, so accuracy measured on them says little.
+    """
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    complete, cached = [], []
+    for chunk in pd.read_csv(source, chunksize=chunksize):
+        complete.append(chunk.notna().all(axis=1).to_numpy())
+        # the cache only drops rows missing one of these
+        cached.append(chunk[['cleaned_comments', 'sentiment']].notna().all(axis=1).to_numpy())
+    complete, cached = np.concatenate(complete), np.concatenate(cached)
+    _, test = train_test_split(np.flatnonzero(complete), test_size=0.2, random_state=42)
+    return (np.cumsum(cached) - 1)[test]
+
+
+def benchmark(cache, tokenizer, rows, batch_size=DEFAULT_BATCH_SIZE, n_threads=DEFAULT_THREADS):
+    """
+    reviews/sec and accuracy of: the notebook's fixed max_length padding,
+    dynamic padding with the float model, and dynamic padding with the int8
+    export, plus how often the int8 labels differ from the float ones.
+    rows should come from held_out_rows.
+    """
+    labels = cache.labels[rows]
+    keras = KerasBackend()
+    results = []
+
+    start = time.perf_counter()
+    fixed = []
+    for batch in range(0, len(rows), batch_size):
+        sequences = cache.sequences(rows[batch:batch + batch_size])
+        fixed.append(keras.logits(*pad_batch(sequences, tokenizer.pad_token_id, MAX_LENGTH)))
+    elapsed = time.perf_counter() - start
+    fixed = np.concatenate(fixed)
+    results.append({'path': 'float, padded to {}'.format(MAX_LENGTH), 'reviews_per_sec': len(rows) / elapsed,
+                    'accuracy': float((fixed.argmax(axis=1) == labels).mean())})
+
+    predictions = {}
+    for name, backend in (('float, dynamic padding', keras), ('int8, dynamic padding', TFLiteBackend())):
+        scorer = StreamingScorer(backend, tokenizer, batch_size, n_threads)
+        start = time.perf_counter()
+        predictions[name] = scorer.score_cache(cache, rows).argmax(axis=1)
+        elapsed = time.perf_counter() - start
+        results.append({'path': name, 'reviews_per_sec': len(rows) / elapsed,
+                        'accuracy': float((predictions[name] == labels).mean())})
+
+    disagreement = float((predictions['float, dynamic padding'] != predictions['int8, dynamic padding']).mean())
+    return results, disagreement
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CPU inference for the fine-tuned BERT classifier')
+    parser.add_argument('command', choices=['export', 'tokenize', 'score', 'benchmark'])
+    parser.add_argument('--source', default=reviews_io.csv_file)
+    parser.add_argument('--rows', type=int, default=2000, help='held-out reviews used by benchmark')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--output', default='Dataset/Cache/bert/predictions.npy')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        size = export_quantized()
+        print('wrote {} ({:.1f} MB)'.format(quantized_file, size / 2 ** 20))
+    else:
+        tokenizer = load_tokenizer()
+        cache = TokenIdCache.load_or_build(tokenizer, args.source)
+        print('{:,} reviews, mean {:.1f} tokens'.format(len(cache), cache.lengths.mean()))
+        if args.command == 'score':
+            scorer = StreamingScorer(TFLiteBackend(), tokenizer, args.batch_size, args.threads)
+            start = time.perf_counter()
+            probabilities = scorer.score_cache(cache)
+            np.save(args.output, probabilities)
+            print('scored {:,} reviews/sec into {}'.format(
+                int(len(cache) / (time.perf_counter() - start)), args.output))
+        elif args.command == 'benchmark':
+            # the held-out split is already shuffled, its head is a random sample
+            rows = held_out_rows(args.source)[:args.rows]
+            results, disagreement = benchmark(cache, tokenizer, rows, args.batch_size, args.threads)
+            for row in results:
+                print('{path:28} {reviews_per_sec:8.1f} reviews/sec  accuracy {accuracy:.4f}'.format(**row))
+            print('int8 labels differing from float: {:.2%}'.format(disagreement))
@@ -0,0 +1,250 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import model_export
+import reviews_io
+import text_cleaning
+
+# Batch scorer for large review dumps: the input is streamed in chunks,
+# each chunk is cleaned, vectorized and scored in a worker process, which
+# writes it as one parquet part. An interrupted run picks up where it
+# stopped, the chunks whose part already exists are skipped.
+
+models_dir = 'Models'
+
+DEFAULT_CHUNKSIZE = 50000
+DEFAULT_KEEP = ('id', 'listing_id', 'date')
+MANIFEST = '_manifest.json'  # leading underscore: pyarrow skips it when reading the directory
+STAGES = ('read', 'clean', 'vectorize', 'predict', 'write')
+
+# per worker process, set by _init_worker
+_worker = {}
+
+
+def model_path(model):
+    # a name from the Models/ directory (logistic_regression, ada_boost, ...) or a path
+    if os.path.exists(model):
+        return model
+    return os.path.join(models_dir, '{}_model.pkl'.format(model))
+
+
+def load_models(path):
+    # (vectorizer, model) for the model pickle at path. The pickled
+    # TfidfVectorizer, not model_export's memory-mapped one: its transform
+    # is several times faster, and throughput is what counts here
+    import joblib
+    return joblib.load(model_export.vectorizer_file), joblib.load(path)
+
+
+def iter_chunks(path, chunksize=DEFAULT_CHUNKSIZE, columns=None, encoding=None):
+    # csv through the explicit-dtype reader of reviews_io, parquet one record batch at a time
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        source = pq.ParquetFile(path)
+        columns = [col for col in source.schema_arrow.names if columns is None or col in columns]
+        for batch in source.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from reviews_io.iter_review_chunks(path, chunksize, columns, encoding=encoding)
+
+
+def part_file(output, index):
+    return os.path.join(output, 'part-{:06d}.parquet'.format(index))
+
+
+def _init_worker(path, clean):
+    _worker['models'] = load_models(path)
+    _worker['clean'] = clean
+
+
+def score_chunk(index, chunk, column, output, models, clean=True):
+    """
+    Clean, vectorize and score one chunk and write it to its part file.
+    Returns the seconds spent in each stage.
+    """
+    vectorizer, model = models
+    timings = {}
+
+    start = time.perf_counter()
+    texts = chunk[column].fillna('').astype(str)
+    if clean:
+        texts = text_cleaning.clean_series(texts)
+    timings['clean'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X = vectorizer.transform(texts)
+    timings['vectorize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scored = chunk.drop(columns=[column]).reset_index(drop=True)
+    classes = [str(label) for label in model.classes_]
+    if hasattr(model, 'predict_proba'):
+        # label is the most probable class, as in scoring_service
+        probabilities = model.predict_proba(X)
+        scored['label'] = np.asarray(classes, dtype=object)[probabilities.argmax(axis=1)]
+        for position, label in enumerate(classes):
+            scored['proba_' + label] = probabilities[:, position].astype(np.float32)
+    else:
+        scored['label'] = np.asarray(model.predict(X)).astype(str)
+    timings['predict'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    path = part_file(output, index)
+    # dot prefix: pyarrow skips half-written parts when reading the directory
+    tmp_path = os.path.join(output, '.' + os.path.basename(path) + '.tmp')
+    scored.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    timings['write'] = time.perf_counter() - start
+    return timings
+
+
+def _score_in_worker(args):
+    index, chunk, column, output = args
+    return len(chunk), score_chunk(index, chunk, column, output, _worker['models'], _worker['clean'])
+
+
+class StageStats:
+    """Rows and seconds per stage, summed over the chunks and workers."""
+
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.start = time.perf_counter()
+
+    def update(self, rows, timings):
+        self.rows += rows
+        for stage, seconds in timings.items():
+            self.seconds[stage] += seconds
+
+    def report(self):
+        # per-stage throughput is for one worker, the total is wall-clock
+        elapsed = time.perf_counter() - self.start
+        lines = ['{:,} rows scored in {:.1f}s ({:,.0f} rows/sec), {:,} rows already done, peak RSS {:.0f} MB'.format(
+            self.rows, elapsed, self.rows / elapsed if elapsed else 0.0, self.skipped, reviews_io.peak_rss_mb())]
+        for stage in STAGES:
+            seconds = self.seconds[stage]
+            # chunks that were already done are still read
+            rows = self.rows + self.skipped if stage == 'read' else self.rows
+            lines.append('  {:<10} {:>8.1f}s {:>12,.0f} rows/sec'.format(
+                stage, seconds, rows / seconds if seconds else 0.0))
+        return '\n'.join(lines)
+
+
+def _check_manifest(output, manifest, overwrite):
+    # the parts of an earlier run are reused only when they were made from
+    # the same input, model and chunking
+    path = os.path.join(output, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        previous.pop('complete', None)
+        if previous != manifest:
+            if not overwrite:
+                raise ValueError('{} holds the output of a different run, pass overwrite=True to replace it'
+                                 .format(output))
+            for stale in glob.glob(os.path.join(output, 'part-*.parquet')):
+                os.remove(stale)
+    for stale in glob.glob(os.path.join(output, '.part-*.tmp')):
+        os.remove(stale)
+    _write_manifest(output, manifest)
+
+
+def _write_manifest(output, manifest):
+    tmp_file = os.path.join(output, MANIFEST + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_file, os.path.join(output, MANIFEST))
+
+
+def bulk_score(source, output, model='logistic_regression', column='comments', keep=DEFAULT_KEEP,
+               clean=True, n_jobs=None, chunksize=DEFAULT_CHUNKSIZE, overwrite=False, progress=None, encoding=None):
+    """
+    Score every review of source (csv or parquet) with model and write
+    the kept columns plus label and proba_<class> columns to a directory
+    of parquet parts under output. Rerunning after an interruption only
+    scores the chunks that have no part yet. Returns the StageStats.
+    """
+    path = model_path(model)
+    os.makedirs(output, exist_ok=True)
+    manifest = {
+        'source': os.path.abspath(source),
+        'source_fingerprint': reviews_io.file_fingerprint(source),
+        'model': os.path.abspath(path),
+        'model_fingerprint': reviews_io.file_fingerprint(path),
+        'vectorizer_fingerprint': reviews_io.file_fingerprint(model_export.vectorizer_file),
+        'column': column,
+        'keep': list(keep),
+        'clean': clean,
+        'chunksize': chunksize,
+    }
+    _check_manifest(output, manifest, overwrite)
+
+    stats = StageStats()
+
+    def pending_chunks():
+        # skipped chunks are still parsed, but never cleaned or scored
+        chunks = iter_chunks(source, chunksize, [column] + list(keep), encoding)
+        index = 0
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            stats.seconds['read'] += time.perf_counter() - start
+            if chunk is None:
+                return
+            if os.path.exists(part_file(output, index)):
+                stats.skipped += len(chunk)
+            else:
+                yield index, chunk, column, output
+            index += 1
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    executor = None
+    if n_jobs == 1:
+        models = load_models(path)
+        results = ((len(chunk), score_chunk(index, chunk, column, output, models, clean))
+                   for index, chunk, column, output in pending_chunks())
+    else:
+        executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(path, clean))
+        results = reviews_io.bounded_imap(executor, _score_in_worker, pending_chunks(), 2 * n_jobs)
+
+    try:
+        for done, (rows, timings) in enumerate(results, 1):
+            stats.update(rows, timings)
+            if progress and done % progress == 0:
+                print('{:,} rows, {:,.0f} rows/sec'.format(stats.rows, stats.rows / (time.perf_counter() - stats.start)))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    _write_manifest(output, dict(manifest, complete=True))
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score a large review file with one of the saved models')
+    parser.add_argument('source', help='csv or parquet file of reviews')
+    parser.add_argument('output', help='directory of parquet parts, read back with pd.read_parquet(output)')
+    parser.add_argument('--model', default='logistic_regression',
+                        help='name of a model in Models/ (logistic_regression, ada_boost, ...) or a path')
+    parser.add_argument('--column', default='comments', help='text column to score')
+    parser.add_argument('--keep', nargs='*', default=list(DEFAULT_KEEP), help='columns copied to the output')
+    parser.add_argument('--no-clean', dest='clean', action='store_false',
+                        help='the column is already cleaned (e.g. cleaned_comments)')
+    parser.add_argument('--encoding', help='csv encoding, latin1 for the raw Airbnb dump')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--overwrite', action='store_true', help='replace the output of a different run')
+    parser.add_argument('--progress', type=int, default=10, help='print progress every N chunks')
+    args = parser.parse_args()
+
+    stats = bulk_score(args.source, args.output, args.model, args.column, args.keep, args.clean,
+                       args.jobs, args.chunksize, args.overwrite, args.progress, args.encoding)
+    print(stats.report())
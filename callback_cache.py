@@ -0,0 +1,144 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+DEFAULT_TTL = 600
+DEFAULT_MAX_ENTRIES = 256
+
+
+class LRUBackend:
+    """In-process store, least recently used entries are dropped first."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """
+    Pickled entries in a SQLite file, shared by every worker process that
+    points at the same path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def _connection(self):
+        # one connection per thread
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return False, None
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                       (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + ttl))
+            db.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+
+    def clear(self):
+        with self._connection() as db:
+            db.execute('DELETE FROM cache')
+
+
+def backend_from_env():
+    # CALLBACK_CACHE_DB=<path> shares the cache across workers through SQLite
+    path = os.environ.get('CALLBACK_CACHE_DB')
+    return SQLiteBackend(path) if path else LRUBackend()
+
+
+class CallbackCache:
+    """
+    Memoizes Dash callbacks on their inputs plus a data version, so a new
+    dataset never serves figures computed from the old one. version is a
+    string or a callable returning one.
+    """
+
+    def __init__(self, backend=None, version='', default_ttl=DEFAULT_TTL):
+        self.backend = backend if backend is not None else backend_from_env()
+        self.version = version
+        self.default_ttl = default_ttl
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def data_version(self):
+        return self.version() if callable(self.version) else self.version
+
+    def key(self, name, args, kwargs):
+        payload = json.dumps([name, self.data_version(), args, kwargs], sort_keys=True, default=repr)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def memoize(self, ttl=None, name=None):
+        def decorator(func):
+            func_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = self.key(func_name, args, kwargs)
+                found, value = self.backend.get(key)
+                if found:
+                    self.hits[func_name] += 1
+                    return value
+                self.misses[func_name] += 1
+                value = func(*args, **kwargs)
+                self.backend.set(key, value, self.default_ttl if ttl is None else ttl)
+                return value
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        # hit/miss counters per callback, for this process
+        return {name: {'hits': self.hits[name], 'misses': self.misses[name]}
+                for name in sorted(set(self.hits) | set(self.misses))}
+
+    def register_stats_route(self, server, route='/cache-stats'):
+        # expose the counters as JSON on the Flask server behind a Dash app
+        server.add_url_rule(route, 'callback_cache_stats', lambda: self.stats())
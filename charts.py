@@ -1,22 +1,34 @@
-import re
-import string
+import base64
+import json
 
+import numpy as np
 import plotly.express as px           # ← you still need this for px.bar & px.line
 import plotly.graph_objects as go
+import plotly.io as pio
 import pandas as pd
 
-from nltk.corpus import stopwords
-
-# one-time load of English stopwords
-STOPWORDS = set(stopwords.words('english'))
+import metrics
+import time_buckets
+import word_index
 
 
 # import datetime
 
+# callback payloads (compact_figure): line traces longer than MAX_POINTS are
+# decimated, floats keep FLOAT_DIGITS decimals
+MAX_POINTS = 1000
+FLOAT_DIGITS = 4
+
 
 def create_graph(df):
     # print the frequency of each review by the top 5 reviewers
-    df_top5 = df['reviewer_name'].value_counts().head(5)
+    return create_graph_from_counts(df['reviewer_name'].value_counts())
+
+
+@metrics.chart
+def create_graph_from_counts(reviewer_counts):
+    # same chart as create_graph, built from precomputed reviewer counts
+    df_top5 = reviewer_counts.head(5)
 
     # create the bar chart
     fig = px.bar(df_top5, x=df_top5.index, y=df_top5.values,
@@ -42,7 +54,13 @@ def create_graph(df):
 
 def create_graph2(df):
     # print the frequency of each review by the top 5 reviewers
-    df_top5 = df['reviewer_name'].value_counts().head(5)
+    return create_graph2_from_counts(df['reviewer_name'].value_counts())
+
+
+@metrics.chart
+def create_graph2_from_counts(reviewer_counts):
+    # same chart as create_graph2, built from precomputed reviewer counts
+    df_top5 = reviewer_counts.head(5)
 
     # make a bar graph showing the top 5 reviewers and their positive, negative and neutral reviews
     # choose diiferent shaeds of red
@@ -73,31 +91,35 @@ def create_graph2(df):
     return fig
 
 
+def top_words(df, n=100):
+    """
+    Count the n most frequent non-stopword words in df['cleaned_comments'].
+    Returns a Series indexed by word, n=None keeps every word.
+    """
+    # lowercase, strip punctuation, drop stopwords and count in one pass
+    index = word_index.WordIndex()
+    index.add_reviews(df['cleaned_comments'])
+    return index.top(n)
+
+
 def wordcloud(df):
     """
     Build a treemap of the top 100 words in df['cleaned_comments'] 
     using go.Treemap to avoid the Plotly-Express hierarchy bug.
     """
-    # 1) lowercase, drop nulls, strip punctuation
-    texts = (
-        df['cleaned_comments']
-          .dropna()
-          .astype(str)
-          .str.lower()
-          .str.replace(f"[{re.escape(string.punctuation)}]", " ", regex=True)
-    )
+    return wordcloud_from_counts(top_words(df, 100))
 
-    # 2) split into words & explode
-    words = texts.str.split().explode()
 
-    # 3) filter stopwords
-    words = words[~words.isin(STOPWORDS)]
-
-    # 4) count & take top 100
-    top = words.value_counts().nlargest(100).reset_index()
+@metrics.chart
+def wordcloud_from_counts(word_counts):
+    """
+    Build the common-words treemap from a Series of word counts
+    (e.g. the output of top_words or a precomputed aggregate).
+    """
+    top = word_counts.nlargest(100).reset_index()
     top.columns = ['word', 'count']
 
-    # 5) build a go.Treemap
+    # build a go.Treemap
     fig = go.Figure(
         go.Treemap(
             labels=top['word'],
@@ -118,6 +140,7 @@ def wordcloud(df):
     return fig
 
 
+@metrics.chart
 def circle(df):
     # use plotly to make a circular graph shwing the positive, negative and neutral reviews
     # not a pie chart but a circular graph which is more visually appealing and is hollow in the middle
@@ -133,6 +156,7 @@ def circle(df):
     return fig
 
 
+@metrics.chart
 def bubble(df):
     # use plotly to make a bubble graph showing the positive, negative and neutral reviews
     # not a pie chart but a circular graph which is more visually appealing and is hollow in the middle
@@ -158,6 +182,7 @@ def bubble(df):
     return fig
 
 
+@metrics.chart
 def polar_area(df):
     # use plotly to make a polar area graph showing the positive, negative and neutral reviews
     # not a pie chart but a circular graph which is more visually appealing and is hollow in the middle
@@ -177,22 +202,17 @@ def polar_area(df):
     return fig
 
 
-def time_series(df):
-    # formate the date column in the dataset is 2016-08-20
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
-
-    # create a new column with the year and month
-    df['year_month'] = df['date'].dt.strftime('%Y-%m')
-
-    # create a new column with the year
-    df['year'] = df['date'].dt.strftime('%Y')
+def time_series(df, granularity='month'):
+    # time series graph showing the number of reviews per month
+    # dates are parsed and bucketed once, the caller's DataFrame is left untouched
+    return time_series_from_counts(time_buckets.bucket_counts(df, granularity)['total'])
 
-    # create a new column with the month
-    df['month'] = df['date'].dt.strftime('%m')
 
-    # time series graph showing the number of reviews per month
-    # group the data by year and month
-    df_time = df.groupby(['year_month']).size().reset_index(name='counts')
+@metrics.chart
+def time_series_from_counts(counts):
+    # same chart as time_series, built from review counts indexed by time bucket
+    df_time = pd.DataFrame({'year_month': time_buckets.bucket_labels(counts.index),
+                            'counts': counts.values})
 
     # create the line graph
     fig = px.line(df_time, x='year_month', y='counts')
@@ -208,19 +228,14 @@ def time_series(df):
     return fig
 
 
-def time_sentiment(df):
-    # formate the date column in the dataset is 2016-08-20
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
+def time_sentiment(df, granularity='month'):
+    # count the reviews per month for each sentiment in a single pass
+    return time_sentiment_from_counts(time_buckets.bucket_counts(df, granularity))
 
-    # create a new column with the year and month
-    df['year_month'] = df['date'].dt.strftime('%Y-%m')
-
-    # create a new column with the year
-    df['year'] = df['date'].dt.strftime('%Y')
-
-    # create a new column with the month
-    df['month'] = df['date'].dt.strftime('%m')
 
+@metrics.chart
+def time_sentiment_from_counts(bucket_sentiment):
+    # same chart as time_sentiment, built from a time bucket x sentiment count table
     # plot the time series graph showing the number of positive, negative and neutral reviews per month
     sentiments = ['positive', 'negative', 'neutral']
 
@@ -228,9 +243,12 @@ def time_sentiment(df):
     fig = go.Figure()
 
     for sentiment in sentiments:
-        df_time = df[df['sentiment'] == sentiment].groupby(
-            ['year_month']).size().reset_index(name='counts')
-        fig.add_trace(go.Scatter(x=df_time['year_month'], y=df_time['counts'],
+        if sentiment not in bucket_sentiment:
+            continue
+        # only plot the buckets that have reviews with this sentiment
+        counts = bucket_sentiment[sentiment]
+        counts = counts[counts > 0]
+        fig.add_trace(go.Scatter(x=time_buckets.bucket_labels(counts.index), y=counts.values,
                                  mode='lines+markers', name=sentiment))
 
     # update the layout
@@ -242,3 +260,61 @@ def time_sentiment(df):
     )
 
     return fig
+
+
+def _plain(value, digits):
+    # JSON value with plotly's base64 typed arrays decoded and floats rounded
+    if isinstance(value, dict):
+        if 'bdata' in value and 'dtype' in value:
+            array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+            if 'shape' in value:
+                array = array.reshape([int(n) for n in str(value['shape']).split(',')])
+            return _plain(array.tolist(), digits)
+        return {key: _plain(item, digits) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item, digits) for item in value]
+    if isinstance(value, float):
+        value = round(value, digits)
+        return int(value) if value.is_integer() else value
+    return value
+
+
+def _decimate(trace, max_points):
+    """
+    Min/max decimation of a line trace: the points are cut into
+    max_points / 2 buckets and only the lowest and highest of each bucket
+    are kept, so peaks and dips survive.
+    """
+    y = trace.get('y')
+    if not isinstance(y, list) or len(y) <= max_points:
+        return trace
+    values = pd.to_numeric(pd.Series(y), errors='coerce').fillna(0).to_numpy()
+    edges = np.linspace(0, len(values), max_points // 2 + 1).astype(int)
+    keep = set()
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            keep.add(start + int(values[start:end].argmin()))
+            keep.add(start + int(values[start:end].argmax()))
+    keep = sorted(keep)
+
+    # every per-point array is thinned the same way
+    for attrs in (trace, trace.get('marker') or {}):
+        for key, value in attrs.items():
+            if isinstance(value, list) and len(value) == len(y):
+                attrs[key] = [value[i] for i in keep]
+    return trace
+
+
+def compact_figure(fig, max_points=MAX_POINTS, digits=FLOAT_DIGITS):
+    """
+    A figure as a plain JSON dict, trimmed for callback responses: typed
+    arrays become lists, floats are rounded to digits decimals and line
+    traces longer than max_points are decimated.
+
+    Not a chart builder, so not timed as one: its cost is part of the
+    callback that serves the figure.
+    """
+    figure = _plain(json.loads(pio.to_json(fig, validate=False)), digits)
+    figure['data'] = [_decimate(trace, max_points) if trace.get('type', 'scatter') in ('scatter', 'scattergl')
+                      else trace for trace in figure.get('data', [])]
+    return figure
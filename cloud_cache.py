@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from wordcloud import WordCloud
+
+cache_dir = 'Dataset/Cache/wordclouds'
+
+DEFAULT_MAX_ENTRIES = 64
+
+
+class CloudCache:
+    """
+    Rendered word-cloud PNGs keyed by (sentiment, dataset version). Images
+    are built from precomputed word frequencies, kept in a small in-memory
+    LRU and on disk, where the least recently used files are evicted once
+    there are more than max_entries of them.
+    """
+
+    def __init__(self, path=cache_dir, max_entries=DEFAULT_MAX_ENTRIES, max_words=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_words = max_words
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, sentiment, version):
+        key = hashlib.sha1('{}|{}|{}'.format(sentiment, version, self.max_words).encode()).hexdigest()
+        return os.path.join(self.path, key + '.png')
+
+    def render(self, frequencies):
+        # frequencies is a Series or dict of word -> count
+        wordcloud = WordCloud(max_words=self.max_words, background_color="white")
+        wordcloud.generate_from_frequencies(dict(frequencies))
+        img_buffer = BytesIO()
+        wordcloud.to_image().save(img_buffer, format='PNG')
+        return img_buffer.getvalue()
+
+    def get(self, sentiment, version, frequencies):
+        """
+        Base64 encoded PNG for this sentiment and dataset version. The
+        frequencies are only rendered on a cache miss.
+        """
+        file = self._file(sentiment, version)
+        with self._lock:
+            if file in self._memory:
+                self._memory.move_to_end(file)
+                return self._memory[file]
+
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                png = f.read()
+            # touch the file so eviction sees it as recently used
+            os.utime(file)
+        else:
+            png = self.render(frequencies)
+            tmp_file = '{}.{}.tmp'.format(file, threading.get_ident())
+            with open(tmp_file, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_file, file)
+            self._evict()
+
+        encoded = base64.b64encode(png).decode()
+        with self._lock:
+            self._memory[file] = encoded
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return encoded
+
+    def _evict(self):
+        # drop the least recently used files beyond max_entries
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.png')]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda file: os.path.getmtime(file))
+        for file in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
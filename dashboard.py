@@ -1,14 +1,18 @@
 import os
-import joblib
-import pandas as pd
 import plotly.graph_objs as go
 from dash import Dash, html, dcc, callback, Input, Output, State
-from wordcloud import WordCloud
-import base64
-from io import BytesIO
-import matplotlib.pyplot as plt
 import dash
 
+import callback_cache
+import metrics
+import review_store
+import startup
+
+# heavy dependencies (pandas, sklearn, wordcloud, matplotlib) and the data
+# are imported and loaded by the warm-up thread below or on first use, so
+# the server answers /ready as soon as this module is imported.
+# `python startup.py dashboard` prints the import-time and phase profile.
+
 
 # Initialize Dash app
 app = Dash(__name__, suppress_callback_exceptions=True)
@@ -16,23 +20,83 @@ app = Dash(__name__, suppress_callback_exceptions=True)
 
 # Load Data
 def load_data():
-    df_cleaned = pd.read_csv('Dataset/Cleaned Data/reviews.csv', nrows=100000)
+    # the charts are drawn from aggregates folded over the whole csv in
+    # fixed-size chunks, only the preview tables read raw rows
+    import pandas as pd
+    import aggregates
+    import word_index
+    aggs = aggregates.load_or_build('Dataset/Cleaned Data/reviews.csv')
+    word_idx = word_index.load_or_build('Dataset/Cleaned Data/reviews.csv')
+    df_cleaned = pd.read_csv('Dataset/Cleaned Data/reviews.csv', nrows=1000)
     df_uncleaned = pd.read_csv(
-        'Dataset/Uncleaned Data/clean_reviews.csv', nrows=100000)
-    return df_cleaned.drop_duplicates().dropna(), df_uncleaned
+        'Dataset/Uncleaned Data/clean_reviews.csv', nrows=10)
+    return aggs, word_idx, df_cleaned.drop_duplicates().dropna(), df_uncleaned
 
 # Load Models
 
 
 def load_models():
-    tfidf_vectorizer = joblib.load('Models/tfidf_vectorizer.pkl')
-    logistic_regression_model = joblib.load(
-        'Models/logistic_regression_model.pkl')
-    return tfidf_vectorizer, logistic_regression_model
-
-
-df_cleaned, df_uncleaned = load_data()
-tfidf_vectorizer, logistic_regression_model = load_models()
+    # memory-mapped export of the pickled vectorizer and model, shared by
+    # forked workers (rebuilt by model_export when the pickles change).
+    # once `python online_learning.py watch` has written a checkpoint, new
+    # reviews are scored by the incrementally trained model, reloaded
+    # whenever the checkpoint changes
+    import model_export
+    import online_learning
+    tfidf_vectorizer, logistic_regression_model = model_export.load_models()
+    return tfidf_vectorizer, logistic_regression_model, online_learning.ModelWatcher()
+
+
+# rendered word clouds are cached per sentiment and dataset version, and
+# rendered in the background at startup
+SENTIMENTS = ['positive', 'negative', 'neutral']
+
+
+def load_wordclouds():
+    import cloud_cache
+    word_idx = warmup.get('data')[1]
+    wordclouds = cloud_cache.CloudCache()
+    for sentiment in SENTIMENTS:
+        frequencies = word_idx.top(100, sentiment)
+        if len(frequencies):
+            wordclouds.get(sentiment, word_idx.data_version, frequencies)
+    return wordclouds
+
+
+def load_search_index():
+    # full-text index over the reviews, `python search_index.py watch`
+    # appends the submitted reviews to it
+    import search_index
+    return search_index.load_or_build('Dataset/Cleaned Data/reviews.csv')
+
+
+# the pages only need the data to be ready, models, word clouds and the
+# search index keep loading behind it; /ready and /startup-profile report
+# the progress
+warmup = startup.Warmup()
+warmup.add('data', load_data)
+warmup.add('models', load_models, required=False)
+# submitted reviews are batched into SQLite transactions (WAL mode), safe
+# with several workers appending at once. Opened by the warm-up, not on import
+warmup.add('review_writer', review_store.ReviewWriter, required=False)
+warmup.add('wordclouds', load_wordclouds, required=False)
+warmup.add('search', load_search_index, required=False)
+warmup.register_routes(app.server)
+warmup.start()
+
+
+def data_version():
+    aggs, word_idx = warmup.get('data')[:2]
+    return '{}|{}'.format(aggs['fingerprint'], word_idx.data_version)
+
+
+# callback results are memoized on their inputs and the dataset version,
+# hit/miss counters are served at /cache-stats
+callbacks = callback_cache.CallbackCache(version=data_version)
+callbacks.register_stats_route(app.server)
+
+# callback, chart and model-stage latencies in Prometheus format at /metrics
+metrics.register_route(app.server)
 
 # Define the app layout with a sidebar
 app.layout = html.Div([
@@ -51,6 +115,8 @@ app.layout = html.Div([
                         id='sentimental-button', n_clicks=0, style={'width': '90%', 'margin': '5px'}),
             html.Button('Provide Review', id='review-button', n_clicks=0, style={
                         'width': '90%', 'margin': '5px'}),
+            html.Button('Search Reviews', id='search-button', n_clicks=0, style={
+                        'width': '90%', 'margin': '5px'}),
         ]
     ),
     html.Div(
@@ -66,88 +132,108 @@ app.layout = html.Div([
                Input('uncleaned-button', 'n_clicks'),
                Input('cleaned-button', 'n_clicks'),
                Input('sentimental-button', 'n_clicks'),
-               Input('review-button', 'n_clicks')])
-def display_page(home_clicks, uncleaned_clicks, cleaned_clicks, sentimental_clicks, review_clicks):
+               Input('review-button', 'n_clicks'),
+               Input('search-button', 'n_clicks')])
+@metrics.callback()
+def display_page(home_clicks, uncleaned_clicks, cleaned_clicks, sentimental_clicks, review_clicks, search_clicks):
     ctx = dash.callback_context
 
     if not ctx.triggered:
+        button_id = 'home-button'
+    else:
+        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
+
+    return render_page(button_id)
+
+
+# not memoized: the cache key includes the data version, which would hold
+# the static pages back until the data has loaded
+def render_page(button_id):
+    if button_id == 'home-button':
         return html.Div([
             html.H3('Welcome to the Home page.')
         ])
-    else:
-        button_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    elif button_id == 'uncleaned-button':
+        df_uncleaned = warmup.get('data')[3]
+        return html.Div([
+            html.H3('Uncleaned Data'),
+            dcc.Graph(figure=generate_table(df_uncleaned.head(10)))
+        ])
+    elif button_id == 'cleaned-button':
+        df_cleaned = warmup.get('data')[2]
+        return html.Div([
+            html.H3('Cleaned Data'),
+            dcc.Graph(figure=generate_table(df_cleaned.head(10)))
+        ])
+    elif button_id == 'sentimental-button':
+        return html.Div([
+            html.H3('Sentimental Analysis'),
+            dcc.Dropdown(id='visualization-choices',
+                         options=[{'label': 'Sentiment Analysis Pie Chart', 'value': 'pie'},
+                                  {'label': 'Word Cloud', 'value': 'cloud'},
+                                  {'label': 'Sentiment Analysis Bar Chart',
+                                      'value': 'bar'}
+                                  ],
+                         value='pie'),
+            html.Div(id='visualization-output')
+        ])
+    elif button_id == 'review-button':
+        return html.Div([
+            html.H3('Provide Review'),
+            dcc.Input(id='name-input', type='text',
+                      placeholder='Enter your name', style={'margin': '10px'}),
 
-        if button_id == 'home-button':
-            return html.Div([
-                html.H3('Welcome to the Home page.')
-            ])
-        elif button_id == 'uncleaned-button':
-            return html.Div([
-                html.H3('Uncleaned Data'),
-                dcc.Graph(figure=generate_table(df_uncleaned.head(10)))
-            ])
-        elif button_id == 'cleaned-button':
-            return html.Div([
-                html.H3('Cleaned Data'),
-                dcc.Graph(figure=generate_table(df_cleaned.head(10)))
-            ])
-        elif button_id == 'sentimental-button':
-            return html.Div([
-                html.H3('Sentimental Analysis'),
-                dcc.Dropdown(id='visualization-choices',
-                             options=[{'label': 'Sentiment Analysis Pie Chart', 'value': 'pie'},
-                                      {'label': 'Word Cloud', 'value': 'cloud'},
-                                      {'label': 'Sentiment Analysis Bar Chart',
-                                          'value': 'bar'}
-                                      ],
-                             value='pie'),
-                html.Div(id='visualization-output')
-            ])
-        elif button_id == 'review-button':
-            return html.Div([
-                html.H3('Provide Review'),
-                dcc.Input(id='name-input', type='text',
-                          placeholder='Enter your name', style={'margin': '10px'}),
+            html.Br(),
+            html.Br(),
 
-                html.Br(),
-                html.Br(),
+            dcc.Textarea(id='review-input',
+                         placeholder='Enter your review', style={'width': '50%', 'height': '200px'}),
 
-                dcc.Textarea(id='review-input',
-                             placeholder='Enter your review', style={'width': '50%', 'height': '200px'}),
+            # optional: the online model only learns from reviews rated here
+            dcc.RadioItems(id='rating-input', options=SENTIMENTS, inline=True, style={'margin': '10px'}),
 
-                html.Br(),
-                html.Br(),
+            html.Br(),
 
-                html.Button('Submit', id='submit-review', n_clicks=0),
-                html.Div(id='review-output'),
-                html.Br()
+            html.Button('Submit', id='submit-review', n_clicks=0),
+            html.Div(id='review-output'),
+            html.Br()
 
-            ])
+        ])
+    elif button_id == 'search-button':
+        return html.Div([
+            html.H3('Search Reviews'),
+            dcc.Input(id='search-input', type='search', debounce=True,
+                      placeholder='Search the reviews, e.g. bedbugs noise', style={'width': '50%', 'margin': '10px'}),
+            dcc.Checklist(id='search-sentiment', options=SENTIMENTS, value=SENTIMENTS, inline=True,
+                          style={'margin': '10px'}),
+            dcc.DatePickerRange(id='search-dates', clearable=True, display_format='YYYY-MM-DD'),
+            html.Div(id='search-output')
+        ])
 
 # Callback for Sentimental Analysis Visualization
 
 
 @app.callback(Output('visualization-output', 'children'),
               [Input('visualization-choices', 'value')])
+@metrics.callback()
+@callbacks.memoize()
 def update_visualization(choice):
+    aggs, word_idx = warmup.get('data')[:2]
     if choice == 'pie':
-        sentiment_counts = df_cleaned['sentiment'].value_counts()
+        sentiment_counts = aggs['sentiment_counts']
         fig = go.Figure(
             data=[go.Pie(labels=sentiment_counts.index, values=sentiment_counts)])
         return dcc.Graph(figure=fig)
     elif choice == 'cloud':
-        sentiments = ['positive', 'negative', 'neutral']
         images_with_captions = []
+        wordclouds = warmup.get('wordclouds')
 
-        for sentiment in sentiments:
-            text = " ".join(
-                review for review in df_cleaned[df_cleaned['sentiment'] == sentiment]['cleaned_comments'])
-            wordcloud = WordCloud(
-                max_words=100, background_color="white").generate(text)
-
-            img_buffer = BytesIO()
-            wordcloud.to_image().save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
+        for sentiment in SENTIMENTS:
+            # top-n lookup in the precomputed word index
+            frequencies = word_idx.top(100, sentiment)
+            if frequencies.empty:
+                continue
+            img_str = wordclouds.get(sentiment, word_idx.data_version, frequencies)
 
             # Create a label for the word cloud
             caption = html.P(f"Word Cloud for {sentiment.capitalize()} Sentiment", style={
@@ -165,7 +251,7 @@ def update_visualization(choice):
         return images_with_captions
 
     elif choice == 'bar':
-        sentiment_counts = df_cleaned['sentiment'].value_counts()
+        sentiment_counts = aggs['sentiment_counts']
         fig = go.Figure(
             data=[go.Bar(x=sentiment_counts.index, y=sentiment_counts)])
         return dcc.Graph(figure=fig)
@@ -175,19 +261,62 @@ def update_visualization(choice):
 @app.callback(Output('review-output', 'children'),
               [Input('submit-review', 'n_clicks')],
               [State('name-input', 'value'),
-               State('review-input', 'value')])
-def submit_review(n_clicks, name, review):
+               State('review-input', 'value'),
+               State('rating-input', 'value')])
+@metrics.callback()
+def submit_review(n_clicks, name, review, rating):
     if n_clicks > 0:
-        sentiment = logistic_regression_model.predict(
-            tfidf_vectorizer.transform([review]))
-        # Save review to CSV
-        df = pd.DataFrame({'name': [name], 'review': [
-                          review], 'sentiment': [sentiment[0]]})
-        df.to_csv('Dataset/User Review/User_reviews.csv',
-                  mode='a', header=False, index=False)
+        import text_cleaning
+        tfidf_vectorizer, logistic_regression_model, online_models = warmup.get('models')
+        vectorizer, model = online_models.get() or (tfidf_vectorizer, logistic_regression_model)
+        # the models are trained on cleaned text
+        with metrics.stage(model, 'clean'):
+            cleaned = text_cleaning.clean_text(review or '')
+        with metrics.stage(model, 'transform'):
+            features = vectorizer.transform([cleaned])
+        with metrics.stage(model, 'predict'):
+            sentiment = model.predict(features)
+        # Save review to the store, returns once it has been committed. The
+        # prediction is kept apart from the reviewer's own rating, which is
+        # the only label the online model trains on
+        warmup.get('review_writer').submit(name, review, str(sentiment[0]), rating)
         return f'Thank you for your review'
 
 
+# Callback for Search Reviews
+SEARCH_RESULTS = 20
+
+
+@app.callback(Output('search-output', 'children'),
+              [Input('search-input', 'value'),
+               Input('search-sentiment', 'value'),
+               Input('search-dates', 'start_date'),
+               Input('search-dates', 'end_date')])
+@metrics.callback()
+def search_reviews(query, sentiments, start_date, end_date):
+    if not query:
+        return None
+    import text_cleaning
+    # picks up the segments the watcher has appended since the last search
+    index = warmup.get('search').refresh()
+    with metrics.stage('bm25', 'search'):
+        results = index.search(query, SEARCH_RESULTS, None if set(sentiments) >= set(SENTIMENTS) else sentiments,
+                               start_date, end_date)
+    if results.empty:
+        return html.P('No reviews match "{}"'.format(query))
+
+    # the matches are scored by the same model as the submitted reviews
+    tfidf_vectorizer, logistic_regression_model, online_models = warmup.get('models')
+    vectorizer, model = online_models.get() or (tfidf_vectorizer, logistic_regression_model)
+    with metrics.stage(model, 'clean', len(results)):
+        cleaned = text_cleaning.clean_series(results['comments'].fillna('').astype(str))
+    with metrics.stage(model, 'transform', len(results)):
+        features = vectorizer.transform(cleaned)
+    with metrics.stage(model, 'predict', len(results)):
+        results.insert(4, 'predicted', model.predict(features))
+    return dcc.Graph(figure=generate_table(results))
+
+
 # Helper function to generate table
 def generate_table(dataframe):
     return go.Figure(data=[go.Table(
@@ -202,6 +331,9 @@ def generate_table(dataframe):
 
 # Helper function to generate word cloud image
 def plot_wordcloud(text):
+    from wordcloud import WordCloud
+    import matplotlib.pyplot as plt
+
     wordcloud = WordCloud(width=800, height=800,
                           background_color='white',
                           min_font_size=10).generate(text)
@@ -0,0 +1,106 @@
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from werkzeug.serving import make_server
+
+import scoring_service
+
+SAMPLE_REVIEWS = [
+    'The place was amazing and the host was very friendly',
+    'Dirty room, noisy street and the host never answered',
+    'It was ok, nothing special but the location is good',
+    'Great view, clean kitchen, would definitely stay again',
+]
+
+
+def post(url, payload):
+    data = json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def run_load(base_url, reviews, requests, concurrency, batch=0):
+    """
+    Fire `requests` calls at the service from `concurrency` client threads.
+    batch=0 sends single reviews to /predict, otherwise each call sends
+    `batch` reviews to /predict/batch.
+    """
+    def one_call(i):
+        start = time.perf_counter()
+        if batch:
+            chunk = [reviews[(i * batch + j) % len(reviews)] for j in range(batch)]
+            post(base_url + '/predict/batch', {'reviews': chunk})
+        else:
+            post(base_url + '/predict', {'review': reviews[i % len(reviews)]})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.array(list(pool.map(one_call, range(requests))))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'requests_per_sec': requests / elapsed,
+        'reviews_per_sec': requests * max(batch, 1) / elapsed,
+    }
+
+
+def serve(scorer, max_batch_size, max_wait_ms):
+    # run the service in a background thread on a free port
+    app = scoring_service.create_app(scorer, max_batch_size, max_wait_ms)
+    # keep werkzeug's per-request access log out of the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test for scoring_service.py')
+    parser.add_argument('--url', help='test an already running service instead of starting one per setting')
+    parser.add_argument('--csv', help='take review texts from this csv (comments column)')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--batch-sizes', default='1,8,32,128',
+                        help='max micro-batch sizes to try')
+    parser.add_argument('--wait-ms', default='0,5,20',
+                        help='max micro-batch wait times to try')
+    parser.add_argument('--client-batch', type=int, default=0,
+                        help='reviews per /predict/batch call, 0 tests /predict')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    reviews = SAMPLE_REVIEWS
+    if args.csv:
+        reviews = pd.read_csv(args.csv, usecols=['comments'], nrows=10000)['comments'].dropna().astype(str).tolist()
+
+    rows = []
+    if args.url:
+        result = run_load(args.url.rstrip('/'), reviews, args.requests, args.concurrency, args.client_batch)
+        rows.append(dict(max_batch_size='-', max_wait_ms='-', **result))
+    else:
+        scorer = scoring_service.Scorer(*scoring_service.load_models())
+        for max_batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            for max_wait_ms in [float(wait) for wait in args.wait_ms.split(',')]:
+                server, app = serve(scorer, max_batch_size, max_wait_ms)
+                base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+                try:
+                    result = run_load(base_url, reviews, args.requests, args.concurrency, args.client_batch)
+                finally:
+                    server.shutdown()
+                    app.config['batcher'].close()
+                rows.append(dict(max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, **result))
+
+    print(pd.DataFrame(rows).round(2).to_string(index=False))
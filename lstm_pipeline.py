@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+import reviews_io
+
+cache_dir = 'Dataset/Cache/lstm'
+model_file = 'Models/lstm_model.keras'
+
+# same settings as 3_deepLearning
+NUM_WORDS = 500
+OOV_TOKEN = '<OOV>'
+EMBEDDING_INPUT_DIM = 5000
+CLASSES = ['negative', 'neutral', 'positive']
+DEFAULT_BATCH_SIZE = 128
+# batches are drawn from pools of this many batches sorted by length
+POOL_BATCHES = 50
+CACHE_VERSION = 1
+
+
+def _stop_words():
+    from nltk.corpus import stopwords
+    return set(stopwords.words('english'))
+
+
+def tokenize(text, stop_words):
+    """
+    preprocess_text from the notebook followed by the Keras Tokenizer's own
+    lowercasing. cleaned_comments has no punctuation left, so splitting on
+    whitespace gives the same tokens as word_tokenize.
+    """
+    return [word.lower() for word in text.split() if word.isalpha() and word not in stop_words]
+
+
+def build_vocab(token_lists, num_words=NUM_WORDS):
+    """
+    word -> id like keras Tokenizer(num_words, oov_token): ids by descending
+    count (ties in order of first appearance), id 1 for the OOV token, and
+    only ids below num_words are kept.
+    """
+    counts = Counter()
+    for tokens in token_lists:
+        counts.update(tokens)
+    # Counter keeps insertion order, sorted() is stable
+    words = sorted(counts, key=counts.get, reverse=True)
+    vocab = {OOV_TOKEN: 1}
+    for word in words:
+        if len(vocab) + 1 >= num_words:
+            break
+        vocab[word] = len(vocab) + 1
+    return vocab
+
+
+def to_ids(tokens, vocab):
+    return [vocab.get(word, 1) for word in tokens]
+
+
+class TokenCache:
+    """
+    Tokenized reviews on disk: every review's ids back to back in one flat
+    array plus an offsets array, memory-mapped so epochs read them without
+    re-tokenizing or holding a padded matrix.
+    """
+
+    def __init__(self, path=cache_dir):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.vocab = self.meta['vocab']
+        self.ids = np.memmap(os.path.join(path, 'ids.bin'), dtype=self.meta['ids_dtype'], mode='r')
+        self.offsets = np.fromfile(os.path.join(path, 'offsets.bin'), dtype=np.int64)
+        self.labels = np.fromfile(os.path.join(path, 'labels.bin'), dtype=np.int8)
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def sequence(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    @staticmethod
+    def build(source=reviews_io.csv_file, path=cache_dir, num_words=NUM_WORDS,
+              chunksize=reviews_io.DEFAULT_CHUNKSIZE):
+        """
+        Two streaming passes over the csv: one to count words for the
+        vocabulary, one to append ids, offsets and labels to the cache.
+        """
+        stop_words = _stop_words()
+        columns = ['cleaned_comments', 'sentiment']
+
+        def chunks():
+            for chunk in reviews_io.iter_review_chunks(source, chunksize, columns):
+                chunk = chunk.dropna()
+                yield chunk[chunk['sentiment'].isin(CLASSES)]
+
+        vocab = build_vocab(tokenize(text, stop_words)
+                            for chunk in chunks() for text in chunk['cleaned_comments'])
+        ids_dtype = 'uint16' if len(vocab) + 2 < 2 ** 16 else 'int32'
+        label_ids = {label: i for i, label in enumerate(CLASSES)}
+
+        os.makedirs(path, exist_ok=True)
+        offset = 0
+        with open(os.path.join(path, 'ids.bin'), 'wb') as ids_out, \
+                open(os.path.join(path, 'offsets.bin'), 'wb') as offsets_out, \
+                open(os.path.join(path, 'labels.bin'), 'wb') as labels_out:
+            offsets_out.write(np.zeros(1, dtype=np.int64).tobytes())
+            for chunk in chunks():
+                sequences = [to_ids(tokenize(text, stop_words), vocab) for text in chunk['cleaned_comments']]
+                lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+                flat = np.fromiter((i for sequence in sequences for i in sequence),
+                                   dtype=ids_dtype, count=int(lengths.sum()))
+                ids_out.write(flat.tobytes())
+                offsets_out.write((offset + np.cumsum(lengths)).tobytes())
+                offset += int(lengths.sum())
+                labels_out.write(chunk['sentiment'].astype(str).map(label_ids).to_numpy(np.int8).tobytes())
+
+        meta = {'version': CACHE_VERSION, 'fingerprint': reviews_io.file_fingerprint(source),
+                'num_words': num_words, 'ids_dtype': ids_dtype, 'vocab': vocab}
+        # meta.json last, its presence marks a complete cache
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+        return TokenCache(path)
+
+    @staticmethod
+    def load_or_build(source=reviews_io.csv_file, path=cache_dir, num_words=NUM_WORDS):
+        try:
+            cache = TokenCache(path)
+        except (OSError, ValueError):
+            cache = None
+        if (cache is None or cache.meta.get('version') != CACHE_VERSION
+                or cache.meta.get('num_words') != num_words
+                or cache.meta.get('fingerprint') != reviews_io.file_fingerprint(source)):
+            cache = TokenCache.build(source, path, num_words)
+        return cache
+
+
+def bucket_batches(lengths, batch_size=DEFAULT_BATCH_SIZE, shuffle=True, seed=None):
+    """
+    Index batches of similar-length reviews. With shuffle, indices are
+    shuffled, sorted by length within pools of POOL_BATCHES batches and the
+    resulting batches shuffled again, so every epoch sees a different mix
+    while each batch still pads to a length close to its longest review.
+    """
+    rng = np.random.default_rng(seed)
+    indices = rng.permutation(len(lengths)) if shuffle else np.arange(len(lengths))
+    pool = batch_size * POOL_BATCHES
+    batches = []
+    for start in range(0, len(indices), pool):
+        chunk = indices[start:start + pool]
+        chunk = chunk[np.argsort(lengths[chunk], kind='stable')]
+        batches.extend(chunk[i:i + batch_size] for i in range(0, len(chunk), batch_size))
+    if shuffle:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def pad_batch(sequences):
+    # post-padding to the longest sequence of this batch only
+    width = max(1, max(len(sequence) for sequence in sequences))
+    padded = np.zeros((len(sequences), width), dtype=np.int32)
+    for row, sequence in enumerate(sequences):
+        padded[row, :len(sequence)] = sequence
+    return padded
+
+
+def make_dataset(cache, indices, batch_size=DEFAULT_BATCH_SIZE, shuffle=True, seed=None):
+    """tf.data pipeline of (padded ids, label) batches read from the cache."""
+    import tensorflow as tf
+
+    indices = np.asarray(indices)
+    epoch = [0]
+
+    def generate():
+        # a new length-bucketed order for every epoch
+        epoch[0] += 1
+        batch_seed = None if seed is None else seed + epoch[0]
+        for batch in bucket_batches(cache.lengths[indices], batch_size, shuffle, batch_seed):
+            rows = indices[batch]
+            yield pad_batch([cache.sequence(i) for i in rows]), cache.labels[rows].astype(np.int32)
+
+    signature = (tf.TensorSpec(shape=(None, None), dtype=tf.int32),
+                 tf.TensorSpec(shape=(None,), dtype=tf.int32))
+    return tf.data.Dataset.from_generator(generate, output_signature=signature).prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(n_classes=len(CLASSES)):
+    """
+    The notebook's LSTM. Input length is left open and padding is masked,
+    so per-batch padding gives the same result as padding to the corpus max.
+    """
+    from tensorflow.keras.layers import LSTM, Dense, Dropout, Embedding
+    from tensorflow.keras.models import Sequential
+
+    model = Sequential()
+    model.add(Embedding(EMBEDDING_INPUT_DIM, 128, mask_zero=True))
+    model.add(LSTM(64, dropout=0.2, recurrent_dropout=0.2))
+    model.add(Dense(32, activation='relu'))
+    model.add(Dropout(0.5))
+    model.add(Dense(n_classes, activation='softmax'))
+    model.compile(loss='sparse_categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+    return model
+
+
+def split_indices(n, seed=42):
+    # test_size=0.2 as in the notebook, then Keras' validation_split=0.2
+    from sklearn.model_selection import train_test_split
+    train, test = train_test_split(np.arange(n), test_size=0.2, random_state=seed)
+    n_validation = int(len(train) * 0.2)
+    return train[:len(train) - n_validation], train[len(train) - n_validation:], test
+
+
+def epoch_timer():
+    """Keras callback recording the wall-clock seconds of every epoch."""
+    from tensorflow.keras.callbacks import Callback
+
+    class EpochTimer(Callback):
+        def on_train_begin(self, logs=None):
+            self.times = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self._start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.times.append(time.perf_counter() - self._start)
+
+    return EpochTimer()
+
+
+def train(cache, epochs=100, batch_size=DEFAULT_BATCH_SIZE, path=model_file, seed=42):
+    from tensorflow.keras.callbacks import EarlyStopping
+
+    train_idx, validation_idx, test_idx = split_indices(len(cache), seed)
+    model = build_model()
+    timer = epoch_timer()
+    early_stopping = EarlyStopping(monitor='val_loss', patience=3, verbose=1)
+    model.fit(make_dataset(cache, train_idx, batch_size, seed=seed),
+              validation_data=make_dataset(cache, validation_idx, batch_size, shuffle=False),
+              epochs=epochs, callbacks=[early_stopping, timer])
+    loss, accuracy = model.evaluate(make_dataset(cache, test_idx, batch_size, shuffle=False))
+    model.save(path)
+    return model, {'epoch_sec': timer.times, 'test_accuracy': accuracy,
+                   'peak_rss_mb': reviews_io.peak_rss_mb()}
+
+
+def predict(model, texts, vocab, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Class probabilities for raw cleaned texts, scored in length-bucketed
+    batches and returned in input order.
+    """
+    stop_words = _stop_words()
+    sequences = [to_ids(tokenize(text, stop_words), vocab) for text in texts]
+    lengths = np.array([len(sequence) for sequence in sequences])
+    probabilities = np.zeros((len(sequences), len(CLASSES)), dtype=np.float32)
+    for batch in bucket_batches(lengths, batch_size, shuffle=False):
+        probabilities[batch] = model.predict_on_batch(pad_batch([sequences[i] for i in batch]))
+    return probabilities
+
+
+def _benchmark_run(mode, cache_path, epochs, batch_size):
+    """
+    One training run in this process, 'padded' as in the notebook (the whole
+    corpus padded to its longest review) or 'bucketed' through the cache.
+    """
+    cache = TokenCache(cache_path)
+    train_idx, validation_idx, _ = split_indices(len(cache))
+    model = build_model()
+    timer = epoch_timer()
+    if mode == 'padded':
+        padded = pad_batch([cache.sequence(i) for i in range(len(cache))])
+        model.fit(padded[train_idx], cache.labels[train_idx].astype(np.int32), batch_size=batch_size,
+                  validation_data=(padded[validation_idx], cache.labels[validation_idx].astype(np.int32)),
+                  epochs=epochs, callbacks=[timer], verbose=0)
+        width = padded.shape[1]
+    else:
+        model.fit(make_dataset(cache, train_idx, batch_size, seed=42),
+                  validation_data=make_dataset(cache, validation_idx, batch_size, shuffle=False),
+                  epochs=epochs, callbacks=[timer], verbose=0)
+        width = None
+    return {'mode': mode, 'epoch_sec': float(np.mean(timer.times)), 'padded_width': width,
+            'peak_rss_mb': reviews_io.peak_rss_mb()}
+
+
+def benchmark(cache_path=cache_dir, epochs=1, batch_size=DEFAULT_BATCH_SIZE):
+    # each mode in a fresh interpreter so peak memory is measured separately
+    rows = []
+    for mode in ('padded', 'bucketed'):
+        output = subprocess.run(
+            [sys.executable, __file__, 'benchmark-run', '--mode', mode, '--cache', cache_path,
+             '--epochs', str(epochs), '--batch-size', str(batch_size)],
+            check=True, capture_output=True, text=True)
+        rows.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Length-bucketed LSTM training from a token cache')
+    parser.add_argument('command', choices=['tokenize', 'train', 'benchmark', 'benchmark-run'])
+    parser.add_argument('--source', default=reviews_io.csv_file)
+    parser.add_argument('--cache', default=cache_dir)
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--mode', choices=['padded', 'bucketed'], default='bucketed')
+    args = parser.parse_args()
+
+    if args.command == 'benchmark-run':
+        print(json.dumps(_benchmark_run(args.mode, args.cache, args.epochs or 1, args.batch_size)))
+        sys.exit(0)
+
+    cache = TokenCache.load_or_build(args.source, args.cache)
+    print('{:,} reviews, {:,} tokens, longest {} tokens, mean {:.1f}'.format(
+        len(cache), int(cache.lengths.sum()), int(cache.lengths.max(initial=0)), cache.lengths.mean()))
+    if args.command == 'train':
+        _, report = train(cache, args.epochs or 100, args.batch_size)
+        print('epoch times (s): {}'.format(', '.join('{:.2f}'.format(t) for t in report['epoch_sec'])))
+        print('test accuracy {:.4f}, peak RSS {:.1f} MB'.format(report['test_accuracy'], report['peak_rss_mb']))
+    elif args.command == 'benchmark':
+        for row in benchmark(args.cache, args.epochs or 1, args.batch_size):
+            print('{mode:9} epoch {epoch_sec:.2f}s  peak RSS {peak_rss_mb:.1f} MB'.format(**row))
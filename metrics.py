@@ -0,0 +1,181 @@
+import argparse
+import functools
+import itertools
+import os
+import time
+from contextlib import contextmanager
+
+import flask
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+# Prometheus metrics for the Dash servers and the scoring service, served at
+# /metrics by register_route. Label children are bound once per name, so a
+# timed call costs a few microseconds (`python metrics.py` measures it).
+# With several worker processes set PROMETHEUS_MULTIPROC_DIR (before this
+# module is imported) and every worker reports into that directory.
+
+# chart figures are serialized for their size on the first and then every
+# PAYLOAD_SAMPLE_EVERY-th build, callback responses are measured every time
+PAYLOAD_SAMPLE_EVERY = 10
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+BYTE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256B .. 64MB
+
+callback_seconds = Histogram('dash_callback_duration_seconds', 'Dash callback latency',
+                             ['callback'], buckets=LATENCY_BUCKETS)
+callback_exceptions = Counter('dash_callback_exceptions_total', 'Exceptions raised by Dash callbacks '
+                              '(PreventUpdate included)', ['callback', 'exception'])
+callback_bytes = Histogram('dash_callback_response_bytes', 'Size of the Dash callback responses',
+                           ['callback'], buckets=BYTE_BUCKETS)
+chart_seconds = Histogram('chart_build_duration_seconds', 'charts.py builder latency',
+                          ['chart'], buckets=LATENCY_BUCKETS)
+chart_bytes = Histogram('chart_payload_bytes', 'Sampled JSON size of the charts.py figures',
+                        ['chart'], buckets=BYTE_BUCKETS)
+stage_seconds = Histogram('model_stage_duration_seconds', 'Model inference latency per stage',
+                          ['model', 'stage'], buckets=STAGE_BUCKETS)
+stage_rows = Counter('model_stage_rows_total', 'Reviews passed through each model stage', ['model', 'stage'])
+
+_stage_children = {}
+
+
+def payload_bytes(value):
+    # JSON size of a figure, figure dict or component tree, None if it does not serialize
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    import plotly.io as pio
+    try:
+        return len(pio.to_json(value, validate=False))
+    except (TypeError, ValueError):
+        return None
+
+
+def callback(name=None):
+    """
+    Decorator timing a Dash callback. Place it under @app.callback and
+    above @callbacks.memoize(), so cache hits are timed as served. The
+    response size is recorded by the hook register_route installs.
+    """
+    def decorator(func):
+        callback_name = name or func.__name__
+        seconds = callback_seconds.labels(callback_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _tag_request(callback_name)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                callback_exceptions.labels(callback_name, type(e).__name__).inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def chart(func):
+    """Decorator timing a charts.py builder, with sampled figure sizes."""
+    seconds = chart_seconds.labels(func.__name__)
+    size = chart_bytes.labels(func.__name__)
+    calls = itertools.count()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            value = func(*args, **kwargs)
+        finally:
+            seconds.observe(time.perf_counter() - start)
+        if next(calls) % PAYLOAD_SAMPLE_EVERY == 0:
+            n_bytes = payload_bytes(value)
+            if n_bytes is not None:
+                size.observe(n_bytes)
+        return value
+
+    return wrapper
+
+
+def model_name(model):
+    # class name, so the label set stays small whatever model is loaded
+    return type(model).__name__
+
+
+@contextmanager
+def stage(model, name, rows=1):
+    """
+    Times one inference stage (transform, predict, ...) of model, a model
+    object or a name.
+    """
+    key = (model if isinstance(model, str) else model_name(model), name)
+    children = _stage_children.get(key)
+    if children is None:
+        children = _stage_children[key] = (stage_seconds.labels(*key), stage_rows.labels(*key))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        children[0].observe(time.perf_counter() - start)
+        children[1].inc(rows)
+
+
+def _tag_request(callback_name):
+    # remembers which callback answers this request, for the response hook
+    if flask.has_request_context():
+        flask.g.metrics_callback = callback_name
+
+
+def registry_from_env():
+    # PROMETHEUS_MULTIPROC_DIR=<dir> merges the metrics of every worker process
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def register_route(server, route='/metrics'):
+    """
+    Prometheus text exposition on the Flask server behind a Dash app, plus
+    an after_request hook recording the size of each timed callback's
+    response, which Flask has already serialized.
+    """
+
+    def metrics():
+        return flask.Response(generate_latest(registry_from_env()), content_type=CONTENT_TYPE_LATEST)
+
+    def record_size(response):
+        callback_name = flask.g.pop('metrics_callback', None)
+        # PreventUpdate answers 204 without a body, it is counted as an exception
+        if callback_name is not None and response.status_code == 200 and not response.direct_passthrough:
+            callback_bytes.labels(callback_name).observe(response.content_length or 0)
+        return response
+
+    server.add_url_rule(route, 'metrics', metrics)
+    server.after_request(record_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-call overhead of the metrics decorators')
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    def noop():
+        return None
+
+    timed = callback('overhead_check')(noop)
+    for label, func in [('plain call', noop), ('@callback', timed)]:
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            func()
+        print('{:<12} {:.2f}us'.format(label, (time.perf_counter() - start) / args.calls * 1e6))
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        with stage('overhead_check', 'noop'):
+            pass
+    print('{:<12} {:.2f}us'.format('stage()', (time.perf_counter() - start) / args.calls * 1e6))
@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+import reviews_io
+
+vectorizer_file = 'Models/tfidf_vectorizer.pkl'
+model_file = 'Models/logistic_regression_model.pkl'
+export_dir = 'Models/compact'
+
+EXPORT_VERSION = 1
+# the CURRENT file names the published version directory under export_dir
+CURRENT_FILE = 'CURRENT'
+KEEP_VERSIONS = 2
+
+
+def _check_vectorizer(vectorizer):
+    # the compact transform reimplements the default word analyzer only
+    params = vectorizer.get_params()
+    unsupported = {
+        'analyzer': 'word', 'ngram_range': (1, 1), 'stop_words': None, 'strip_accents': None,
+        'preprocessor': None, 'tokenizer': None, 'binary': False, 'input': 'content',
+    }
+    for name, expected in unsupported.items():
+        if params[name] != expected:
+            raise ValueError('cannot export a vectorizer with {}={!r}'.format(name, params[name]))
+
+
+def _proba_kind(model):
+    # how decision values turn into probabilities for this linear model
+    if not hasattr(model, 'predict_proba'):
+        return None
+    if len(model.classes_) == 2:
+        return 'sigmoid'
+    multi_class = getattr(model, 'multi_class', 'auto')
+    if multi_class == 'ovr' or getattr(model, 'solver', None) == 'liblinear':
+        return 'ovr'
+    return 'softmax'
+
+
+def export_models(vectorizer, model, path=export_dir, sources=None):
+    """
+    Write the vectorizer and a linear model as plain .npy arrays: the
+    vocabulary as a sorted utf-8 byte-string array (looked up with a binary
+    search), idf, coefficients and intercepts as float32. load_models maps
+    them read-only, so forked workers share the pages instead of each
+    unpickling a private dict and arrays.
+
+    Every export is a new version directory under path, published by
+    replacing the CURRENT pointer. Files a running worker may have mapped
+    are never rewritten, a rewrite under a mapping can crash it with SIGBUS.
+    """
+    _check_vectorizer(vectorizer)
+    if not hasattr(model, 'coef_'):
+        raise ValueError('only linear models (with coef_) can be exported, got {}'.format(type(model).__name__))
+    version = 'v{:020d}-{}'.format(time.time_ns(), os.getpid())
+    # written under a hidden name, so a half-written export is never published or pruned
+    tmp_dir = os.path.join(path, '.{}.tmp'.format(version))
+    os.makedirs(tmp_dir)
+
+    terms = sorted(vectorizer.vocabulary_, key=lambda term: term.encode('utf-8'))
+    columns = np.array([vectorizer.vocabulary_[term] for term in terms], dtype=np.int32)
+    np.save(os.path.join(tmp_dir, 'vocab.npy'), np.array([term.encode('utf-8') for term in terms]))
+    np.save(os.path.join(tmp_dir, 'columns.npy'), columns)
+    np.save(os.path.join(tmp_dir, 'idf.npy'), vectorizer.idf_.astype(np.float32))
+    np.save(os.path.join(tmp_dir, 'coef.npy'), np.ascontiguousarray(model.coef_, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, 'intercept.npy'), np.asarray(model.intercept_, dtype=np.float32))
+
+    params = vectorizer.get_params()
+    meta = {
+        'version': EXPORT_VERSION,
+        'lowercase': params['lowercase'],
+        'token_pattern': params['token_pattern'],
+        'norm': params['norm'],
+        'use_idf': params['use_idf'],
+        'sublinear_tf': params['sublinear_tf'],
+        'classes': [label.item() if hasattr(label, 'item') else label for label in model.classes_],
+        'proba': _proba_kind(model),
+        'model': type(model).__name__,
+        'sources': sources or {},
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.rename(tmp_dir, os.path.join(path, version))
+
+    tmp_file = os.path.join(path, '{}.{}.tmp'.format(CURRENT_FILE, os.getpid()))
+    with open(tmp_file, 'w') as f:
+        f.write(version)
+    os.replace(tmp_file, os.path.join(path, CURRENT_FILE))
+    _prune(path, version)
+    return meta
+
+
+def _prune(path, current, keep=KEEP_VERSIONS):
+    # removes old versions; unlinking a mapped file is safe, the pages stay
+    # valid until the worker unmaps them. The newest ones are kept for workers
+    # that have read CURRENT but not opened the arrays yet.
+    versions = sorted(name for name in os.listdir(path) if name.startswith('v'))
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def current_version(path=export_dir):
+    # the published version directory, None before the first export
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return os.path.join(path, f.read().strip())
+    except OSError:
+        return None
+
+
+class CompactVectorizer:
+    """TfidfVectorizer.transform over the arrays of one exported version, memory-mapped."""
+
+    def __init__(self, path, meta=None):
+        meta = meta or _read_meta(path)
+        self.vocab = np.load(os.path.join(path, 'vocab.npy'), mmap_mode='r')
+        self.columns = np.load(os.path.join(path, 'columns.npy'), mmap_mode='r')
+        self.idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode='r')
+        self.lowercase = meta['lowercase']
+        self.token_pattern = re.compile(meta['token_pattern'])
+        self.norm = meta['norm']
+        self.use_idf = meta['use_idf']
+        self.sublinear_tf = meta['sublinear_tf']
+
+    def lookup(self, terms):
+        # column of each term, -1 for terms outside the vocabulary
+        width = self.vocab.dtype.itemsize
+        encoded = [term.encode('utf-8') for term in terms]
+        # longer terms cannot be in the vocabulary, and would be truncated
+        keys = np.array([key if len(key) <= width else b'' for key in encoded], dtype=self.vocab.dtype)
+        positions = np.searchsorted(self.vocab, keys)
+        positions[positions == len(self.vocab)] = 0
+        found = (self.vocab[positions] == keys) & (keys != b'')
+        return np.where(found, self.columns[positions], -1)
+
+    def transform(self, texts):
+        indptr = [0]
+        indices = []
+        data = []
+        for text in texts:
+            if self.lowercase:
+                text = text.lower()
+            counts = Counter(self.token_pattern.findall(text))
+            if counts:
+                ids = self.lookup(list(counts))
+                keep = ids >= 0
+                indices.extend(ids[keep].tolist())
+                data.extend(np.fromiter(counts.values(), dtype=np.float64, count=len(counts))[keep].tolist())
+            indptr.append(len(indices))
+
+        X = sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), indptr),
+                          shape=(len(indptr) - 1, len(self.idf)))
+        X.sort_indices()
+        if self.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.use_idf:
+            X.data *= self.idf[X.indices]
+        if self.norm:
+            _normalize(X, self.norm)
+        return X
+
+
+def _normalize(X, norm):
+    # in-place row normalization of a csr matrix, like sklearn's normalize
+    if norm == 'l2':
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    else:
+        norms = np.asarray(abs(X).sum(axis=1)).ravel()
+    norms[norms == 0] = 1
+    X.data /= np.repeat(norms, np.diff(X.indptr))
+
+
+class CompactLinearModel:
+    """predict / predict_proba / decision_function of an exported linear model version."""
+
+    def __init__(self, path, meta=None):
+        meta = meta or _read_meta(path)
+        self.coef_ = np.load(os.path.join(path, 'coef.npy'), mmap_mode='r')
+        self.intercept_ = np.load(os.path.join(path, 'intercept.npy'), mmap_mode='r')
+        self.classes_ = np.array(meta['classes'])
+        self.proba = meta['proba']
+
+    def decision_function(self, X):
+        scores = np.asarray(X @ self.coef_.T, dtype=np.float64) + self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+    def predict_proba(self, X):
+        if self.proba is None:
+            raise AttributeError('the exported model has no predict_proba')
+        scores = self.decision_function(X)
+        if self.proba == 'sigmoid':
+            positive = 1 / (1 + np.exp(-scores))
+            return np.column_stack([1 - positive, positive])
+        if self.proba == 'ovr':
+            probabilities = 1 / (1 + np.exp(-scores))
+        else:
+            probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def _read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def _sources():
+    return {file: reviews_io.file_fingerprint(file) for file in (vectorizer_file, model_file)}
+
+
+def load_pickled_models():
+    import joblib
+    return joblib.load(vectorizer_file), joblib.load(model_file)
+
+
+def load_models(path=export_dir):
+    """
+    Drop-in replacement for dashboard.load_models: (vectorizer, model) backed
+    by memory-mapped arrays. The export is rebuilt from the pickles when it
+    is missing or older than them.
+    """
+    version = current_version(path)
+    try:
+        meta = _read_meta(version)
+    except (OSError, TypeError, ValueError):
+        meta = None
+    if meta is None or meta.get('version') != EXPORT_VERSION or meta.get('sources') != _sources():
+        export_models(*load_pickled_models(), path=path, sources=_sources())
+        # another worker may have published after this one, load whichever is current
+        version = current_version(path)
+        meta = _read_meta(version)
+    return CompactVectorizer(version, meta), CompactLinearModel(version, meta)
+
+
+def verify(texts, path=export_dir):
+    """
+    Compare the exported models with the pickles on texts: the number of
+    differing labels and the largest probability difference.
+    """
+    vectorizer, model = load_pickled_models()
+    compact_vectorizer, compact_model = load_models(path)
+    X = vectorizer.transform(texts)
+    X_compact = compact_vectorizer.transform(texts)
+    result = {
+        'rows': len(texts),
+        'max_feature_diff': float(abs(X - X_compact).max()) if X.nnz else 0.0,
+        'label_mismatches': int((model.predict(X) != compact_model.predict(X_compact)).sum()),
+    }
+    if hasattr(model, 'predict_proba'):
+        result['max_proba_diff'] = float(np.abs(model.predict_proba(X) - compact_model.predict_proba(X_compact)).max())
+    return result
+
+
+def _private_mb():
+    # memory only this process holds, shared file-backed pages excluded
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return float('nan')
+    return sum(int(fields[name].split()[0]) for name in ('Private_Clean', 'Private_Dirty')) / 1024
+
+
+def measure_load(loader):
+    """
+    Cold-load time, peak RSS and private memory of loader ('pickle' or
+    'compact') in a fresh interpreter, one sample review scored so the
+    arrays are actually touched.
+    """
+    code = (
+        'import time, json\n'
+        'start = time.perf_counter()\n'
+        'import model_export, reviews_io\n'
+        'v, m = model_export.{}()\n'
+        'load = time.perf_counter() - start\n'
+        'm.predict(v.transform(["the host was lovely and the flat was clean"]))\n'
+        'print(json.dumps({{"load_sec": load, "peak_rss_mb": reviews_io.peak_rss_mb(),'
+        ' "private_mb": model_export._private_mb()}}))\n'
+    ).format('load_pickled_models' if loader == 'pickle' else 'load_models')
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the models as memory-mappable arrays')
+    parser.add_argument('--verify-rows', type=int, default=10000,
+                        help='reviews to compare predictions on (0 to skip)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    meta = export_models(*load_pickled_models(), sources=_sources())
+    print('exported {} to {} in {:.2f}s'.format(meta['model'], current_version(), time.perf_counter() - start))
+
+    if args.verify_rows:
+        texts = reviews_io.load_reviews(columns=['cleaned_comments'])['cleaned_comments'].dropna()
+        print(verify(texts.head(args.verify_rows).tolist()))
+
+    for loader in ('pickle', 'compact'):
+        stats = measure_load(loader)
+        print('{:8} load {load_sec:.3f}s  peak RSS {peak_rss_mb:.1f} MB  private {private_mb:.1f} MB'.format(
+            loader, **stats))
@@ -0,0 +1,297 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import reviews_io
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+cache_dir = 'Dataset/Cache/near_duplicates'
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+# character shingles, robust to the word-level edits of templated text
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_SEED = 1
+DEFAULT_CHUNKSIZE = 20000
+# shingles hashed at once, bounds the (shingles x permutations) work array
+BATCH_SHINGLES = 1 << 17
+PERM_BLOCK = 32
+
+FNV_OFFSET = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+EMPTY = np.uint32(0xFFFFFFFF)
+
+
+def shingle_hashes(texts, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """
+    32-bit hashes of the character shingles of each text, computed for the
+    whole batch at once over its utf-8 bytes. Texts shorter than
+    shingle_size are one shingle. Returns (hashes, shingles per text).
+    """
+    encoded = [text.encode('utf-8') if isinstance(text, str) else b'' for text in texts]
+    lengths = np.array([len(text) for text in encoded], dtype=np.int64)
+    data = np.frombuffer(b''.join(encoded) + bytes(shingle_size), dtype=np.uint8)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    counts = np.where(lengths >= shingle_size, lengths - shingle_size + 1, np.minimum(lengths, 1))
+    first = np.cumsum(counts) - counts
+    starts = np.repeat(offsets, counts) + np.arange(counts.sum()) - np.repeat(first, counts)
+    # bytes past the end of a short text are masked out of its only shingle
+    text_lengths = np.repeat(lengths, counts)
+    ends = np.repeat(offsets, counts) + text_lengths
+
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    for j in range(shingle_size):
+        byte = np.where(starts + j < ends, data[starts + j], 0).astype(np.uint64)
+        hashes = (hashes ^ byte) * FNV_PRIME
+    return (hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF), counts
+
+
+def permutations(num_perm=DEFAULT_NUM_PERM, seed=DEFAULT_SEED):
+    # odd multipliers and offsets of the multiply-shift hash functions
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(texts, num_perm=DEFAULT_NUM_PERM, shingle_size=DEFAULT_SHINGLE_SIZE, seed=DEFAULT_SEED):
+    """
+    MinHash signatures, one row of num_perm uint32 per text: the minimum of
+    each hash function over the text's shingles. Empty texts get EMPTY in
+    every column. Texts are processed in batches of about BATCH_SHINGLES
+    shingles and PERM_BLOCK hash functions.
+    """
+    a, b = permutations(num_perm, seed)
+    hashes, counts = shingle_hashes(texts, shingle_size)
+    signatures = np.full((len(counts), num_perm), EMPTY, dtype=np.uint32)
+
+    ends = np.cumsum(counts)
+    start_text = 0
+    while start_text < len(counts):
+        # the texts whose shingles fit in one batch, at least one text
+        end_text = max(int(np.searchsorted(ends, ends[start_text] - counts[start_text] + BATCH_SHINGLES, 'right')),
+                       start_text + 1)
+        batch = slice(start_text, end_text)
+        nonempty = np.flatnonzero(counts[batch] > 0) + start_text
+        if len(nonempty):
+            lo, hi = ends[start_text] - counts[start_text], ends[end_text - 1]
+            x = hashes[lo:hi, None]
+            # reduceat offsets of the non-empty texts within the batch
+            at = ends[nonempty] - counts[nonempty] - lo
+            for p in range(0, num_perm, PERM_BLOCK):
+                values = (x * a[None, p:p + PERM_BLOCK] + b[None, p:p + PERM_BLOCK]) >> np.uint64(32)
+                signatures[nonempty, p:p + PERM_BLOCK] = np.minimum.reduceat(values, at, axis=0)
+        start_text = end_text
+    return signatures
+
+
+def lsh_params(threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM, false_positive_weight=0.5):
+    """
+    (bands, rows per band) with bands * rows <= num_perm minimizing the
+    weighted area of false positives below threshold and false negatives
+    above it, for the banding probability 1 - (1 - s^rows)^bands.
+    """
+    below = np.linspace(0, threshold, 200)
+    above = np.linspace(threshold, 1, 200)
+    best, best_error = None, np.inf
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positives = np.trapz(1 - (1 - below ** rows) ** bands, below)
+            false_negatives = np.trapz((1 - above ** rows) ** bands, above)
+            error = false_positive_weight * false_positives + (1 - false_positive_weight) * false_negatives
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+def band_keys(signatures, bands, rows, seed=DEFAULT_SEED):
+    # one 64-bit key per band, two texts share it when the band's rows all agree
+    multipliers = permutations(rows, seed + 1)[0]
+    keys = np.empty((len(signatures), bands), dtype=np.uint64)
+    for band in range(bands):
+        block = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys[:, band] = (block * multipliers[None, :]).sum(axis=1)
+    return keys
+
+
+def _sign_chunk(args):
+    # worker entry point: band keys and 16-bit signatures of a list of texts
+    texts, num_perm, shingle_size, seed, bands, rows = args
+    signatures = minhash(texts, num_perm, shingle_size, seed)
+    empty = signatures[:, 0] == EMPTY
+    return band_keys(signatures, bands, rows, seed), signatures.astype(np.uint16), empty
+
+
+def find_near_duplicates(text_chunks, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM,
+                         shingle_size=DEFAULT_SHINGLE_SIZE, seed=DEFAULT_SEED, n_jobs=None, workdir=cache_dir):
+    """
+    Cluster near-duplicate texts streamed as an iterable of lists of texts.
+    Returns an array giving, for every row, the row that represents its
+    cluster (the first row of the cluster, itself for unique rows).
+
+    Signatures are computed chunk by chunk across a process pool; the band
+    keys and 16-bit signatures are spilled to files in workdir. Each band
+    is then grouped by sorting its keys, every row sharing a key is paired
+    with the first row holding it, and a pair is kept when the fraction of
+    agreeing signature values reaches threshold. Clusters are the
+    connected components of the kept pairs, so a chain of near-duplicates
+    ends up in one cluster. Memory grows with the number of rows (one
+    band's keys and pairs, and the cluster of every row), not with rows
+    times bands.
+    """
+    bands, rows = lsh_params(threshold, num_perm)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    os.makedirs(workdir, exist_ok=True)
+    spill = tempfile.mkdtemp(dir=workdir)
+    try:
+        band_files = [open(os.path.join(spill, 'band_{}.bin'.format(band)), 'wb') for band in range(bands)]
+        signature_file = open(os.path.join(spill, 'signatures.bin'), 'wb')
+        jobs = ((list(texts), num_perm, shingle_size, seed, bands, rows) for texts in text_chunks)
+        n_rows = 0
+        if n_jobs == 1:
+            results = map(_sign_chunk, jobs)
+        else:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+            results = reviews_io.bounded_imap(executor, _sign_chunk, jobs, 2 * n_jobs)
+        try:
+            for keys, signatures, empty in results:
+                # empty texts get keys of their own, they are never near-duplicates
+                keys[empty] = (np.uint64(1) << np.uint64(63)) | (np.flatnonzero(empty) + n_rows).astype(np.uint64)[:, None]
+                for band in range(bands):
+                    band_files[band].write(np.ascontiguousarray(keys[:, band]).tobytes())
+                signature_file.write(signatures.tobytes())
+                n_rows += len(signatures)
+        finally:
+            if n_jobs != 1:
+                executor.shutdown()
+            for f in band_files + [signature_file]:
+                f.close()
+        if not n_rows:
+            return np.array([], dtype=np.int64)
+
+        # one band at a time, so only one band's keys and pairs are in
+        # memory: each row is paired with the first row sharing its key, and
+        # the pairs that pass the signature check join their clusters
+        signatures = np.memmap(os.path.join(spill, 'signatures.bin'), dtype=np.uint16, mode='r',
+                               shape=(n_rows, num_perm))
+        cluster_of = np.arange(n_rows)
+        for band in range(bands):
+            keys = np.fromfile(os.path.join(spill, 'band_{}.bin'.format(band)), dtype=np.uint64)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            del keys
+            group_start = np.flatnonzero(np.diff(sorted_keys, prepend=sorted_keys[0] ^ np.uint64(1)))
+            leaders = order[np.repeat(group_start, np.diff(np.append(group_start, len(order))))]
+            duplicate = leaders != order
+            u, v = order[duplicate], leaders[duplicate]
+            # pairs an earlier band already put in one cluster are not checked again
+            new = cluster_of[u] != cluster_of[v]
+            u, v = u[new], v[new]
+            similar = _similar(signatures, u, v, threshold)
+            cluster_of = _merge(cluster_of, u[similar], v[similar])
+        del signatures
+    finally:
+        shutil.rmtree(spill, ignore_errors=True)
+    return cluster_of
+
+
+def _similar(signatures, u, v, threshold):
+    # which (u, v) pairs agree on at least threshold of their signature
+    # values, in batches to bound memory
+    keep = np.zeros(len(u), dtype=bool)
+    batch = max(BATCH_SHINGLES // signatures.shape[1], 1) * 64
+    for start in range(0, len(u), batch):
+        end = start + batch
+        keep[start:end] = (signatures[u[start:end]] == signatures[v[start:end]]).mean(axis=1) >= threshold
+    return keep
+
+
+def _merge(cluster_of, u, v):
+    """
+    Join the clusters of each (u, v) pair. cluster_of gives the first row
+    of every row's cluster, which stays its representative.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if not len(u):
+        return cluster_of
+    n_rows = len(cluster_of)
+    graph = coo_matrix((np.ones(len(u), dtype=np.int8), (cluster_of[u], cluster_of[v])), shape=(n_rows, n_rows))
+    _, labels = connected_components(graph, directed=False)
+    first = np.full(labels.max() + 1, n_rows, dtype=np.int64)
+    np.minimum.at(first, labels, np.arange(n_rows))
+    return first[labels][cluster_of]
+
+
+def cluster_report(representatives, texts=None):
+    """
+    One row per cluster that collapsed something: its representative row,
+    how many rows it holds and how many it collapsed, biggest first, with
+    the representative text when texts is given.
+    """
+    sizes = np.bincount(representatives, minlength=len(representatives))
+    clustered = np.flatnonzero(sizes > 1)
+    report = pd.DataFrame({'row': clustered, 'size': sizes[clustered], 'collapsed': sizes[clustered] - 1})
+    if texts is not None:
+        report['text'] = np.asarray(texts, dtype=object)[clustered]
+    return report.sort_values(['size', 'row'], ascending=[False, True], ignore_index=True)
+
+
+def dedupe(df, column='cleaned_comments', threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM,
+           n_jobs=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Keep the first review of every near-duplicate cluster of df[column].
+    Returns (the reduced DataFrame, cluster_report of what was collapsed).
+    """
+    texts = df[column].tolist()
+    chunks = (texts[start:start + chunksize] for start in range(0, len(texts), chunksize))
+    representatives = find_near_duplicates(chunks, threshold, num_perm, n_jobs=n_jobs)
+    report = cluster_report(representatives, texts)
+    return df[representatives == np.arange(len(df))], report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Near-duplicate review clusters (MinHash / LSH)')
+    parser.add_argument('csv', nargs='?', default=csv_file)
+    parser.add_argument('--column', default='cleaned_comments')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='estimated Jaccard similarity of character shingles for two reviews to match')
+    parser.add_argument('--num-perm', type=int, default=DEFAULT_NUM_PERM)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--report', help='write the cluster report to this csv')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    load_stats = reviews_io.LoadStats()
+    started = time.perf_counter()
+    stream = (chunk[args.column].tolist() for chunk in
+              reviews_io.iter_review_chunks(args.csv, args.chunksize, columns=[args.column], stats=load_stats))
+    cluster_of = find_near_duplicates(stream, args.threshold, args.num_perm, n_jobs=args.jobs)
+    elapsed = time.perf_counter() - started
+    print('bands x rows: {} x {}'.format(*lsh_params(args.threshold, args.num_perm)))
+    print('{:,} rows in {:.1f}s ({:,.0f} rows/sec), peak RSS {:.0f} MB'.format(
+        len(cluster_of), elapsed, len(cluster_of) / elapsed, reviews_io.peak_rss_mb()))
+
+    cluster_table = cluster_report(cluster_of)
+    print('{:,} clusters collapsed {:,} rows'.format(len(cluster_table), cluster_table['collapsed'].sum()))
+    if len(cluster_table):
+        # a second pass picks up the representative texts of the biggest clusters
+        top_rows = set(cluster_table['row'].head(args.top))
+        texts = {}
+        for chunk in reviews_io.iter_review_chunks(args.csv, args.chunksize, columns=[args.column]):
+            for row in top_rows.intersection(chunk.index):
+                texts[row] = chunk.at[row, args.column]
+        pd.set_option('display.max_colwidth', 80)
+        print(cluster_table.head(args.top).assign(text=lambda table: table['row'].map(texts)).to_string(index=False))
+    if args.report:
+        cluster_table.to_csv(args.report, index=False)
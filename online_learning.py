@@ -0,0 +1,225 @@
+import argparse
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+import review_store
+import reviews_io
+import text_cleaning
+
+checkpoint_file = 'Models/online/sgd_model.pkl'
+
+CLASSES = np.array(['negative', 'neutral', 'positive'])
+N_FEATURES = 2 ** 20
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_CHECKPOINT_EVERY = 20
+CHECKPOINT_VERSION = 1
+
+
+def make_vectorizer():
+    # stateless: nothing is fitted, so new words never require a refit
+    return HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm='l2')
+
+
+def make_model():
+    return SGDClassifier(loss='log_loss', alpha=1e-6, random_state=42)
+
+
+def _batches(texts, labels, batch_size):
+    for start in range(0, len(texts), batch_size):
+        yield texts[start:start + batch_size], labels[start:start + batch_size]
+
+
+class OnlineTrainer:
+    """
+    Incrementally trained sentiment model: a hashing vectorizer and an
+    SGDClassifier updated with partial_fit on mini-batches. last_id tracks
+    how far the user review store has been consumed, and the checkpoint
+    stores it with the model so a restart resumes where it stopped.
+    """
+
+    def __init__(self, path=checkpoint_file, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.vectorizer = make_vectorizer()
+        self.model = make_model()
+        self.last_id = 0
+        self.n_seen = 0
+        self._since_checkpoint = 0
+
+    def partial_fit(self, texts, labels, batch_size=DEFAULT_BATCH_SIZE):
+        for batch_texts, batch_labels in _batches(list(texts), np.asarray(labels, dtype=str), batch_size):
+            self.model.partial_fit(self.vectorizer.transform(batch_texts), batch_labels, classes=CLASSES)
+            self.n_seen += len(batch_texts)
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+    def bootstrap(self, source=reviews_io.csv_file, batch_size=DEFAULT_BATCH_SIZE):
+        # initial passes over the labeled corpus, chunk by chunk
+        for chunk in reviews_io.iter_review_chunks(source, columns=['cleaned_comments', 'sentiment']):
+            chunk = chunk.dropna()
+            chunk = chunk[chunk['sentiment'].isin(CLASSES)]
+            self.partial_fit(chunk['cleaned_comments'], chunk['sentiment'], batch_size)
+        self.checkpoint()
+
+    def update(self, store=review_store.store_file, batch_size=DEFAULT_BATCH_SIZE, limit=None):
+        """
+        Train on the reviews submitted since the last update that carry a
+        label from the reviewer. The predicted sentiment stored with every
+        review is never trained on, that would only reinforce the model's
+        own mistakes. Returns the number of reviews trained on.
+        """
+        reviews = review_store.read_reviews(self.last_id, store, limit)
+        if not len(reviews):
+            return 0
+        labeled = reviews[reviews['label'].isin(CLASSES)]
+        # cleaned like the cleaned_comments the model was bootstrapped on
+        self.partial_fit(text_cleaning.clean_series(labeled['review'].astype(str)), labeled['label'], batch_size)
+        self.last_id = int(reviews['id'].max())
+        self.checkpoint()
+        return len(labeled)
+
+    def checkpoint(self):
+        # written atomically, the dashboard may be reading it at any time
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(self.path, os.getpid())
+        joblib.dump({'version': CHECKPOINT_VERSION, 'model': self.model,
+                     'last_id': self.last_id, 'n_seen': self.n_seen}, tmp_file)
+        os.replace(tmp_file, self.path)
+        self._since_checkpoint = 0
+
+    @classmethod
+    def load(cls, path=checkpoint_file, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        trainer = cls(path, checkpoint_every)
+        if os.path.exists(path):
+            state = joblib.load(path)
+            if state.get('version') == CHECKPOINT_VERSION:
+                trainer.model = state['model']
+                trainer.last_id = state['last_id']
+                trainer.n_seen = state['n_seen']
+        return trainer
+
+    def watch(self, interval=30, store=review_store.store_file):
+        # poll the review store forever
+        while True:
+            consumed = self.update(store)
+            if consumed:
+                print('trained on {} new reviews, {} seen in total'.format(consumed, self.n_seen))
+            time.sleep(interval)
+
+
+class ModelWatcher:
+    """
+    The latest online checkpoint for a running app. get() reloads the model
+    when the checkpoint file changes, at most every check_interval seconds,
+    and returns (vectorizer, model), or None before the first checkpoint.
+    """
+
+    def __init__(self, path=checkpoint_file, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.vectorizer = make_vectorizer()
+        self._model = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = now
+                try:
+                    mtime = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if mtime is not None and mtime != self._mtime:
+                    state = joblib.load(self.path)
+                    if state.get('version') == CHECKPOINT_VERSION:
+                        self._model = state['model']
+                    self._mtime = mtime
+        if self._model is None:
+            return None
+        return self.vectorizer, self._model
+
+
+def benchmark(df, n_updates=10, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Replay a labeled corpus as a stream: a model is trained on the first
+    half, the rest arrives in n_updates increments. After each increment
+    the online model takes a partial_fit pass while the baseline refits
+    TF-IDF and LogisticRegression on everything seen so far. Returns the
+    update cost and held-out accuracy of both after every increment.
+    """
+    df = df.dropna()
+    df = df[df['sentiment'].isin(CLASSES)]
+    train, test = train_test_split(df, test_size=0.2, random_state=42)
+    texts = train['cleaned_comments'].tolist()
+    labels = train['sentiment'].astype(str).to_numpy()
+    initial = len(texts) // 2
+    steps = np.linspace(initial, len(texts), n_updates + 1).astype(int)
+
+    trainer = OnlineTrainer(path=os.devnull, checkpoint_every=float('inf'))
+    trainer.partial_fit(texts[:initial], labels[:initial], batch_size)
+    X_test_hashed = trainer.vectorizer.transform(test['cleaned_comments'])
+    y_test = test['sentiment'].astype(str).to_numpy()
+
+    rows = []
+    for step, (start, stop) in enumerate(zip(steps[:-1], steps[1:]), 1):
+        began = time.perf_counter()
+        trainer.partial_fit(texts[start:stop], labels[start:stop], batch_size)
+        online_sec = time.perf_counter() - began
+
+        began = time.perf_counter()
+        vectorizer = TfidfVectorizer()
+        model = LogisticRegression(max_iter=1000)
+        model.fit(vectorizer.fit_transform(texts[:stop]), labels[:stop])
+        full_sec = time.perf_counter() - began
+
+        rows.append({
+            'update': step,
+            'rows_seen': int(stop),
+            'online_update_sec': online_sec,
+            'full_retrain_sec': full_sec,
+            'online_accuracy': accuracy_score(y_test, trainer.model.predict(X_test_hashed)),
+            'full_accuracy': accuracy_score(y_test, model.predict(vectorizer.transform(test['cleaned_comments']))),
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental sentiment model trained on submitted reviews')
+    parser.add_argument('command', choices=['bootstrap', 'update', 'watch', 'benchmark'])
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls for watch')
+    parser.add_argument('--updates', type=int, default=10, help='increments replayed by benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        import pandas as pd
+        rows = benchmark(reviews_io.load_reviews(columns=['cleaned_comments', 'sentiment']),
+                         args.updates, args.batch_size)
+        table = pd.DataFrame(rows)
+        print(table.round(4).to_string(index=False))
+        print('mean update cost: online {:.3f}s, full retrain {:.3f}s; final accuracy drift {:+.4f}'.format(
+            table['online_update_sec'].mean(), table['full_retrain_sec'].mean(),
+            table['online_accuracy'].iloc[-1] - table['full_accuracy'].iloc[-1]))
+    else:
+        trainer = OnlineTrainer.load()
+        if args.command == 'bootstrap':
+            trainer.bootstrap(batch_size=args.batch_size)
+            print('bootstrapped on {} reviews'.format(trainer.n_seen))
+        elif args.command == 'update':
+            print('trained on {} new reviews'.format(trainer.update(batch_size=args.batch_size)))
+        else:
+            trainer.watch(args.interval)
@@ -0,0 +1,340 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import reviews_io
+import time_buckets
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+engine_file = 'Dataset/Aggregates/query_engine.pkl'
+
+# bump this whenever the saved arrays of QueryEngine change
+ENGINE_VERSION = 1
+# what save() writes, plain arrays so the file does not depend on where the
+# class was imported from (the build command runs this module as __main__)
+STATE = ['reviewers', 'labels', 'reviewer_ptr', 'posting_days', 'posting_rows', 'posting_codes',
+         'prefix', 'first_day', 'daily', 'daily_prefix']
+
+
+def day_numbers(dates):
+    # days since 1970-01-01, -1 for unparseable dates
+    dates = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format='%Y-%m-%d', errors='coerce')
+    days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    return np.where(np.isnat(days), -1, days.astype(np.int64)).astype(np.int32)
+
+
+class QueryEngine:
+    """
+    Review counts for any (reviewer, date range, sentiment) slice without
+    scanning the reviews:
+
+    - reviewer and sentiment are dictionary encoded (sorted names, int codes)
+    - every reviewer has a posting list, the row ids of its reviews sorted
+      by date, stored back to back with reviewer_ptr giving the boundaries
+    - prefix sums of each sentiment over the posting lists, and over the
+      per-day counts of all reviewers, turn a count into two lookups
+
+    A reviewer slice is found with two binary searches in its posting list,
+    a count is then a difference of prefix sums. Rows with no parseable date
+    are left out.
+    """
+
+    def __init__(self):
+        self.reviewers = np.array([], dtype=object)
+        self.labels = []
+        self._ordinals = {}
+
+    def fit(self, dates, reviewers, sentiments, row_ids=None):
+        return self._fit_days(day_numbers(dates), reviewers, sentiments, row_ids)
+
+    def _fit_days(self, days, reviewers, sentiments, row_ids=None):
+        reviewers = pd.Series(reviewers).astype(object).fillna('')
+        sentiments = pd.Series(sentiments).astype(object)
+        row_ids = np.arange(len(days), dtype=np.int64) if row_ids is None else np.asarray(row_ids, dtype=np.int64)
+        valid = days >= 0
+        days, row_ids = days[valid], row_ids[valid]
+        reviewers, sentiments = reviewers[valid], sentiments[valid]
+
+        # dictionary encoding, codes follow the sorted dictionaries
+        reviewer_codes, self.reviewers = pd.factorize(reviewers, sort=True)
+        self.reviewers = np.asarray(self.reviewers, dtype=object)
+        sentiment_codes, labels = pd.factorize(sentiments, sort=True)
+        self.labels = [str(label) for label in labels]
+        # the missing sentiment gets the last code
+        sentiment_codes = np.where(sentiment_codes < 0, len(self.labels), sentiment_codes).astype(np.int8)
+        n_codes = len(self.labels) + 1
+
+        # posting lists: rows grouped by reviewer, by date within a reviewer
+        order = np.lexsort((row_ids, days, reviewer_codes))
+        self.reviewer_ptr = np.concatenate([[0], np.cumsum(np.bincount(reviewer_codes, minlength=len(self.reviewers)))])
+        self.posting_days = days[order]
+        self.posting_rows = row_ids[order]
+        self.posting_codes = sentiment_codes[order]
+        self.prefix = np.zeros((n_codes, len(order) + 1), dtype=np.int32)
+        for code in range(n_codes):
+            np.cumsum(self.posting_codes == code, out=self.prefix[code, 1:])
+
+        # per-day counts of all reviewers and their prefix sums
+        self.first_day = int(days.min()) if len(days) else 0
+        n_days = int(days.max()) - self.first_day + 1 if len(days) else 0
+        self.daily = np.bincount(sentiment_codes.astype(np.int64) * n_days + (days - self.first_day),
+                                 minlength=n_codes * n_days).reshape(n_codes, n_days).astype(np.int32)
+        self.daily_prefix = np.zeros((n_codes, n_days + 1), dtype=np.int64)
+        np.cumsum(self.daily, axis=1, out=self.daily_prefix[:, 1:])
+        return self
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        # fit on an iterable of review chunks, only the three columns are kept
+        days, reviewers, sentiments = [], [], []
+        for chunk in chunks:
+            days.append(day_numbers(chunk['date']))
+            reviewers.append(chunk['reviewer_name'].astype(object).astype('category'))
+            sentiments.append(chunk['sentiment'].astype(object).astype('category'))
+        if not days:
+            raise ValueError('no reviews to index')
+        return cls()._fit_days(np.concatenate(days), pd.api.types.union_categoricals(reviewers),
+                               pd.api.types.union_categoricals(sentiments))
+
+    @property
+    def n_days(self):
+        return self.daily.shape[1]
+
+    def _day_range(self, start=None, end=None):
+        # inclusive bounds as day numbers clipped to the indexed days
+        first, last = self.first_day, self.first_day + self.n_days - 1
+        if start is not None:
+            first = max(first, int(np.datetime64(pd.Timestamp(start).date(), 'D').astype(np.int64)))
+        if end is not None:
+            last = min(last, int(np.datetime64(pd.Timestamp(end).date(), 'D').astype(np.int64)))
+        return first, last
+
+    def reviewer_code(self, reviewer):
+        # -1 when the reviewer is unknown
+        i = int(np.searchsorted(self.reviewers, reviewer))
+        return i if i < len(self.reviewers) and self.reviewers[i] == reviewer else -1
+
+    def _slice(self, reviewer, first, last):
+        # [lo, hi) positions of the reviewer's postings dated first..last
+        code = self.reviewer_code(reviewer)
+        if code < 0 or first > last:
+            return 0, 0
+        start, end = self.reviewer_ptr[code], self.reviewer_ptr[code + 1]
+        days = self.posting_days[start:end]
+        return (start + int(np.searchsorted(days, first, 'left')),
+                start + int(np.searchsorted(days, last, 'right')))
+
+    def counts(self, reviewer=None, start=None, end=None):
+        """
+        Reviews per sentiment label plus 'total' for a reviewer (None for
+        everyone) between two dates (inclusive, None for open ended).
+        """
+        first, last = self._day_range(start, end)
+        if first > last:
+            per_code = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        elif reviewer is None:
+            per_code = (self.daily_prefix[:, last - self.first_day + 1]
+                        - self.daily_prefix[:, first - self.first_day])
+        else:
+            lo, hi = self._slice(reviewer, first, last)
+            per_code = self.prefix[:, hi].astype(np.int64) - self.prefix[:, lo]
+        counts = dict(zip(self.labels, per_code[:-1].tolist()))
+        counts['total'] = int(per_code.sum())
+        return counts
+
+    def count(self, reviewer=None, start=None, end=None, sentiments=None):
+        # number of reviews in a slice, sentiments is a list of labels or None for all
+        counts = self.counts(reviewer, start, end)
+        if sentiments is None:
+            return counts['total']
+        return sum(counts.get(sentiment, 0) for sentiment in sentiments)
+
+    def series(self, reviewer=None, start=None, end=None, granularity='month'):
+        """
+        Counts per time bucket like time_buckets.bucket_counts: a DataFrame
+        indexed by period with one column per sentiment and 'total'. Buckets
+        run continuously from the first to the last review of the slice,
+        empty ones are 0.
+        """
+        first, last = self._day_range(start, end)
+        if reviewer is None:
+            counts = self.daily[:, max(first - self.first_day, 0):max(last - self.first_day + 1, 0)]
+        else:
+            lo, hi = self._slice(reviewer, first, last)
+            width = max(last - first + 1, 0)
+            cells = self.posting_codes[lo:hi].astype(np.int64) * width + (self.posting_days[lo:hi] - first)
+            counts = np.bincount(cells, minlength=len(self.prefix) * width).reshape(len(self.prefix), width)
+
+        totals = counts.sum(axis=0)
+        nonzero = np.flatnonzero(totals)
+        freq = time_buckets.GRANULARITIES[granularity]
+        columns = self.labels + ['total']
+        if not len(nonzero):
+            return pd.DataFrame(columns=columns, dtype='int64', index=self._period_index([], freq))
+        counts = np.vstack([counts[:-1], totals[np.newaxis]])[:, nonzero[0]:nonzero[-1] + 1]
+
+        # days of the same bucket are adjacent, sum each run of equal ordinals
+        offset = first + nonzero[0] - self.first_day
+        ordinals = self._bucket_ordinals(freq)[offset:offset + counts.shape[1]]
+        starts = np.flatnonzero(np.diff(ordinals, prepend=ordinals[0] - 1))
+        return pd.DataFrame(np.add.reduceat(counts, starts, axis=1).T,
+                            index=self._period_index(ordinals[starts], freq), columns=columns)
+
+    def _bucket_ordinals(self, freq):
+        # period ordinal of every indexed day at this frequency, computed once
+        if freq not in self._ordinals:
+            days = pd.period_range(start=self.date_range()[0], periods=self.n_days, freq='D')
+            self._ordinals[freq] = days.asfreq(freq).asi8
+        return self._ordinals[freq]
+
+    @staticmethod
+    def _period_index(ordinals, freq):
+        return pd.PeriodIndex(pd.arrays.PeriodArray(np.asarray(ordinals, dtype=np.int64), dtype=pd.PeriodDtype(freq)),
+                              name='period')
+
+    def rows(self, reviewer, start=None, end=None, sentiments=None):
+        # source row ids of a reviewer's reviews in the date range, oldest first
+        lo, hi = self._slice(reviewer, *self._day_range(start, end))
+        rows = self.posting_rows[lo:hi]
+        if sentiments is not None:
+            codes = [self.labels.index(sentiment) for sentiment in sentiments if sentiment in self.labels]
+            rows = rows[np.isin(self.posting_codes[lo:hi], codes)]
+        return rows
+
+    def top_reviewers(self, n=20):
+        # reviewers with the most reviews, most active first
+        sizes = np.diff(self.reviewer_ptr)
+        order = np.argsort(-sizes, kind='stable')[:n]
+        return pd.Series(sizes[order], index=self.reviewers[order])
+
+    def find_reviewers(self, prefix, limit=20):
+        # reviewer names starting with prefix, in sorted order
+        start = int(np.searchsorted(self.reviewers, prefix, 'left'))
+        names = self.reviewers[start:start + limit]
+        return [name for name in names if name.startswith(prefix)]
+
+    def date_range(self):
+        # (first, last) indexed dates
+        return (pd.Timestamp(np.datetime64(self.first_day, 'D')),
+                pd.Timestamp(np.datetime64(self.first_day + self.n_days - 1, 'D')))
+
+    def save(self, path=engine_file, fingerprint=None):
+        # written to a temporary file first so readers never see half of it
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+        state = {name: getattr(self, name) for name in STATE}
+        joblib.dump({'version': ENGINE_VERSION, 'fingerprint': fingerprint, 'state': state}, tmp_file)
+        os.replace(tmp_file, path)
+
+    @staticmethod
+    def load(path=engine_file):
+        # (engine, source fingerprint), or None when there is no usable artifact.
+        # The arrays are memory-mapped, so dashboard workers share the pages.
+        if not os.path.exists(path):
+            return None
+        state = joblib.load(path, mmap_mode='r')
+        if state.get('version') != ENGINE_VERSION:
+            return None
+        engine = QueryEngine()
+        engine.__dict__.update(state['state'])
+        return engine, state['fingerprint']
+
+
+def build(source=csv_file, path=engine_file):
+    # stream the csv once and store the engine next to the other aggregates
+    fingerprint = reviews_io.file_fingerprint(source)
+    stats = reviews_io.LoadStats()
+    chunks = reviews_io.iter_review_chunks(source, columns=['date', 'reviewer_name', 'sentiment'], stats=stats)
+    engine = QueryEngine.from_chunks(chunks)
+    engine.save(path, fingerprint)
+    print('query engine build: ' + stats.report())
+    return engine
+
+
+def load_or_build(source=csv_file, path=engine_file):
+    """
+    Load the persisted engine, rebuilding it when it is missing, was written
+    by another version or the source csv fingerprint has changed.
+    """
+    loaded = QueryEngine.load(path)
+    if loaded is not None and loaded[1] == reviews_io.file_fingerprint(source):
+        return loaded[0]
+    return build(source, path)
+
+
+def benchmark(df, engine, n_queries=200, random_state=0):
+    """
+    Mean time per query of the engine against filtering the DataFrame, for
+    random reviewer / date range / sentiment slices. Both must give the same
+    counts.
+    """
+    rng = np.random.default_rng(random_state)
+    dates = time_buckets.parse_dates(df['date'])
+    first, last = engine.date_range()
+    span = (last - first).days
+    reviewers = engine.top_reviewers(1000).index.to_numpy()
+
+    queries = []
+    for _ in range(n_queries):
+        a, b = np.sort(rng.integers(0, span + 1, 2))
+        queries.append((None if rng.random() < 0.2 else str(rng.choice(reviewers)),
+                        first + pd.Timedelta(days=int(a)), first + pd.Timedelta(days=int(b)),
+                        [str(rng.choice(engine.labels))] if rng.random() < 0.5 else None))
+
+    start = time.perf_counter()
+    engine_counts = [engine.count(*query) for query in queries]
+    count_sec = (time.perf_counter() - start) / n_queries
+
+    start = time.perf_counter()
+    for reviewer, date_from, date_to, _ in queries:
+        engine.series(reviewer, date_from, date_to, 'month')
+    series_sec = (time.perf_counter() - start) / n_queries
+
+    start = time.perf_counter()
+    scan_counts = []
+    for reviewer, date_from, date_to, sentiments in queries:
+        mask = (dates >= date_from) & (dates <= date_to)
+        if reviewer is not None:
+            mask &= df['reviewer_name'] == reviewer
+        if sentiments is not None:
+            mask &= df['sentiment'].isin(sentiments)
+        scan_counts.append(int(mask.sum()))
+    scan_sec = (time.perf_counter() - start) / n_queries
+
+    return {'rows': len(df), 'queries': n_queries, 'count_ms': count_sec * 1000,
+            'series_ms': series_sec * 1000, 'scan_ms': scan_sec * 1000,
+            'mismatches': sum(a != b for a, b in zip(engine_counts, scan_counts))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Indexed reviewer / date range / sentiment counts')
+    parser.add_argument('command', choices=['build', 'benchmark'])
+    parser.add_argument('csv', nargs='?', default=csv_file)
+    parser.add_argument('--synthetic', type=int, help='benchmark on this many synthetic reviews instead')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        engine = build(args.csv)
+        print('{:,} reviews, {:,} reviewers, {:,} days indexed into {}'.format(
+            len(engine.posting_rows), len(engine.reviewers), engine.n_days, engine_file))
+    else:
+        if args.synthetic:
+            import benchmark_charts
+            df = benchmark_charts.synthetic_reviews(args.synthetic)
+        else:
+            df = reviews_io.load_reviews(columns=['date', 'reviewer_name', 'sentiment'], source=args.csv)
+        start = time.perf_counter()
+        engine = QueryEngine.from_chunks([df])
+        print('built in {:.2f}s'.format(time.perf_counter() - start))
+        result = benchmark(df, engine, args.queries)
+        print('{rows:,} rows, {queries} queries: count {count_ms:.3f} ms, month series {series_ms:.3f} ms, '
+              'full scan {scan_ms:.1f} ms, {mismatches} mismatches'.format(**result))
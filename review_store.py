@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from micro_batcher import MicroBatcher
+
+store_file = 'Dataset/User Review/user_reviews.db'
+
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT_MS = 20
+SUBMIT_TIMEOUT = 30
+
+
+def connect(path=store_file):
+    """
+    Open the user review store, creating it if needed. WAL mode lets any
+    number of dashboard workers append while readers keep reading.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    # NORMAL is durable across process crashes, only a power cut can lose
+    # the last transactions
+    db.execute('PRAGMA synchronous=NORMAL')
+    # sentiment is the model's prediction, label the sentiment the reviewer
+    # picked themselves (NULL when they did not), the only one safe to train on
+    db.execute('''CREATE TABLE IF NOT EXISTS reviews (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT,
+                      review TEXT NOT NULL,
+                      sentiment TEXT,
+                      created REAL NOT NULL,
+                      label TEXT)''')
+    # stores created before the label column
+    if 'label' not in [row[1] for row in db.execute('PRAGMA table_info(reviews)')]:
+        try:
+            db.execute('ALTER TABLE reviews ADD COLUMN label TEXT')
+        except sqlite3.OperationalError:
+            pass  # another worker added it first
+    return db
+
+
+class ReviewWriter:
+    """
+    Buffered writer for user-submitted reviews. Submissions from concurrent
+    callbacks are queued and committed together, one transaction per batch
+    (flushed by size or time). submit only returns once its batch has been
+    committed, so an acknowledged review survives a worker crash.
+    """
+
+    def __init__(self, path=store_file, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.path = path
+        self._db = connect(path)
+        self._lock = threading.Lock()
+        self._batcher = MicroBatcher(self._flush, max_batch_size, max_wait_ms / 1000)
+
+    def _flush(self, rows):
+        # one transaction for the whole batch, returns the new row ids
+        created = time.time()
+        ids = []
+        with self._lock, self._db:
+            for name, review, sentiment, label in rows:
+                cursor = self._db.execute(
+                    'INSERT INTO reviews (name, review, sentiment, created, label) VALUES (?, ?, ?, ?, ?)',
+                    (name, review, sentiment, created, label))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def submit(self, name, review, sentiment, label=None, timeout=SUBMIT_TIMEOUT):
+        # blocks until the review is committed and returns its id
+        return self._batcher.submit((name, review, sentiment, label)).result(timeout=timeout)
+
+    def close(self):
+        self._batcher.close()
+        self._db.close()
+
+
+def read_reviews(since_id=0, path=store_file, limit=None):
+    """
+    Reviews with id > since_id in insertion order, for downstream
+    retraining. Pass the last id seen to read only new rows.
+    """
+    # imported here so the dashboards, which only write, start without pandas
+    import pandas as pd
+
+    query = 'SELECT id, name, review, sentiment, label, created FROM reviews WHERE id > ? ORDER BY id'
+    params = [int(since_id)]
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    db = connect(path)
+    try:
+        df = pd.read_sql_query(query, db, params=params)
+    finally:
+        db.close()
+    df['created'] = pd.to_datetime(df['created'], unit='s')
+    return df
+
+
+def import_csv(csv_path, path=store_file):
+    """
+    One-off migration of the old append-only csv. Each line of that file was
+    written as a single quoted "name,review,sentiment" field, so lines are
+    split on their first and last comma.
+    """
+    rows = []
+    with open(csv_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('"') and line.endswith('"'):
+                line = line[1:-1]
+            if line.count(',') < 2 or line == 'name,review,sentiment':
+                continue
+            name, rest = line.split(',', 1)
+            review, sentiment = rest.rsplit(',', 1)
+            rows.append((name, review, sentiment, time.time()))
+    db = connect(path)
+    with db:
+        db.executemany('INSERT INTO reviews (name, review, sentiment, created) VALUES (?, ?, ?, ?)', rows)
+    db.close()
+    return len(rows)
+
+
+if __name__ == '__main__':
+    # python review_store.py import [User_reviews.csv]
+    # python review_store.py dump
+    command = sys.argv[1] if len(sys.argv) > 1 else 'dump'
+    if command == 'import':
+        source = sys.argv[2] if len(sys.argv) > 2 else 'Dataset/User Review/User_reviews.csv'
+        print('imported {} reviews into {}'.format(import_csv(source), store_file))
+    else:
+        print(read_reviews().to_string(index=False))
@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+cache_file = 'Dataset/Cache/reviews.parquet'
+
+DEFAULT_CHUNKSIZE = 100000
+
+# explicit dtypes so pandas never has to infer them chunk by chunk
+REVIEW_DTYPES = {
+    'listing_id': 'Int64',
+    'id': 'Int64',
+    'reviewer_id': 'Int64',
+    'reviewer_name': 'category',
+    'comments': 'object',
+    'cleaned_comments': 'object',
+    'polarity': 'float64',
+    'sentiment': 'category',
+}
+
+# dtypes of the columnar cache, narrower than what the csv parser produces
+CACHE_DTYPES = dict(REVIEW_DTYPES, polarity='float32')
+
+# how many bytes from the start and end of the csv go into the fingerprint
+FINGERPRINT_BLOCK = 1 << 20
+
+
+def file_fingerprint(path):
+    """
+    Cheap fingerprint of a source file: size, modification time and a hash of
+    its first and last megabyte. Changes whenever the file is rewritten or
+    appended to, without having to read the whole dump.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if stat.st_size > FINGERPRINT_BLOCK:
+            f.seek(max(stat.st_size - FINGERPRINT_BLOCK, FINGERPRINT_BLOCK))
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return '{}-{}-{}'.format(stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+
+def peak_rss_mb():
+    # peak resident set size of this process so far
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+class LoadStats:
+    """Row count, throughput and peak memory of a streaming load."""
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def update(self, rows):
+        self.rows += rows
+        self.chunks += 1
+        self.elapsed = time.perf_counter() - self.start
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        return '{:,} rows in {} chunks, {:.1f}s ({:,.0f} rows/sec), peak RSS {:.0f} MB'.format(
+            self.rows, self.chunks, self.elapsed, self.rows_per_sec, peak_rss_mb())
+
+
+def csv_columns(path, columns=None, encoding=None):
+    # the requested columns that exist in the csv, and their explicit dtypes
+    header = pd.read_csv(path, nrows=0, encoding=encoding).columns
+    usecols = [col for col in header if columns is None or col in columns]
+    return usecols, {col: dtype for col, dtype in REVIEW_DTYPES.items() if col in usecols}
+
+
+def iter_review_chunks(path=csv_file, chunksize=DEFAULT_CHUNKSIZE, columns=None, stats=None, encoding=None):
+    """
+    Stream the reviews csv in fixed-size chunks with explicit dtypes. The
+    date column is parsed once per chunk into datetime64. Pass a LoadStats
+    to collect rows/sec and peak RSS.
+    """
+    usecols, dtypes = csv_columns(path, columns, encoding)
+    reader = pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunksize, encoding=encoding)
+    for chunk in reader:
+        if 'date' in chunk:
+            # rows whose date does not parse become NaT instead of failing the load
+            chunk['date'] = pd.to_datetime(chunk['date'], format='%Y-%m-%d', errors='coerce')
+        if stats is not None:
+            stats.update(len(chunk))
+        yield chunk
+
+
+def bounded_imap(executor, fn, items, window):
+    """
+    executor.map over a stream that only keeps window items in flight, so
+    the stream (e.g. iter_review_chunks) is never read ahead of what the
+    workers can take. Results come in input order.
+    """
+    pending = []
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def compact_dtypes(df):
+    # cast the known review columns to their cache dtypes
+    df = df.astype({col: dtype for col, dtype in CACHE_DTYPES.items() if col in df})
+    if 'date' in df and not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
+    return df
+
+
+def write_review_cache(df, source=csv_file, path=cache_file):
+    """
+    Store the cleaned reviews as parquet with compact dtypes. The sidecar
+    json records the fingerprint of the csv the cache was made from, so
+    load_reviews can tell when it has gone stale.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # per-process tmp files, several workers may refresh a stale cache at once
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    compact_dtypes(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    # the sidecar goes last: a reader seeing the new parquet with the old
+    # sidecar only takes the cache for stale, never reads a partial json
+    tmp_path = '{}.json.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'source': source, 'fingerprint': file_fingerprint(source)}, f)
+    os.replace(tmp_path, path + '.json')
+
+
+def cache_is_fresh(source=csv_file, path=cache_file):
+    if not os.path.exists(path) or not os.path.exists(path + '.json'):
+        return False
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    return meta.get('fingerprint') == file_fingerprint(source)
+
+
+def load_reviews(columns=None, source=csv_file, path=cache_file, encoding=None):
+    """
+    Shared loader for the cleaned reviews. Reads only the requested columns
+    from the parquet cache; when the cache is missing or older than the csv
+    it falls back to parsing the csv and refreshes the cache.
+    """
+    if cache_is_fresh(source, path):
+        return pd.read_parquet(path, columns=columns)
+
+    usecols, dtypes = csv_columns(source, encoding=encoding)
+    df = compact_dtypes(pd.read_csv(source, usecols=usecols, dtype=dtypes, encoding=encoding))
+    write_review_cache(df, source, path)
+    return df if columns is None else df[list(columns)]
+
+
+def benchmark_cache(source=csv_file, path=cache_file, columns=('date', 'sentiment')):
+    # load time and in-memory size: csv vs full cache vs projected cache
+    if not cache_is_fresh(source, path):
+        load_reviews(source=source, path=path)
+
+    def measure(label, load):
+        start = time.perf_counter()
+        df = load()
+        elapsed = time.perf_counter() - start
+        print('{:<28} {:>8.2f}s {:>10.1f} MB'.format(
+            label, elapsed, df.memory_usage(deep=True).sum() / 2 ** 20))
+
+    measure('csv', lambda: pd.read_csv(source))
+    measure('parquet cache', lambda: pd.read_parquet(path))
+    measure('parquet ' + '/'.join(columns), lambda: pd.read_parquet(path, columns=list(columns)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Streaming and cached access to reviews.csv')
+    parser.add_argument('source', nargs='?', default=csv_file)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--cache-benchmark', action='store_true',
+                        help='compare csv and parquet cache load time and memory')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.cache_benchmark:
+        benchmark_cache(args.source)
+    else:
+        load_stats = LoadStats()
+        for _ in iter_review_chunks(args.source, args.chunksize, stats=load_stats):
+            pass
+        print(load_stats.report())
@@ -0,0 +1,94 @@
+import argparse
+
+import pandas as pd
+from flask import Flask, jsonify, request
+
+import metrics
+import model_export
+import text_cleaning
+from micro_batcher import MicroBatcher
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 10
+REQUEST_TIMEOUT = 30
+
+
+# Load Models
+def load_models():
+    # memory-mapped export of the pickled vectorizer and model, shared by
+    # forked workers (rebuilt by model_export when the pickles change)
+    return model_export.load_models()
+
+
+class Scorer:
+    """Labels and class probabilities for a list of reviews."""
+
+    def __init__(self, vectorizer, model):
+        self.vectorizer = vectorizer
+        self.model = model
+        self.classes = [str(label) for label in model.classes_]
+
+    def score(self, reviews):
+        # one clean + transform + predict_proba call for the whole batch,
+        # cleaned like the reviews the model was trained on
+        with metrics.stage(self.model, 'clean', len(reviews)):
+            cleaned = text_cleaning.clean_series(pd.Series(reviews, dtype=object))
+        with metrics.stage(self.model, 'transform', len(reviews)):
+            features = self.vectorizer.transform(cleaned)
+        with metrics.stage(self.model, 'predict_proba', len(reviews)):
+            probabilities = self.model.predict_proba(features)
+        results = []
+        with metrics.stage(self.model, 'format', len(reviews)):
+            for row in probabilities:
+                best = row.argmax()
+                results.append({
+                    'label': self.classes[best],
+                    'probabilities': dict(zip(self.classes, row.round(6).tolist())),
+                })
+        return results
+
+
+def create_app(scorer, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    app = Flask(__name__)
+    batcher = MicroBatcher(scorer.score, max_batch_size, max_wait_ms / 1000)
+    app.config['batcher'] = batcher
+    # per-stage inference latencies in Prometheus format
+    metrics.register_route(app)
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        review = (request.get_json(silent=True) or {}).get('review')
+        if not isinstance(review, str):
+            return jsonify(error="expected a JSON body like {'review': '...'}"), 400
+        return jsonify(batcher.submit(review).result(timeout=REQUEST_TIMEOUT))
+
+    @app.route('/predict/batch', methods=['POST'])
+    def predict_batch():
+        reviews = (request.get_json(silent=True) or {}).get('reviews')
+        if not isinstance(reviews, list) or not all(isinstance(review, str) for review in reviews):
+            return jsonify(error="expected a JSON body like {'reviews': ['...', ...]}"), 400
+        if not reviews:
+            return jsonify(results=[])
+        return jsonify(results=scorer.score(reviews))
+
+    @app.route('/health')
+    def health():
+        return jsonify(status='ok', batches=batcher.batches, reviews=batcher.items,
+                       max_batch_size=batcher.max_batch_size, max_wait_ms=batcher.max_wait * 1000)
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Sentiment scoring service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    app = create_app(Scorer(*load_models()), args.max_batch_size, args.max_wait_ms)
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,702 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import review_store
+import reviews_io
+from query_engine import day_numbers
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+index_dir = 'Dataset/Search'
+
+# bump this whenever the layout of the manifest or the segment files changes
+INDEX_VERSION = 1
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SENTIMENTS = ['negative', 'neutral', 'positive']
+# reviews per segment written by a full build, bounds the build's memory
+SEGMENT_DOCS = 1000000
+# stored reviews are compressed together in blocks of this many
+DOC_BLOCK = 64
+# appended segments are merged once there are more than this many
+MAX_SMALL_SEGMENTS = 8
+# size of the sample top_k takes its first threshold from
+TOP_K_SAMPLE = 1 << 14
+
+
+def encode_varints(values):
+    """
+    LEB128 encoding of non-negative integers: 7 bits per byte, the high bit
+    set on every byte but the last of a value. Returns the bytes and the
+    number of bytes of each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        nbytes += values >= (1 << shift)
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(5):
+        has = nbytes > k
+        more = (nbytes[has] > k + 1).astype(np.uint8) << 7
+        out[starts[has] + k] = ((values[has] >> np.uint64(7 * k)) & np.uint64(127)).astype(np.uint8) | more
+    return out, nbytes
+
+
+def decode_varints(buf):
+    # vectorized inverse of encode_varints
+    buf = np.asarray(buf, dtype=np.uint8)
+    if not len(buf) or buf.max() < 128:
+        # every value fits in one byte, the common case for gaps and term frequencies
+        return buf
+    ends = np.flatnonzero(buf < 128)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts + 1
+    position = np.arange(len(buf)) - np.repeat(starts, lengths)
+    values = (buf & 127).astype(np.int64) << (7 * position)
+    return np.add.reduceat(values, starts)
+
+
+def kth_bound(scores, k):
+    """
+    A lower bound for the k-th highest score, 0 when there are fewer than k.
+    Exact on short lists, on long ones the k-th best of a strided sample.
+    """
+    if len(scores) < k:
+        return 0.0
+    if len(scores) > 4 * TOP_K_SAMPLE:
+        sample = scores[::len(scores) // TOP_K_SAMPLE]
+        return float(np.partition(sample, len(sample) - k)[len(sample) - k])
+    return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+
+def top_k(docs, scores, k):
+    """
+    The k highest scores, best first, ties going to the lowest doc id; docs
+    must be ascending. Long lists are first cut down to the scores at or
+    above kth_bound in a single comparison pass.
+    """
+    if len(scores) > 4 * TOP_K_SAMPLE:
+        above = np.flatnonzero(scores >= kth_bound(scores, k))
+        docs, scores = docs[above], scores[above]
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        better = scores > kth
+        tied = np.flatnonzero(scores == kth)[:k - int(better.sum())]
+        keep = np.sort(np.concatenate([np.flatnonzero(better), tied]))
+        docs, scores = docs[keep], scores[keep]
+    order = np.lexsort((docs, -scores))
+    return docs[order], scores[order]
+
+
+def query_terms(query):
+    # the query goes through the same cleaning as cleaned_comments, a list
+    # is taken as terms that are already clean
+    if isinstance(query, (list, tuple)):
+        return list(dict.fromkeys(query))
+    if not isinstance(query, str) or not query.strip():
+        return []
+    import text_cleaning
+    return list(dict.fromkeys(text_cleaning.clean_text(query).split()))
+
+
+class Segment:
+    """
+    An immutable slice of the index, one joblib file with memory-mapped
+    arrays:
+
+    - vocab maps a term to its id; postings of term t are its doc ids as
+      varint-encoded gaps in doc_gaps[doc_ptr[t]:doc_ptr[t + 1]] and the
+      matching term frequencies in tfs[tf_ptr[t]:tf_ptr[t + 1]]
+    - doc_len, days and sentiment are per review, for BM25 and the filters
+    - the reviewer name and comment of each review are stored as zlib
+      compressed json blocks of DOC_BLOCK reviews
+    """
+
+    def __init__(self, path):
+        self.path = path
+        state = joblib.load(path, mmap_mode='r')
+        self.__dict__.update(state)
+        self.n_docs = len(self.doc_len)
+        # for the collection statistics and skipping segments outside a date range
+        self.total_len = int(self.doc_len.sum())
+        dated = self.days[self.days >= 0]
+        self.first_day = int(dated.min()) if len(dated) else None
+        self.last_day = int(dated.max()) if len(dated) else None
+        self._norm = (None, None)
+
+    @staticmethod
+    def write(path, vocab, term_ids, doc_ids, tfs, doc_len, days, sentiment, rows):
+        """
+        Write a segment from flat (term id, doc id, tf) postings, in any
+        term order but with doc ids ascending for each term.
+        """
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)[order]
+        df = np.bincount(term_ids, minlength=len(vocab)).astype(np.int32)
+        posting_ptr = np.concatenate([[0], np.cumsum(df)])
+
+        # the first doc of a term is stored as is, the others as gaps
+        gaps = np.diff(doc_ids, prepend=0)
+        gaps[posting_ptr[:-1][df > 0]] = doc_ids[posting_ptr[:-1][df > 0]]
+        doc_gaps, gap_bytes = encode_varints(gaps)
+        tf_bytes_out, tf_bytes = encode_varints(np.asarray(tfs, dtype=np.int64)[order])
+
+        def byte_ptr(nbytes):
+            per_term = np.zeros(len(df), dtype=np.int64)
+            used = df > 0
+            per_term[used] = np.add.reduceat(nbytes, posting_ptr[:-1][used])
+            return np.concatenate([[0], np.cumsum(per_term)])
+
+        blocks = [zlib.compress(json.dumps(rows[start:start + DOC_BLOCK]).encode('utf-8'))
+                  for start in range(0, len(rows), DOC_BLOCK)]
+        state = {
+            'vocab': vocab,
+            'df': df,
+            'doc_ptr': byte_ptr(gap_bytes),
+            'doc_gaps': doc_gaps,
+            'tf_ptr': byte_ptr(tf_bytes),
+            'tfs': tf_bytes_out,
+            'doc_len': np.asarray(doc_len, dtype=np.int32),
+            'days': np.asarray(days, dtype=np.int32),
+            'sentiment': np.asarray(sentiment, dtype=np.int8),
+            'block_ptr': np.concatenate([[0], np.cumsum([len(block) for block in blocks])]).astype(np.int64),
+            'blocks': np.frombuffer(b''.join(blocks), dtype=np.uint8),
+        }
+        tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+        joblib.dump(state, tmp_file)
+        os.replace(tmp_file, path)
+        return Segment(path)
+
+    @staticmethod
+    def from_frame(path, df):
+        """
+        Index a frame of reviews with cleaned_comments, comments,
+        reviewer_name, date and sentiment columns.
+        """
+        vocab = {}
+        term_ids, tfs = array('i'), array('i')
+        terms_per_doc = np.zeros(len(df), dtype=np.int64)
+        doc_len = np.zeros(len(df), dtype=np.int32)
+        for i, text in enumerate(df['cleaned_comments'].tolist()):
+            tokens = text.split() if isinstance(text, str) else []
+            counts = Counter(tokens)
+            term_ids.extend([vocab.setdefault(term, len(vocab)) for term in counts])
+            tfs.extend(counts.values())
+            terms_per_doc[i] = len(counts)
+            doc_len[i] = len(tokens)
+        doc_ids = np.repeat(np.arange(len(df)), terms_per_doc)
+
+        sentiment = pd.Categorical(df['sentiment'].astype(object), categories=SENTIMENTS).codes
+        rows = [[name if isinstance(name, str) else '', comment if isinstance(comment, str) else '']
+                for name, comment in zip(df['reviewer_name'].astype(object), df['comments'].astype(object))]
+        return Segment.write(path, vocab, np.frombuffer(term_ids, dtype=np.int32), doc_ids,
+                             np.frombuffer(tfs, dtype=np.int32), doc_len, day_numbers(df['date']), sentiment, rows)
+
+    @staticmethod
+    def merge(path, segments):
+        # one segment holding the reviews of segments, in order
+        vocab, term_ids, doc_ids, tfs = {}, [], [], []
+        offset = 0
+        for segment in segments:
+            for term, term_id in segment.vocab.items():
+                docs, counts = segment.postings_of(term_id)
+                term_ids.append(np.full(len(docs), vocab.setdefault(term, len(vocab)), dtype=np.int64))
+                doc_ids.append(docs + offset)
+                tfs.append(counts)
+            offset += segment.n_docs
+        if not term_ids:
+            term_ids = doc_ids = tfs = [np.array([], dtype=np.int64)]
+        rows = [row for segment in segments for row in segment.documents(np.arange(segment.n_docs))]
+        return Segment.write(
+            path, vocab, np.concatenate(term_ids), np.concatenate(doc_ids), np.concatenate(tfs),
+            np.concatenate([segment.doc_len for segment in segments]),
+            np.concatenate([segment.days for segment in segments]),
+            np.concatenate([segment.sentiment for segment in segments]), rows)
+
+    def postings_of(self, term_id):
+        # (doc ids, term frequencies) of one term
+        gaps = decode_varints(self.doc_gaps[self.doc_ptr[term_id]:self.doc_ptr[term_id + 1]])
+        return np.cumsum(gaps, dtype=np.int32), decode_varints(self.tfs[self.tf_ptr[term_id]:self.tf_ptr[term_id + 1]])
+
+    def length_norm(self, avgdl):
+        # the document length part of BM25 for every doc, kept until avgdl changes
+        cached_avgdl, norm = self._norm
+        if cached_avgdl != avgdl:
+            norm = (K1 * (1 - B + B * self.doc_len / avgdl)).astype(np.float32)
+            self._norm = (avgdl, norm)
+        return norm
+
+    def doc_freq(self, term):
+        term_id = self.vocab.get(term)
+        return 0 if term_id is None else int(self.df[term_id])
+
+    def top(self, idfs, avgdl, k, sentiments=None, days=None, threshold=0.0):
+        """
+        (doc ids, scores) of the k best BM25 matches among the reviews
+        passing the filters. idfs maps each query term to its idf,
+        sentiments is a list of codes and days an inclusive range.
+        threshold is a score the caller already has k matches at or above,
+        reviews that cannot beat it are left out.
+
+        Terms are scored rarest first (MaxScore): a term adds at most
+        idf * (K1 + 1) to a review, so once the bound of the terms left is
+        below the k-th best score so far, reviews matching none of the
+        terms scored yet cannot reach the top k. The remaining, common,
+        terms then only update the scores of the candidates, and
+        candidates that cannot reach the k-th score are dropped.
+        """
+        norm = self.length_norm(avgdl)
+        filtered = sentiments is not None or days is not None
+        terms = sorted(((idf, self.vocab[term]) for term, idf in idfs.items() if term in self.vocab), reverse=True)
+        remaining = sum(idf * (K1 + 1) for idf, _ in terms)
+        docs, scores = np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+
+        for idf, term_id in terms:
+            kth = max(threshold, kth_bound(scores, k))
+            if remaining < kth:
+                hopeful = scores + remaining >= kth
+                docs, scores = docs[hopeful], scores[hopeful]
+                if not len(docs):
+                    break
+            term_docs, tfs = self.postings_of(term_id)
+
+            # with few candidates left they are looked up in the postings,
+            # otherwise scoring the whole posting list is as cheap
+            if remaining < kth and len(docs) * 4 < len(term_docs):
+                # only the candidates can still make it, look them up in the postings
+                if len(docs) * 64 > len(term_docs):
+                    # many candidates: one pass over the postings is cheaper than binary searches
+                    positions = np.full(self.n_docs, -1, dtype=np.int32)
+                    positions[term_docs] = np.arange(len(term_docs), dtype=np.int32)
+                    found = positions[docs]
+                    hit = found >= 0
+                else:
+                    found = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+                    hit = term_docs[found] == docs
+                tf = tfs[found[hit]].astype(np.float32)
+                scores[hit] += tf * np.float32(idf * (K1 + 1)) / (tf + norm[docs[hit]])
+            else:
+                term_scores = tfs.astype(np.float32)
+                term_scores *= np.float32(idf * (K1 + 1))
+                term_scores /= tfs + norm[term_docs]
+                if filtered:
+                    keep = self.passes(sentiments, days, term_docs)
+                    term_docs, term_scores = term_docs[keep], term_scores[keep]
+                docs, scores = self._union(docs, scores, term_docs, term_scores)
+            remaining -= idf * (K1 + 1)
+        return top_k(docs, scores, k)
+
+    def _union(self, docs, scores, term_docs, term_scores):
+        # add two sparse score vectors (ascending doc ids)
+        if not len(docs):
+            return term_docs, term_scores
+        if len(docs) + len(term_docs) > self.n_docs // 8:
+            dense = np.zeros(self.n_docs, dtype=np.float32)
+            dense[docs] = scores
+            dense[term_docs] += term_scores
+            docs = np.flatnonzero(dense).astype(np.int32)
+            return docs, dense[docs]
+        docs = np.concatenate([docs, term_docs])
+        order = np.argsort(docs, kind='stable')
+        docs = docs[order]
+        starts = np.flatnonzero(np.diff(docs, prepend=-1))
+        return docs[starts], np.add.reduceat(np.concatenate([scores, term_scores])[order], starts)
+
+    def passes(self, sentiments=None, days=None, docs=None):
+        # which of docs (all when None) pass the sentiment and date filters
+        doc_sentiment = self.sentiment if docs is None else self.sentiment[docs]
+        keep = np.ones(len(doc_sentiment), dtype=bool)
+        if sentiments is not None:
+            # lookup table by code, the extra last entry is code -1 (no sentiment)
+            allowed = np.zeros(len(SENTIMENTS) + 1, dtype=bool)
+            allowed[sentiments] = True
+            keep &= allowed[doc_sentiment]
+        if days is not None:
+            doc_days = self.days if docs is None else self.days[docs]
+            keep &= (doc_days >= days[0]) & (doc_days <= days[1])
+        return keep
+
+    def documents(self, doc_ids):
+        # [reviewer_name, comment] of each doc, decompressing each block once
+        blocks = {}
+        rows = []
+        for doc in np.asarray(doc_ids).tolist():
+            block = doc // DOC_BLOCK
+            if block not in blocks:
+                data = self.blocks[self.block_ptr[block]:self.block_ptr[block + 1]].tobytes()
+                blocks[block] = json.loads(zlib.decompress(data).decode('utf-8'))
+            rows.append(blocks[block][doc % DOC_BLOCK])
+        return rows
+
+
+class SearchIndex:
+    """
+    Full-text BM25 search over cleaned_comments, filterable by sentiment and
+    date. The index is a list of segments in index_dir, recorded in
+    manifest.json with the fingerprint of the csv they were built from and
+    the last user review store id they contain. A full build writes
+    SEGMENT_DOCS reviews per segment; newly submitted reviews are appended
+    as small segments, merged once there are more than MAX_SMALL_SEGMENTS.
+
+    Updates usually come from one process (`python search_index.py watch`),
+    the dashboards call refresh() to pick up the segments it adds. Manifest
+    updates hold a lock file, so concurrent builds or appends never lose or
+    delete each other's segments.
+    """
+
+    def __init__(self, path=index_dir, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.manifest = None
+        self.segments = []
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    @property
+    def n_docs(self):
+        return sum(segment.n_docs for segment in self.segments)
+
+    def load(self):
+        # (re)open the segments listed in the manifest, False if there is none
+        try:
+            mtime = os.stat(self.manifest_file).st_mtime_ns
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+        except OSError:
+            return False
+        if manifest.get('version') != INDEX_VERSION:
+            return False
+        opened = {segment.path: segment for segment in self.segments}
+        try:
+            segments = [opened.get(os.path.join(self.path, entry['file']))
+                        or Segment(os.path.join(self.path, entry['file']))
+                        for entry in manifest['segments']]
+        except OSError:
+            # a newer manifest already dropped and deleted one of these
+            # segments: keep the current ones, the next refresh reloads
+            return False
+        self.manifest, self.segments, self._mtime = manifest, segments, mtime
+        return True
+
+    def refresh(self):
+        # reload when the manifest changed, at most every check_interval seconds
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                self._checked = now
+                try:
+                    mtime = os.stat(self.manifest_file).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if mtime is not None and mtime != self._mtime:
+                    self.load()
+        return self
+
+    @contextmanager
+    def _locked(self):
+        """
+        Exclusive lock on the index directory for a read-modify-write of the
+        manifest, the manifest on disk is reloaded once it is held. There
+        is no fcntl on Windows, updates there must come from one process.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'a') as f:
+            try:
+                import fcntl
+            except ImportError:
+                fcntl = None
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_manifest(self, manifest):
+        # caller holds _locked(), self.manifest is the manifest being replaced
+        replaced = {entry['file'] for entry in (self.manifest or {}).get('segments', [])}
+        tmp_file = '{}.{}.tmp'.format(self.manifest_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+        self.load()
+        # segments the old manifest listed and this one dropped (a rebuild or
+        # a merge), the segments another process is still writing are not listed yet
+        for name in replaced - {entry['file'] for entry in manifest['segments']}:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    @staticmethod
+    def _new_segment_file():
+        # unique across processes, a counter in the manifest is not
+        return 'segment_{}.pkl'.format(uuid.uuid4().hex)
+
+    @staticmethod
+    def _entry(name, segment, small):
+        return {'file': name, 'n_docs': segment.n_docs, 'small': small}
+
+    def build(self, chunks, fingerprint=None, segment_docs=SEGMENT_DOCS):
+        """
+        Replace the index with one built from an iterable of review chunks,
+        written as segments of segment_docs reviews.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        manifest = {'version': INDEX_VERSION, 'fingerprint': fingerprint, 'store_last_id': 0, 'segments': []}
+        columns = ['cleaned_comments', 'comments', 'reviewer_name', 'date', 'sentiment']
+
+        def flush(frames):
+            name = self._new_segment_file()
+            segment = Segment.from_frame(os.path.join(self.path, name), pd.concat(frames, ignore_index=True))
+            manifest['segments'].append(self._entry(name, segment, small=False))
+
+        pending, n_pending = [], 0
+        for chunk in chunks:
+            chunk = chunk[[column for column in columns if column in chunk]]
+            while len(chunk):
+                take = chunk.iloc[:segment_docs - n_pending]
+                pending.append(take)
+                n_pending += len(take)
+                chunk = chunk.iloc[len(take):]
+                if n_pending == segment_docs:
+                    flush(pending)
+                    pending, n_pending = [], 0
+        if pending:
+            flush(pending)
+        # the segments are written without the lock, only the swap holds it
+        with self._locked():
+            self._save_manifest(manifest)
+        return self
+
+    def add_frame(self, df, store_last_id=None):
+        # append a frame of reviews as a new small segment
+        with self._locked():
+            return self._add_frame(df, store_last_id)
+
+    def _add_frame(self, df, store_last_id=None):
+        manifest = dict(self.manifest)
+        name = self._new_segment_file()
+        segment = Segment.from_frame(os.path.join(self.path, name), df)
+        manifest['segments'] = manifest['segments'] + [self._entry(name, segment, small=True)]
+        if store_last_id is not None:
+            manifest['store_last_id'] = int(store_last_id)
+        self._save_manifest(manifest)
+        if sum(entry['small'] for entry in manifest['segments']) > MAX_SMALL_SEGMENTS:
+            self._merge_small()
+        return len(df)
+
+    def merge_small(self):
+        # fold the appended segments into one, the full-build segments stay as they are
+        with self._locked():
+            self._merge_small()
+
+    def _merge_small(self):
+        manifest = dict(self.manifest)
+        small = [entry for entry in manifest['segments'] if entry['small']]
+        if len(small) < 2:
+            return
+        name = self._new_segment_file()
+        by_file = {os.path.basename(segment.path): segment for segment in self.segments}
+        segment = Segment.merge(os.path.join(self.path, name), [by_file[entry['file']] for entry in small])
+        manifest['segments'] = ([entry for entry in manifest['segments'] if not entry['small']]
+                                + [self._entry(name, segment, small=True)])
+        self._save_manifest(manifest)
+
+    def update_from_store(self, store=review_store.store_file):
+        """
+        Append the user reviews submitted since the last update. They are
+        cleaned like the csv reviews and keep the sentiment the model
+        predicted when they were submitted. Returns the number added.
+        """
+        if not os.path.exists(store):
+            return 0
+        import text_cleaning
+        # read and appended under one lock, two updaters never add the same reviews
+        with self._locked():
+            new = review_store.read_reviews(since_id=self.manifest['store_last_id'], path=store)
+            if new.empty:
+                return 0
+            comments = new['review'].fillna('').astype(str)
+            df = pd.DataFrame({'cleaned_comments': text_cleaning.clean_series(comments), 'comments': comments,
+                               'reviewer_name': new['name'], 'date': new['created'].dt.normalize(),
+                               'sentiment': new['sentiment']})
+            return self._add_frame(df, store_last_id=new['id'].max())
+
+    def search(self, query, k=10, sentiments=None, start=None, end=None):
+        """
+        The k reviews ranking highest by BM25 for query (a string, or a list
+        of cleaned terms), optionally only those with one of sentiments and
+        dated between start and end (inclusive). Returns a DataFrame with
+        score, date, reviewer_name, sentiment and comments columns, best
+        match first.
+
+        The cost grows with the posting lists of the rarest query term. A
+        query made only of terms that occur in most reviews scores those
+        lists whole, about 12-60ms per million reviews, so over tens of
+        millions of reviews such queries take well over 100ms: postings are
+        in doc id order and there is no impact-ordered early termination.
+        """
+        columns = ['score', 'date', 'reviewer_name', 'sentiment', 'comments']
+        terms = query_terms(query)
+        # refresh() may swap the list while this query runs
+        segments = self.segments
+        n_docs = sum(segment.n_docs for segment in segments)
+        if not terms or not n_docs:
+            return pd.DataFrame(columns=columns)
+
+        # collection statistics over every segment
+        avgdl = max(sum(segment.total_len for segment in segments) / n_docs, 1.0)
+        idfs = {}
+        for term in terms:
+            df = sum(segment.doc_freq(term) for segment in segments)
+            if df:
+                idfs[term] = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        codes = None if sentiments is None else [SENTIMENTS.index(s) for s in sentiments if s in SENTIMENTS]
+        days = None
+        if start is not None or end is not None:
+            days = (day_numbers([start])[0] if start is not None else 0,
+                    day_numbers([end])[0] if end is not None else np.iinfo(np.int32).max)
+
+        hits = []
+        for segment in segments:
+            # segments entirely outside the date range are skipped
+            if days is not None and (segment.first_day is None or segment.last_day < days[0]
+                                     or segment.first_day > days[1]):
+                continue
+            # the k-th best score of the segments before is a bound for this one
+            threshold = sorted(hit[0] for hit in hits)[-k] if len(hits) >= k else 0.0
+            docs, scores = segment.top(idfs, avgdl, k, codes, days, threshold)
+            hits.extend((score, segment, doc) for score, doc in zip(scores.tolist(), docs.tolist()))
+        # stable sort, equal scores stay in segment and doc order
+        hits = sorted(hits, key=lambda hit: -hit[0])[:k]
+
+        rows = []
+        for score, segment, doc in hits:
+            reviewer_name, comment = segment.documents([doc])[0]
+            day = int(segment.days[doc])
+            code = int(segment.sentiment[doc])
+            rows.append([round(score, 4), None if day < 0 else str(np.datetime64(day, 'D')), reviewer_name,
+                         SENTIMENTS[code] if code >= 0 else None, comment])
+        return pd.DataFrame(rows, columns=columns)
+
+
+def build(source=csv_file, path=index_dir, store=review_store.store_file):
+    # stream the csv into a fresh index, then append the submitted reviews
+    stats = reviews_io.LoadStats()
+    chunks = reviews_io.iter_review_chunks(
+        source, columns=['cleaned_comments', 'comments', 'reviewer_name', 'date', 'sentiment'], stats=stats)
+    index = SearchIndex(path)
+    index.load()
+    index.build(chunks, reviews_io.file_fingerprint(source))
+    index.update_from_store(store)
+    print('search index build: ' + stats.report())
+    return index
+
+
+def load_or_build(source=csv_file, path=index_dir):
+    """
+    Open the index, rebuilding it when it is missing, was written by another
+    version or the source csv fingerprint has changed.
+    """
+    index = SearchIndex(path)
+    if index.load() and index.manifest['fingerprint'] == reviews_io.file_fingerprint(source):
+        return index
+    return build(source, path)
+
+
+def benchmark(index, n_queries=200, k=10, random_state=0):
+    """
+    Query latency for one, two and three term queries drawn from the
+    vocabulary of the first segment, weighted towards frequent terms, with
+    and without a sentiment and date filter.
+    """
+    rng = np.random.default_rng(random_state)
+    segment = index.segments[0]
+    terms = np.array(list(segment.vocab), dtype=object)
+    df = np.asarray(segment.df, dtype=np.float64)[[segment.vocab[term] for term in terms]]
+    weights = np.sqrt(df) / np.sqrt(df).sum()
+    start_day, end_day = int(segment.days.min()), int(segment.days.max())
+
+    rows = []
+    for n_terms in (1, 2, 3):
+        for filtered in (False, True):
+            times = []
+            for _ in range(n_queries):
+                query = rng.choice(terms, n_terms, replace=False, p=weights).tolist()
+                kwargs = {}
+                if filtered:
+                    a, b = np.sort(rng.integers(start_day, end_day + 1, 2))
+                    kwargs = {'sentiments': ['negative'], 'start': np.datetime64(int(a), 'D'),
+                              'end': np.datetime64(int(b), 'D')}
+                began = time.perf_counter()
+                index.search(query, k, **kwargs)
+                times.append(time.perf_counter() - began)
+            times = np.array(times) * 1000
+            rows.append({'terms': n_terms, 'filtered': filtered, 'mean_ms': times.mean(),
+                         'p95_ms': np.percentile(times, 95), 'max_ms': times.max()})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Full-text BM25 search over the reviews')
+    parser.add_argument('command', choices=['build', 'update', 'watch', 'search', 'benchmark'])
+    parser.add_argument('query', nargs='?', default='', help='search terms for search')
+    parser.add_argument('--csv', default=csv_file)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--sentiment', action='append', choices=SENTIMENTS)
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls for watch')
+    parser.add_argument('--synthetic', type=int, help='benchmark on an index of this many synthetic reviews')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        search_index = build(args.csv)
+        print('{:,} reviews in {} segments at {}'.format(search_index.n_docs, len(search_index.segments), index_dir))
+    elif args.command in ('update', 'watch'):
+        search_index = load_or_build(args.csv)
+        while True:
+            print('appended {} submitted reviews'.format(search_index.update_from_store()))
+            if args.command == 'update':
+                break
+            time.sleep(args.interval)
+    elif args.command == 'search':
+        pd.set_option('display.max_colwidth', 120)
+        print(load_or_build(args.csv).search(args.query, args.k, args.sentiment).to_string(index=False))
+    else:
+        if args.synthetic:
+            import benchmark_charts
+            path = os.path.join(benchmark_charts.cache_dir, 'search_{}'.format(args.synthetic))
+            search_index = SearchIndex(path)
+            if not search_index.load():
+                started = time.perf_counter()
+                search_index.build(benchmark_charts.iter_synthetic_chunks(args.synthetic))
+                print('indexed {:,} synthetic reviews in {:.1f}s'.format(args.synthetic, time.perf_counter() - started))
+        else:
+            search_index = load_or_build(args.csv)
+        table = pd.DataFrame(benchmark(search_index, args.queries, args.k))
+        print(table.round(2).to_string(index=False))
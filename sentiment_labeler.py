@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+bins_file = 'Models/sentiment_bins.json'
+
+DEFAULT_CHUNKSIZE = 20000
+DEFAULT_TOLERANCE = 1e-9
+# thirds of the polarity range, what pd.cut(bins=3) gave on the full corpus
+DEFAULT_EDGES = [-1.0, -1 / 3, 1 / 3, 1.0]
+LABELS = ['negative', 'neutral', 'positive']
+
+# loaded once per process by _lexicon()
+_LEXICON = None
+
+
+def _lexicon():
+    """
+    TextBlob's polarity lexicon as arrays: a term index, the polarity each
+    term scores when no part-of-speech tag is given, and which terms can
+    modify (intensify) the next word. Only single-word entries, like the
+    assessments TextBlob makes for plain strings.
+    """
+    global _LEXICON
+    if _LEXICON is None:
+        from textblob.en import sentiment as pattern_sentiment
+        if not dict.__len__(pattern_sentiment):
+            pattern_sentiment.load()
+        terms = [term for term in dict.keys(pattern_sentiment) if ' ' not in term]
+        scores = [dict.__getitem__(pattern_sentiment, term) for term in terms]
+        _LEXICON = {
+            'analyzer': pattern_sentiment,
+            'index': pd.Index(terms),
+            'polarity': np.array([score[None][0] for score in scores], dtype=np.float64),
+            'modifier': np.array([any(tag in score for tag in pattern_sentiment.modifiers)
+                                  for score in scores]),
+            'negations': list(pattern_sentiment.negations),
+        }
+    return _LEXICON
+
+
+def _score_chunk(texts):
+    """
+    Mean lexicon polarity of each text, like TextBlob(text).sentiment.polarity.
+    Token ids go into a sparse (review x term) count matrix multiplied by the
+    polarity array. Texts where TextBlob's word-order rules could apply (a
+    modifier before another word, a negation, punctuation or emoticons) are
+    scored by TextBlob's own analyzer instead.
+    """
+    lexicon = _lexicon()
+    lowered = pd.Series(texts, dtype=object).fillna('').astype(str).str.lower()
+    split = lowered.str.split()
+    lengths = split.str.len().to_numpy()
+    tokens = pd.Series(list(chain.from_iterable(split)), dtype=object)
+    ids = lexicon['index'].get_indexer(tokens)
+    docs = np.repeat(np.arange(len(texts)), lengths)
+
+    known = ids >= 0
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(docs[known], minlength=len(texts)))])
+    X = sp.csr_matrix((np.ones(known.sum()), ids[known], indptr), shape=(len(texts), len(lexicon['index'])))
+    counts = np.diff(indptr)
+    polarity = (X @ lexicon['polarity']) / np.maximum(counts, 1)
+
+    # a known modifier followed by a known or short word may be merged with it
+    is_modifier = known & lexicon['modifier'][np.where(known, ids, 0)]
+    follows = (docs[1:] == docs[:-1]) & is_modifier[:-1] & (known[1:] | (tokens.str.len().to_numpy()[1:] <= 2))
+    exact = np.zeros(len(texts), dtype=bool)
+    exact[docs[:-1][follows]] = True
+    exact[docs[tokens.isin(lexicon['negations']).to_numpy()]] = True
+    exact |= lowered.str.contains(r'[^\w\s]', regex=True).to_numpy()
+
+    analyzer = lexicon['analyzer']
+    for i in np.flatnonzero(exact):
+        polarity[i] = analyzer(texts[i])[0]
+    return polarity
+
+
+def score_polarity(texts, n_jobs=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Polarity of every review, in chunks spread across a process pool when
+    there is more than one chunk. n_jobs defaults to the number of cores.
+    """
+    texts = pd.Series(texts).fillna('').astype(str)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1 or len(texts) <= chunksize:
+        return pd.Series(_score_chunk(texts.tolist()), index=texts.index, name='polarity')
+
+    chunks = [texts.iloc[start:start + chunksize].tolist()
+              for start in range(0, len(texts), chunksize)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        polarity = np.concatenate(list(executor.map(_score_chunk, chunks)))
+    return pd.Series(polarity, index=texts.index, name='polarity')
+
+
+def load_bins(path=bins_file):
+    # (edges, labels), the default thirds when no edges were saved yet
+    try:
+        with open(path) as f:
+            bins = json.load(f)
+    except FileNotFoundError:
+        return list(DEFAULT_EDGES), list(LABELS)
+    return bins['edges'], bins['labels']
+
+
+def save_bins(edges, labels=LABELS, path=bins_file):
+    with open(path, 'w') as f:
+        json.dump({'edges': [float(edge) for edge in edges], 'labels': list(labels)}, f, indent=1)
+
+
+def bin_sentiment(polarity, path=bins_file):
+    """
+    Sentiment labels from fixed, persisted bin edges, so the same polarity
+    always gets the same label whatever else is in the batch.
+    """
+    edges, labels = load_bins(path)
+    return pd.cut(polarity, edges, labels=labels, include_lowest=True)
+
+
+def regression_check(texts, sample=2000, tolerance=DEFAULT_TOLERANCE, random_state=42):
+    """
+    Compare score_polarity with TextBlob on a random sample. Returns the
+    sample size, the largest absolute difference, how many rows differ by
+    more than tolerance and the timing of both.
+    """
+    from textblob import TextBlob
+
+    texts = pd.Series(texts).fillna('').astype(str)
+    texts = texts.sample(min(sample, len(texts)), random_state=random_state)
+
+    start = time.perf_counter()
+    expected = texts.apply(lambda x: TextBlob(x).sentiment.polarity).to_numpy()
+    textblob_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = score_polarity(texts, n_jobs=1).to_numpy()
+    batch_time = time.perf_counter() - start
+
+    diff = np.abs(actual - expected)
+    return {
+        'rows': len(texts),
+        'max_diff': float(diff.max()) if len(diff) else 0.0,
+        'over_tolerance': int((diff > tolerance).sum()),
+        'tolerance': tolerance,
+        'textblob_rows_per_sec': len(texts) / textblob_time if textblob_time else float('inf'),
+        'batch_rows_per_sec': len(texts) / batch_time if batch_time else float('inf'),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch TextBlob-compatible polarity labeler')
+    parser.add_argument('csv', nargs='?', default='Dataset/Cleaned Data/reviews.csv')
+    parser.add_argument('--rows', type=int, default=None)
+    parser.add_argument('--sample', type=int, default=2000, help='rows compared against TextBlob')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--fit-bins', action='store_true',
+                        help='save the edges pd.cut(bins=3) picks on this csv as the fixed bins')
+    args = parser.parse_args()
+
+    comments = pd.read_csv(args.csv, encoding='latin1', usecols=['cleaned_comments'],
+                           nrows=args.rows)['cleaned_comments']
+
+    check = regression_check(comments, args.sample, args.tolerance)
+    print('regression sample: {rows} rows, max |diff| {max_diff:.2e}, '
+          '{over_tolerance} over {tolerance:g}'.format(**check))
+    print('textblob {:,.0f} reviews/sec, batch (1 process) {:,.0f} reviews/sec'.format(
+        check['textblob_rows_per_sec'], check['batch_rows_per_sec']))
+
+    start = time.perf_counter()
+    polarity = score_polarity(comments, n_jobs=args.jobs)
+    elapsed = time.perf_counter() - start
+    print('labeled {:,} reviews in {:.2f}s ({:,.0f} reviews/sec)'.format(
+        len(polarity), elapsed, len(polarity) / elapsed if elapsed else float('inf')))
+
+    if args.fit_bins:
+        _, edges = pd.cut(polarity, bins=3, retbins=True)
+        save_bins(edges)
+        print('saved bin edges {} to {}'.format(np.round(edges, 6).tolist(), bins_file))
+    print(bin_sentiment(polarity).value_counts().to_string())
+    raise SystemExit(1 if check['over_tolerance'] else 0)
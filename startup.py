@@ -0,0 +1,186 @@
+import argparse
+import importlib
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# time budgets checked by `python startup.py <module>`
+DEFAULT_MAX_IMPORT_SEC = 5.0
+DEFAULT_MAX_READY_SEC = 25.0
+
+
+class StartupProfile:
+    """Wall-clock duration of named startup phases, relative to creation."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append({'phase': name, 'thread': threading.current_thread().name,
+                                    'start_sec': round(start - self.started, 4),
+                                    'duration_sec': round(end - start, 4)})
+
+    def report(self):
+        with self._lock:
+            phases = list(self.phases)
+        return {'uptime_sec': round(time.perf_counter() - self.started, 4), 'phases': phases}
+
+
+class Warmup:
+    """
+    Named resources (data, models, rendered images) loaded one after the
+    other in a background thread, so the server answers requests while they
+    load. get(name) blocks until that resource is there, starting the thread
+    on first use if start() was not called. Only required resources hold
+    back readiness, the others are warmed but may still be loading when the
+    app reports ready.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile if profile is not None else StartupProfile()
+        self._loaders = OrderedDict()
+        self._required = set()
+        self._events = {}
+        self._values = {}
+        self._errors = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self.ready_sec = None
+
+    def add(self, name, loader, required=True):
+        self._loaders[name] = loader
+        self._events[name] = threading.Event()
+        if required:
+            self._required.add(name)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def _run(self):
+        for name, loader in self._loaders.items():
+            try:
+                with self.profile.phase(name):
+                    self._values[name] = loader()
+            except Exception as e:
+                self._errors[name] = e
+            self._events[name].set()
+            if self.ready_sec is None and self.ready():
+                self.ready_sec = round(time.perf_counter() - self.profile.started, 4)
+
+    def get(self, name, timeout=None):
+        self.start()
+        if not self._events[name].wait(timeout):
+            raise TimeoutError('{} is still loading'.format(name))
+        if name in self._errors:
+            raise RuntimeError('{} failed to load'.format(name)) from self._errors[name]
+        return self._values[name]
+
+    def wait(self, timeout=None):
+        # block until every resource has loaded or failed
+        self.start()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def ready(self):
+        return all(self._events[name].is_set() and name not in self._errors for name in self._required)
+
+    def status(self):
+        return {
+            'ready': self.ready(),
+            'ready_sec': self.ready_sec,
+            'loaded': [name for name in self._loaders if self._events[name].is_set() and name not in self._errors],
+            'loading': [name for name in self._loaders if not self._events[name].is_set()],
+            'failed': {name: repr(error) for name, error in self._errors.items()},
+        }
+
+    def register_routes(self, server, ready_route='/ready', profile_route='/startup-profile'):
+        """
+        Readiness and profiling routes on the Flask server behind a Dash
+        app: ready_route answers 200 once the required resources are
+        loaded and 503 before, profile_route returns the phase timings.
+        """
+        def ready():
+            status = self.status()
+            return status, 200 if status['ready'] else 503
+
+        def profile():
+            report = self.profile.report()
+            report.update(self.status())
+            return report
+
+        server.add_url_rule(ready_route, 'warmup_ready', ready)
+        server.add_url_rule(profile_route, 'warmup_profile', profile)
+
+
+def import_times(module, top=20):
+    """
+    Cumulative import time of the heaviest modules pulled in by importing
+    module, measured in a fresh interpreter with `python -X importtime`.
+    Returns (total_sec, rows) with rows sorted by cumulative time.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError('importing {} failed:\n{}'.format(module, result.stderr[-2000:]))
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append({'module': name.strip(), 'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+                     'self_sec': int(self_us) / 1e6, 'cumulative_sec': int(cumulative_us) / 1e6})
+    total = next((row['cumulative_sec'] for row in rows if row['module'] == module), 0.0)
+    # only the top-level packages, nested modules are counted in them
+    top_level = [row for row in rows if row['depth'] <= 1 and row['module'] != module]
+    top_level.sort(key=lambda row: row['cumulative_sec'], reverse=True)
+    return total, top_level[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import-time and startup-phase profile of a dashboard entry point')
+    parser.add_argument('module', nargs='?', default='dashboard', help='dashboard or test')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-import-sec', type=float, default=DEFAULT_MAX_IMPORT_SEC)
+    parser.add_argument('--max-ready-sec', type=float, default=DEFAULT_MAX_READY_SEC)
+    args = parser.parse_args()
+
+    total, rows = import_times(args.module, args.top)
+    print('import {}: {:.3f}s (fresh interpreter)'.format(args.module, total))
+    for row in rows:
+        print('  {:>8.3f}s  {}'.format(row['cumulative_sec'], row['module']))
+
+    start = time.perf_counter()
+    app_module = importlib.import_module(args.module)
+    import_sec = time.perf_counter() - start
+    app_module.warmup.wait()
+    report = app_module.warmup.profile.report()
+    status = app_module.warmup.status()
+
+    print('startup phases:')
+    for phase in report['phases']:
+        print('  {:>8.3f}s  +{:.3f}s  {} ({})'.format(phase['duration_sec'], phase['start_sec'],
+                                                   phase['phase'], phase['thread']))
+    for name, error in status['failed'].items():
+        print('  failed: {} {}'.format(name, error))
+    print('importable after {:.3f}s, ready after {}s'.format(import_sec, status['ready_sec']))
+
+    over_budget = (import_sec > args.max_import_sec or status['ready_sec'] is None
+                   or status['ready_sec'] > args.max_ready_sec)
+    raise SystemExit(1 if over_budget else 0)
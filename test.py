@@ -2,13 +2,15 @@ import dash
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-import pandas as pd
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import base64
 import plotly.graph_objects as go
 from flask import Flask
 import os
-import charts
+import callback_cache
+import metrics
+import startup
 
 server = Flask(__name__)
 
@@ -58,413 +60,525 @@ db_logo_img = dbc.Col([logo_img],
                       xs=dict(size=3, offset=0), sm=dict(size=3, offset=0),
                       md=dict(size=2, offset=0), lg=dict(size=2, offset=0), xl=dict(size=2, offset=0))
 
-df = pd.read_csv(csv_file)
+def load_data():
+    # only the precomputed aggregates are loaded at startup, the raw csv is
+    # read again only when its fingerprint changes (see aggregates.py)
+    import aggregates
+    import time_buckets
+    import word_index
+    aggs = aggregates.load_or_build(csv_file)
+    monthly = time_buckets.rollup(aggs['daily'], 'month')
+    # word counts come from the persistent word index, only new rows get indexed
+    word_idx = word_index.load_or_build(csv_file)
+    return aggs, monthly, word_idx
 
 
-# ---------------------------------------------------------------------------------------
+def load_engine():
+    # indexed reviewer / date / sentiment counts behind the dashboard filters
+    import query_engine
+    return query_engine.load_or_build(csv_file)
 
-tweets_num_text = html.Div(html.H1('Total Number of Reviews', className='info-header', id='tweets_num_text',
-                                   style=dict(fontWeight='bold', color='black')),
-                           style=dict(textAlign="center", width='100%'))
 
-tweets_num = df['cleaned_comments'].count()
+def data_version():
+    aggs, _, word_idx = warmup.get('data')
+    return '{}|{}'.format(aggs['fingerprint'], word_idx.data_version)
 
-tweets_num_fig = go.Figure()
 
 indicator_size = 27
-tweets_num_fig.add_trace(go.Indicator(
-    mode="number",
-    value=tweets_num,
-    number={'font': {'color': '#DC143C',
-                     'size': indicator_size}, 'valueformat': ","},
-    domain={'row': 0, 'column': 0}
-))
+COUNT_NUMBER = {'font': {'color': '#DC143C', 'size': indicator_size}, 'valueformat': ","}
+PERCENT_NUMBER = {'font': {'color': '#DC143C', 'size': indicator_size}, 'suffix': "%"}
+SENTIMENTS = ['positive', 'negative', 'neutral']
 
 
-tweets_num_fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0),
-
-                             )
-
-tweets_num_indicator = html.Div(dcc.Graph(figure=tweets_num_fig, config={
-                                'displayModeBar': False}, id='tweets_num_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
-
-# ---------------------------------------------------------------------------------------
-
-retweets_avg_text = html.Div(html.H1('Average Number of Reviews', className='info-header', id='retweets_avg_text',
-                                     style=dict(fontWeight='bold', color='black')),
-                             style=dict(textAlign="center", width='100%'))
-
-
-retweets_avg = round(df['cleaned_comments'].count() + 3500 /
-                     len(df['cleaned_comments'].unique()), 2)
-
-retweets_avg_fig = go.Figure()
-
-retweets_avg_fig.add_trace(go.Indicator(
-    mode="number",
-    value=retweets_avg,
-    number={'font': {'color': '#DC143C',
-                     'size': indicator_size}, 'valueformat': ","},
-    domain={'row': 0, 'column': 0}
-))
-
-
-retweets_avg_fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0),
-
-                               )
-
-retweets_avg_indicator = html.Div(dcc.Graph(figure=retweets_avg_fig, config={
-                                  'displayModeBar': False}, id='retweets_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
-
-# ---------------------------------------------------------------------------------------
-
-likes_avg_text = html.Div(html.H1('Average Number of Positive Reviews', className='info-header', id='likes_avg_text',
-                                  style=dict(fontWeight='bold', color='black')),
-                          style=dict(textAlign="center", width='100%'))
-
-# getting avg positive sentiments from the dataframe
-likes_avg = round(df[df['sentiment'] == 'positive']
-                  ['sentiment'].count() / len(df) * 100, 2)
-
-likes_avg_fig = go.Figure()
-
-likes_avg_fig.add_trace(go.Indicator(
-    mode="number",
-    value=likes_avg,
-    number={'font': {'color': '#DC143C', 'size': indicator_size}, 'suffix': "%"},
-    domain={'row': 0, 'column': 0}
-))
-
-likes_avg_fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0),
-
-                            )
-
-likes_avg_indicator = html.Div(dcc.Graph(figure=likes_avg_fig, config={
-                               'displayModeBar': False}, id='likes_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
-
-# ---------------------------------------------------------------------------------------
-
-replies_avg_text = html.Div(html.H1('Average Number of Negative Reviews', className='info-header', id='replies_avg_text',
-                                    style=dict(fontWeight='bold', color='black')),
-                            style=dict(textAlign="center", width='100%'))
-
-
-replies_avg = round(df[df['sentiment'] == 'negative']
-                    ['sentiment'].count() / len(df['sentiment']) * 100, 2)
-
+def indicator_figure(value, number):
+    fig = go.Figure()
+    fig.add_trace(go.Indicator(mode="number", value=value, number=number, domain={'row': 0, 'column': 0}))
+    fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0))
+    return fig
 
-replies_avg_fig = go.Figure()
 
-replies_avg_fig.add_trace(go.Indicator(
-    mode="number",
-    value=replies_avg,
-    number={'font': {'color': '#DC143C', 'size': indicator_size}, 'suffix': "%"},
-    domain={'row': 0, 'column': 0}
-))
+def build_figure(card, aggs, monthly, word_idx):
+    """Figure of one dashboard card, drawn from the loaded aggregates."""
+    import charts
+    sentiment_counts = aggs['sentiment_counts']
+
+    if card == 'tweets_num_indicator':
+        return indicator_figure(aggs['n_comments'], COUNT_NUMBER)
+    elif card == 'retweets_avg_indicator':
+        return indicator_figure(round(aggs['n_comments'] + 3500 / aggs['n_unique_comments'], 2), COUNT_NUMBER)
+    elif card == 'likes_avg_indicator':
+        # getting avg positive sentiments from the dataframe
+        return indicator_figure(round(sentiment_counts.get('positive', 0) / aggs['n_rows'] * 100, 2), PERCENT_NUMBER)
+    elif card == 'replies_avg_indicator':
+        return indicator_figure(round(sentiment_counts.get('negative', 0) / aggs['n_rows'] * 100, 2), PERCENT_NUMBER)
+    elif card == 'countries_num_indicator':
+        return indicator_figure(round(sentiment_counts.get('neutral', 0) / aggs['n_rows'] * 100, 2), PERCENT_NUMBER)
+    elif card == 'hor_bar_chart':
+        return charts.create_graph_from_counts(aggs['reviewer_counts'])
+    elif card == 'ver_bar_chart':
+        return charts.create_graph2_from_counts(aggs['reviewer_counts'])
+    elif card == 'common_words':
+        return charts.wordcloud_from_counts(word_idx.top(100))
+    elif card == 'circle_chart':
+        return charts.circle(None)
+    elif card == 'bubble_chart':
+        return charts.bubble(None)
+    elif card == 'polar_area_chart':
+        return charts.polar_area(None)
+    elif card == 'time_series_chart':
+        return charts.time_series_from_counts(monthly['total'])
+    elif card == 'time_sentiment_chart':
+        return charts.time_sentiment_from_counts(monthly)
+    raise KeyError(card)
+
+
+# indicator cards showing the share of one sentiment
+SENTIMENT_CARDS = {'likes_avg_indicator': 'positive', 'replies_avg_indicator': 'negative',
+                   'countries_num_indicator': 'neutral'}
+# cards that follow the reviewer / date range / sentiment filters
+FILTERED_CARDS = ['tweets_num_indicator', 'time_series_chart', 'time_sentiment_chart'] + list(SENTIMENT_CARDS)
+
+
+def build_filtered_figure(card, engine, reviewer=None, start=None, end=None, sentiments=None):
+    """
+    Figure of a filterable card for one reviewer / date range / sentiment
+    slice, from the query engine's indexed counts.
+    """
+    import charts
+    counts = engine.counts(reviewer, start, end)
+    selected = counts['total'] if sentiments is None else sum(counts.get(sentiment, 0) for sentiment in sentiments)
+
+    if card == 'tweets_num_indicator':
+        return indicator_figure(selected, COUNT_NUMBER)
+    elif card in SENTIMENT_CARDS:
+        sentiment = SENTIMENT_CARDS[card]
+        share = counts.get(sentiment, 0) if sentiments is None or sentiment in sentiments else 0
+        return indicator_figure(round(share / selected * 100, 2) if selected else 0, PERCENT_NUMBER)
+
+    table = engine.series(reviewer, start, end, 'month')
+    if sentiments is not None:
+        table = table[[sentiment for sentiment in sentiments if sentiment in table]].assign(
+            total=lambda selected_table: selected_table.sum(axis=1))
+    if card == 'time_series_chart':
+        return charts.time_series_from_counts(table['total'])
+    elif card == 'time_sentiment_chart':
+        return charts.time_sentiment_from_counts(table)
+    raise KeyError(card)
+
+
+# graph ids of the cards loaded through their own callback
+CARDS = ['tweets_num_indicator', 'retweets_avg_indicator', 'likes_avg_indicator', 'replies_avg_indicator',
+         'countries_num_indicator', 'hor_bar_chart', 'ver_bar_chart', 'common_words', 'circle_chart',
+         'bubble_chart', 'polar_area_chart', 'time_series_chart', 'time_sentiment_chart']
+
+
+def blank_figure(height=None):
+    # placeholder shipped with the layout until the card's figure arrives
+    layout = dict(paper_bgcolor='#f7f7f7', plot_bgcolor='#f7f7f7', margin=dict(l=0, r=0, t=0, b=0),
+                  xaxis=dict(visible=False), yaxis=dict(visible=False))
+    if height:
+        layout['height'] = height
+    return dict(data=[], layout=layout)
+
+
+def lazy_card(graph, className='', **kwargs):
+    # assets/lazy_cards.js sets the store's data once the card scrolls into
+    # view, which fires the card's callback
+    return html.Div([graph, dcc.Store(id=graph.id + '_visible')],
+                    className=('lazy-card ' + className).strip(), **{'data-card': graph.id}, **kwargs)
+
+
+def build_main_layout():
+    # only the card shells, every figure is loaded by its own callback
+
+    # the reviewer options are filled in by reviewer_options
+    filters_row = dbc.Row([
+        dbc.Col(dcc.Dropdown(id='reviewer_filter', placeholder='All reviewers', clearable=True),
+                md=dict(size=4, offset=0), xs=dict(size=12, offset=0)),
+        dbc.Col(dcc.DatePickerRange(id='date_filter', clearable=True, display_format='YYYY-MM-DD'),
+                md=dict(size=4, offset=0), xs=dict(size=12, offset=0)),
+        dbc.Col(dcc.Checklist(id='sentiment_filter', options=SENTIMENTS, value=SENTIMENTS, inline=True,
+                              inputStyle=dict(marginLeft='1vw', marginRight='0.3vw')),
+                md=dict(size=4, offset=0), xs=dict(size=12, offset=0)),
+    ], id='filters', style=dict(padding='1vh 1vw', alignItems='center', backgroundColor='white'))
+
+    # ---------------------------------------------------------------------------------------
+
+    tweets_num_text = html.Div(html.H1('Total Number of Reviews', className='info-header', id='tweets_num_text',
+                                       style=dict(fontWeight='bold', color='black')),
+                               style=dict(textAlign="center", width='100%'))
 
-replies_avg_fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0),
+    tweets_num_indicator = lazy_card(dcc.Graph(figure=blank_figure(50), config={
+                                    'displayModeBar': False}, id='tweets_num_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
-                              )
+    # ---------------------------------------------------------------------------------------
 
-replies_avg_indicator = html.Div(dcc.Graph(figure=replies_avg_fig, config={
-                                 'displayModeBar': False}, id='replies_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
+    retweets_avg_text = html.Div(html.H1('Average Number of Reviews', className='info-header', id='retweets_avg_text',
+                                         style=dict(fontWeight='bold', color='black')),
+                                 style=dict(textAlign="center", width='100%'))
 
+    retweets_avg_indicator = lazy_card(dcc.Graph(figure=blank_figure(50), config={
+                                      'displayModeBar': False}, id='retweets_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
-# ---------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------
 
-countries_num_text = html.Div(html.H1('Average Number of Neutral Reviews', className='info-header', id='countries_num_text',
+    likes_avg_text = html.Div(html.H1('Average Number of Positive Reviews', className='info-header', id='likes_avg_text',
                                       style=dict(fontWeight='bold', color='black')),
                               style=dict(textAlign="center", width='100%'))
 
-countries_num = round(df[df['sentiment'] == 'neutral']
-                      ['sentiment'].count() / len(df['sentiment']) * 100, 2)
+    likes_avg_indicator = lazy_card(dcc.Graph(figure=blank_figure(50), config={
+                                   'displayModeBar': False}, id='likes_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
+    # ---------------------------------------------------------------------------------------
 
-countries_num_fig = go.Figure()
-
-countries_num_fig.add_trace(go.Indicator(
-    mode="number",
-    value=countries_num,
-    number={'font': {'color': '#DC143C',
-                     'size': indicator_size}, 'suffix': "%"},
-    domain={'row': 0, 'column': 0}
-))
-
-countries_num_fig.update_layout(paper_bgcolor="#f7f7f7", plot_bgcolor='white', height=50, margin=dict(l=0, r=0, t=0, b=0),
+    replies_avg_text = html.Div(html.H1('Average Number of Negative Reviews', className='info-header', id='replies_avg_text',
+                                        style=dict(fontWeight='bold', color='black')),
+                                style=dict(textAlign="center", width='100%'))
 
-                                )
+    replies_avg_indicator = lazy_card(dcc.Graph(figure=blank_figure(50), config={
+                                     'displayModeBar': False}, id='replies_avg_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
-countries_num_indicator = html.Div(dcc.Graph(figure=countries_num_fig, config={
-                                   'displayModeBar': False}, id='countries_num_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
-# Edward Zavala -------------- :)!!!!!!!
+    # ---------------------------------------------------------------------------------------
 
-hor_bar_chart_header = html.Div(html.H1('Sentiment Score by Reviewer Name', className='date-chart-header', id='hor_bar_chart_header',
-                                        style=dict(fontWeight='bold', color='black',
-                                                   marginTop='')),
-                                style=dict(textAlign="center", width='100%'))
+    countries_num_text = html.Div(html.H1('Average Number of Neutral Reviews', className='info-header', id='countries_num_text',
+                                          style=dict(fontWeight='bold', color='black')),
+                                  style=dict(textAlign="center", width='100%'))
 
+    countries_num_indicator = lazy_card(dcc.Graph(figure=blank_figure(50), config={
+                                       'displayModeBar': False}, id='countries_num_indicator', style=dict(width='100%')), className='num', style=dict(width='100%'))
 
-hor_bar_chart = charts.create_graph(df)
-hor_bar_chart_div = html.Div([
-    dcc.Graph(id='hor_bar_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                          'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='hor-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=hor_bar_chart
-              )], id='hor_bar_chart_div'
-)
+    # Edward Zavala -------------- :)!!!!!!!
 
+    hor_bar_chart_header = html.Div(html.H1('Sentiment Score by Reviewer Name', className='date-chart-header', id='hor_bar_chart_header',
+                                            style=dict(fontWeight='bold', color='black',
+                                                       marginTop='')),
+                                    style=dict(textAlign="center", width='100%'))
 
-ver_bar_chart_header = html.Div(html.H1('Sentiment Score by Reviews', className='date-chart-header', id='ver_bar_chart_header',
-                                        style=dict(fontWeight='bold', color='black')),
-                                style=dict(textAlign="center", width='100%'))
 
+    hor_bar_chart_div = lazy_card(
+        dcc.Graph(id='hor_bar_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                              'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='hor-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='hor_bar_chart_div'
+    )
 
-ver_bar_chart = charts.create_graph2(df)
-ver_bar_chart_div = html.Div([
-    dcc.Graph(id='ver_bar_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                          'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=ver_bar_chart
-              )], id='ver_bar_chart_div'
-)
 
-# ---------------------------------------------------------------------------------------
+    ver_bar_chart_header = html.Div(html.H1('Sentiment Score by Reviews', className='date-chart-header', id='ver_bar_chart_header',
+                                            style=dict(fontWeight='bold', color='black')),
+                                    style=dict(textAlign="center", width='100%'))
 
-common_words = html.Div(html.H1('Common Words', className='date-chart-header', id='common_words',
-                                style=dict(fontWeight='bold', color='black')),
-                        style=dict(textAlign="center", width='100%'))
 
-common_words_fig = charts.wordcloud(df)
-common_words_div = html.Div([
-    dcc.Graph(id='common_words', config={'displayModeBar': True, 'displaylogo': False,
-                                         'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=common_words_fig
-              )], id='common_words_div'
-)
+    ver_bar_chart_div = lazy_card(
+        dcc.Graph(id='ver_bar_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                              'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='ver_bar_chart_div'
+    )
 
-# ---------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------
 
-circle_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='circle_chart_header',
-                                       style=dict(fontWeight='bold', color='black')),
-                               style=dict(textAlign="center", width='100%'))
+    common_words = html.Div(html.H1('Common Words', className='date-chart-header', id='common_words_header',
+                                    style=dict(fontWeight='bold', color='black')),
+                            style=dict(textAlign="center", width='100%'))
 
+    common_words_div = lazy_card(
+        dcc.Graph(id='common_words', config={'displayModeBar': True, 'displaylogo': False,
+                                             'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='common_words_div'
+    )
 
-circle_chart = charts.circle(df)
-circle_chart_div = html.Div([
-    dcc.Graph(id='circle_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                         'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=circle_chart
-              )], id='circle_chart_div'
-)
+    # ---------------------------------------------------------------------------------------
 
-# ---------------------------------------------------------------------------------------
+    circle_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='circle_chart_header',
+                                           style=dict(fontWeight='bold', color='black')),
+                                   style=dict(textAlign="center", width='100%'))
 
-bubble_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='bubble_chart_header',
-                                       style=dict(fontWeight='bold', color='black')),
-                               style=dict(textAlign="center", width='100%'))
 
-bubble_chart = charts.bubble(df)
-bubble_chart_div = html.Div([
-    dcc.Graph(id='bubble_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                         'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=bubble_chart
-              )], id='bubble_chart_div'
-)
+    circle_chart_div = lazy_card(
+        dcc.Graph(id='circle_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                             'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='circle_chart_div'
+    )
 
-# ---------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------
 
-polar_area_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='polar_area_chart_header',
+    bubble_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='bubble_chart_header',
                                            style=dict(fontWeight='bold', color='black')),
                                    style=dict(textAlign="center", width='100%'))
 
-polar_area_chart = charts.polar_area(df)
-polar_area_chart_div = html.Div([
-    dcc.Graph(id='polar_area_chart', config={'displayModeBar': True, 'displaylogo': False,
+    bubble_chart_div = lazy_card(
+        dcc.Graph(id='bubble_chart', config={'displayModeBar': True, 'displaylogo': False,
                                              'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=polar_area_chart
-              )], id='polar_area_chart_div'
-)
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='bubble_chart_div'
+    )
 
-# ---------------------------------------------------------------------------------------
+    # ---------------------------------------------------------------------------------------
 
-time_series_chart_header = html.Div(html.H1('Frequency of Reviews by Year', className='date-chart-header', id='time_series_chart_header',
-                                            style=dict(fontWeight='bold', color='black')),
-                                    style=dict(textAlign="center", width='100%'))
+    polar_area_chart_header = html.Div(html.H1('Sentiments', className='date-chart-header', id='polar_area_chart_header',
+                                               style=dict(fontWeight='bold', color='black')),
+                                       style=dict(textAlign="center", width='100%'))
 
-time_series_chart = charts.time_series(df)
-time_series_chart_div = html.Div([
-    dcc.Graph(id='time_series_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                              'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=time_series_chart
-              )], id='time_series_chart_div'
-)
+    polar_area_chart_div = lazy_card(
+        dcc.Graph(id='polar_area_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                                 'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='polar_area_chart_div'
+    )
 
+    # ---------------------------------------------------------------------------------------
 
-# ---------------------------------------------------------------------------------------
+    time_series_chart_header = html.Div(html.H1('Frequency of Reviews by Year', className='date-chart-header', id='time_series_chart_header',
+                                                style=dict(fontWeight='bold', color='black')),
+                                        style=dict(textAlign="center", width='100%'))
 
-time_sentiment_chart_header = html.Div(html.H1('Sentiment Score by Date', className='date-chart-header', id='time_sentiment_chart_header',
-                                               style=dict(fontWeight='bold', color='black')),
-                                       style=dict(textAlign="center", width='100%'))
+    time_series_chart_div = lazy_card(
+        dcc.Graph(id='time_series_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                                  'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='time_series_chart_div'
+    )
 
-time_sentiment_chart = charts.time_sentiment(df)
-time_sentiment_chart_div = html.Div([
-    dcc.Graph(id='time_sentiment_chart', config={'displayModeBar': True, 'displaylogo': False,
-                                                 'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
-              style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=time_sentiment_chart
-              )], id='time_sentiment_chart_div'
-)
 
-# ---------------------------------------------------------------------------------------
-
-main_layout = html.Div([dbc.Row([db_logo_img, db_header_text],
-                                style=dict(backgroundColor='white'), id='main_header'),
-                        # html.Br(),
+    # ---------------------------------------------------------------------------------------
+
+    time_sentiment_chart_header = html.Div(html.H1('Sentiment Score by Date', className='date-chart-header', id='time_sentiment_chart_header',
+                                                   style=dict(fontWeight='bold', color='black')),
+                                           style=dict(textAlign="center", width='100%'))
 
-                       dbc.Row([
-                           html.Div([
-
-                               dbc.Card(dbc.CardBody([tweets_num_text,
-                                                     dbc.Spinner([tweets_num_indicator], size="lg", color="primary",
-                                                                 type="border", fullscreen=False,
-                                                                 spinner_style=dict(marginTop=''))
-
-                                                      ]), style=dict(backgroundColor='#f7f7f7'), id='card3',
-                                        className='info-card'),
-
-
-                               dbc.Card(dbc.CardBody([retweets_avg_text,
-                                                      dbc.Spinner([retweets_avg_indicator], size="lg", color="primary",
-                                                                  type="border", fullscreen=False,
-                                                                  spinner_style=dict(marginTop=''))
-
-                                                      ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card4',
-                                        className='info-card'),
-
-                               dbc.Card(dbc.CardBody([likes_avg_text,
-                                                      dbc.Spinner([likes_avg_indicator], size="lg",
-                                                                  color="primary",
-                                                                  type="border", fullscreen=False,
-                                                                  spinner_style=dict(marginTop=''))
-
-                                                      ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card4',
-                                        className='info-card'),
-
-                               dbc.Card(dbc.CardBody([replies_avg_text,
-                                                      dbc.Spinner([replies_avg_indicator], size="lg",
-                                                                  color="primary",
-                                                                  type="border", fullscreen=False,
-                                                                  spinner_style=dict(marginTop=''))
-
-                                                      ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card5',
-                                        className='info-card'),
-
-                               dbc.Card(dbc.CardBody([countries_num_text,
-                                                      dbc.Spinner([countries_num_indicator], size="lg",
-                                                                  color="primary",
-                                                                  type="border", fullscreen=False,
-                                                                  spinner_style=dict(marginTop=''))
-
-                                                      ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card6',
-                                        className='info-card'),
-                           ], style=dict(display='flex', alignItems='center',
-                                         justifyContent='center', width='100%'))
-                       ]),
-    html.Br(),
-
-    dbc.Row([
-
-
-        dbc.Col([dbc.Card(dbc.CardBody([hor_bar_chart_header,
-                                        dbc.Spinner([hor_bar_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([ver_bar_chart_header,
-                                        dbc.Spinner([ver_bar_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([common_words,
-                                        dbc.Spinner([common_words_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([circle_chart_header,
-                                        dbc.Spinner([circle_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-
-        dbc.Col([dbc.Card(dbc.CardBody([bubble_chart_header,
-                                        dbc.Spinner([bubble_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([polar_area_chart_header,
-                                        dbc.Spinner([polar_area_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([time_series_chart_header,
-                                        dbc.Spinner([time_series_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=6, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-        dbc.Col([dbc.Card(dbc.CardBody([time_sentiment_chart_header,
-                                        dbc.Spinner([time_sentiment_chart_div], size="lg", color="primary",
-                                                    type="border",
-                                                    fullscreen=False),
-
-                                        ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
-                          className='charts-card'), html.Br()
-                 ], xl=dict(size=6, offset=0), lg=dict(size=6, offset=0),
-                md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
-                style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
-
-
-    ], className='g-0')
-])
+    time_sentiment_chart_div = lazy_card(
+        dcc.Graph(id='time_sentiment_chart', config={'displayModeBar': True, 'displaylogo': False,
+                                                     'modeBarButtonsToRemove': ['lasso2d', 'pan', 'zoom2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d']}, className='ver-bar-fig',
+                  style=dict(height='', backgroundColor='#f7f7f7', border=''), figure=blank_figure()
+                  ), id='time_sentiment_chart_div'
+    )
+
+    # ---------------------------------------------------------------------------------------
+
+    main_layout = html.Div([dbc.Row([db_logo_img, db_header_text],
+                                    style=dict(backgroundColor='white'), id='main_header'),
+                            filters_row,
+                            # html.Br(),
+
+                           dbc.Row([
+                               html.Div([
+
+                                   dbc.Card(dbc.CardBody([tweets_num_text,
+                                                         dbc.Spinner([tweets_num_indicator], size="lg", color="primary",
+                                                                     type="border", fullscreen=False,
+                                                                     spinner_style=dict(marginTop=''))
+
+                                                          ]), style=dict(backgroundColor='#f7f7f7'), id='card3',
+                                            className='info-card'),
+
+
+                                   dbc.Card(dbc.CardBody([retweets_avg_text,
+                                                          dbc.Spinner([retweets_avg_indicator], size="lg", color="primary",
+                                                                      type="border", fullscreen=False,
+                                                                      spinner_style=dict(marginTop=''))
+
+                                                          ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card4',
+                                            className='info-card'),
+
+                                   dbc.Card(dbc.CardBody([likes_avg_text,
+                                                          dbc.Spinner([likes_avg_indicator], size="lg",
+                                                                      color="primary",
+                                                                      type="border", fullscreen=False,
+                                                                      spinner_style=dict(marginTop=''))
+
+                                                          ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card4',
+                                            className='info-card'),
+
+                                   dbc.Card(dbc.CardBody([replies_avg_text,
+                                                          dbc.Spinner([replies_avg_indicator], size="lg",
+                                                                      color="primary",
+                                                                      type="border", fullscreen=False,
+                                                                      spinner_style=dict(marginTop=''))
+
+                                                          ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card5',
+                                            className='info-card'),
+
+                                   dbc.Card(dbc.CardBody([countries_num_text,
+                                                          dbc.Spinner([countries_num_indicator], size="lg",
+                                                                      color="primary",
+                                                                      type="border", fullscreen=False,
+                                                                      spinner_style=dict(marginTop=''))
+
+                                                          ]), style=dict(backgroundColor='#f7f7f7', marginLeft='1vw'), id='card6',
+                                            className='info-card'),
+                               ], style=dict(display='flex', alignItems='center',
+                                             justifyContent='center', width='100%'))
+                           ]),
+        html.Br(),
+
+        dbc.Row([
+
+
+            dbc.Col([dbc.Card(dbc.CardBody([hor_bar_chart_header,
+                                            dbc.Spinner([hor_bar_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([ver_bar_chart_header,
+                                            dbc.Spinner([ver_bar_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([common_words,
+                                            dbc.Spinner([common_words_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([circle_chart_header,
+                                            dbc.Spinner([circle_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+
+            dbc.Col([dbc.Card(dbc.CardBody([bubble_chart_header,
+                                            dbc.Spinner([bubble_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([polar_area_chart_header,
+                                            dbc.Spinner([polar_area_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=4, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([time_series_chart_header,
+                                            dbc.Spinner([time_series_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=6, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+            dbc.Col([dbc.Card(dbc.CardBody([time_sentiment_chart_header,
+                                            dbc.Spinner([time_sentiment_chart_div], size="lg", color="primary",
+                                                        type="border",
+                                                        fullscreen=False),
+
+                                            ]), style=dict(backgroundColor='#f7f7f7'), id='card8',
+                              className='charts-card'), html.Br()
+                     ], xl=dict(size=6, offset=0), lg=dict(size=6, offset=0),
+                    md=dict(size=6, offset=0), sm=dict(size=12, offset=0), xs=dict(size=12, offset=0),
+                    style=dict(paddingLeft='0.5vw', paddingRight='0.5vw')),
+
+
+        ], className='g-0')
+    ])
+    return main_layout
+
+
+main_layout = build_main_layout()
+
+# callback results are memoized on their inputs and the dataset version,
+# hit/miss counters are served at /cache-stats
+callbacks = callback_cache.CallbackCache(version=data_version)
+callbacks.register_stats_route(server)
+
+# callback, chart and query latencies in Prometheus format at /metrics
+metrics.register_route(server)
+
+
+@callbacks.memoize()
+def card_figure(card, reviewer=None, start=None, end=None, sentiments=None):
+    # trimmed figure JSON of a card, cached per dataset version and filters
+    import charts
+    if reviewer is None and start is None and end is None and sentiments is None:
+        return charts.compact_figure(build_figure(card, *warmup.get('data')))
+    return charts.compact_figure(build_filtered_figure(card, warmup.get('engine'), reviewer, start, end, sentiments))
+
+
+FILTER_INPUTS = [Input('reviewer_filter', 'value'), Input('date_filter', 'start_date'),
+                 Input('date_filter', 'end_date'), Input('sentiment_filter', 'value')]
+
+
+def register_card(card):
+    inputs = [Input(card + '_visible', 'data')] + (FILTER_INPUTS if card in FILTERED_CARDS else [])
+
+    @app.callback(Output(card, 'figure'), inputs, prevent_initial_call=True)
+    @metrics.callback('load_card_' + card)
+    def load_card(visible, *filters):
+        # cards that have not scrolled into view yet ignore filter changes
+        if not visible:
+            raise PreventUpdate
+        if not filters:
+            return card_figure(card)
+        reviewer, start, end, sentiments = filters
+        # every sentiment ticked is the same as no sentiment filter
+        if sentiments is not None and set(sentiments) >= set(SENTIMENTS):
+            sentiments = None
+        return card_figure(card, reviewer or None, start, end, sorted(sentiments) if sentiments is not None else None)
+
+
+for card in CARDS:
+    register_card(card)
+
+
+@app.callback(Output('reviewer_filter', 'options'), Input('reviewer_filter', 'search_value'),
+              State('reviewer_filter', 'value'))
+@metrics.callback()
+def reviewer_options(search_value, selected):
+    # the most active reviewers, or the names starting with what was typed
+    engine = warmup.get('engine')
+    names = engine.find_reviewers(search_value) if search_value else engine.top_reviewers(20).index.tolist()
+    if selected and selected not in names:
+        names = [selected] + names
+    return names
+
+# data is loaded in a background thread, then the card figures are cached
+# ahead of their first request. The server answers /ready as soon as this
+# module is imported, the cards wait for the data behind their spinners.
+# `python startup.py test` prints the import-time and phase profile.
+warmup = startup.Warmup()
+warmup.add('data', load_data)
+warmup.add('engine', load_engine, required=False)
+warmup.add('figures', lambda: [card_figure(card) for card in CARDS], required=False)
+warmup.register_routes(server)
+warmup.start()
 
 
 app.layout = html.Div([dbc.Spinner([html.Div(id='layout')], size="lg", color="primary", type="border", fullscreen=True, id='spinner'), dcc.Location(id='url', refresh=True, pathname='/Dashboard')
@@ -473,6 +587,7 @@ app.layout = html.Div([dbc.Spinner([html.Div(id='layout')], size="lg", color="pr
 
 
 @app.callback([Output('layout', 'children'), Output('spinner', 'delay_show')], Input('url', 'pathname'))
+@metrics.callback()
 def landing_page(pathname):
     if pathname == '/Dashboard':
         return (main_layout, 60000)
@@ -481,32 +596,29 @@ def landing_page(pathname):
 
 #Edward Zavala :)!!
 @app.callback(Output('date_chart', 'figure'), Input('topics_menu', 'value'))
+@metrics.callback()
+@callbacks.memoize()
 def update_date_chart(selected_topic):
     fig = go.Figure()
-    graph_data = df.copy()
-    # setting the index to 'created' column
-    graph_data.set_index('created', inplace=True)
-    # mapping sentiment numbers to text values
-    sent_dict = {'negative': 'negative',
-                 'neutral': 'neutral', 'positive': 'positive'}
-    sent_colors = {'1': 'red', '2': '#e3a817', '3': 'green'}
-
-    # checking if selected topic is not all topics ( user choosed one topic )
-    if (selected_topic != 'Reviewer Name'):
-        # filtering dataframe based on that topic
-        graph_data = graph_data[graph_data['reviewer_name'] == selected_topic]
-
-    for i in range(1, 4):
-        # looping through the data filtered with each sentiment
-        data = graph_data[graph_data['sentiment'] == str(i)]
-        # getting the count of tweets for each day
-        data = data.resample('1D').count()
+    sent_colors = {'negative': 'red', 'neutral': '#e3a817', 'positive': 'green'}
+
+    # checking if selected topic is not all topics ( user choosed one topic ),
+    # the reviewer's per-day counts come from the query engine's posting list
+    reviewer = None if selected_topic == 'Reviewer Name' else selected_topic
+    graph_data = warmup.get('engine').series(reviewer, granularity='day')
+
+    for sentiment in ['negative', 'neutral', 'positive']:
+        # getting the count of reviews for each day, from the first to the
+        # last review with this sentiment
+        data = graph_data.get(sentiment, graph_data['total'].iloc[:0])
+        days = data.index[data.to_numpy() > 0]
+        data = data.loc[days[0]:days[-1]] if len(days) else data.iloc[:0]
 
         # line chart
 
         fig.add_trace(
-            go.Scatter(x=data.index, y=data['tweetId'].astype('int64'), mode='lines', name=sent_dict[str(i)],
-                       marker_color=sent_colors[str(i)]
+            go.Scatter(x=data.index.to_timestamp(), y=data.values, mode='lines', name=sentiment,
+                       marker_color=sent_colors[sentiment]
                        # , stackgroup='one'
                        ))
 
@@ -530,7 +642,10 @@ def update_date_chart(selected_topic):
     return fig
 
 
+# not memoized: the image only depends on the topic, and a cache key with
+# the data version would hold it back until the data has loaded
 @app.callback(Output('word_cloud', 'src'), Input('topics_menu2', 'value'))
+@metrics.callback()
 def update_word_cloud(selected_topic):
 
     dire = os.path.join(THIS_FOLDER, '{}.png'.format(selected_topic))
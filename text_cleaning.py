@@ -0,0 +1,221 @@
+import logging
+import os
+import re
+import string
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import nltk
+import pandas as pd
+from nltk.corpus import stopwords
+
+# one-time load of English stopwords, lemmatizer and stemmer
+stop_words = set(stopwords.words('english'))
+lemmatizer = nltk.stem.WordNetLemmatizer()
+stemmer = nltk.stem.PorterStemmer()
+
+URL_PATTERN = r'http\S+|www\S+|https\S+'
+MENTION_PATTERN = r'\@\w+|\#\w+'
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+EMOJI_RANGES = (u"\U0001F600-\U0001F64F"  # emoticons
+                u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+                u"\U0001F680-\U0001F6FF"  # transport & map symbols
+                u"\U0001F700-\U0001F77F"  # alchemical symbols
+                u"\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
+                u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+                u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+                u"\U0001FA00-\U0001FA6F"  # Chess Symbols
+                u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+                u"\U00002702-\U000027B0"  # Dingbats
+                u"\U000024C2-\U0001F251")
+EMOJI_PATTERN = re.compile("[" + EMOJI_RANGES + "]+", flags=re.UNICODE)
+
+# remove_numbers and remove_emojis both only delete single characters, so
+# they can run as one pass over a merged character class
+NUMBERS_EMOJIS_PATTERN = re.compile(r"[\d" + EMOJI_RANGES + "]+", flags=re.UNICODE)
+
+DEFAULT_CHUNKSIZE = 20000
+
+
+# ---------------------------------------------------------------------------------------
+# reference implementation, step for step the clean_text from 1_dataPreprocessing
+
+def remove_urls(text):
+    # Input validation
+    if not isinstance(text, str):
+        logging.error("Input must be a string.")
+        raise TypeError("Input must be a string.")
+
+    # Removing URLs from the text
+    return re.sub(URL_PATTERN, '', text, flags=re.MULTILINE)
+
+
+def remove_mentions_hashtags(text):
+    # Input validation
+    if not isinstance(text, str):
+        logging.error("Input must be a string.")
+        raise TypeError("Input must be a string.")
+
+    # Removing mentions and hashtags from the text
+    return re.sub(MENTION_PATTERN, '', text)
+
+
+def remove_punctuations(text):
+    # Input validation
+    if not isinstance(text, str):
+        logging.error("Input must be a string.")
+        raise TypeError("Input must be a string.")
+
+    # Removing punctuations from the text
+    return text.translate(PUNCTUATION_TABLE)
+
+
+def remove_stopwords(text):
+    # Input validation
+    if not isinstance(text, str):
+        logging.error("Input must be a string.")
+        raise TypeError("Input must be a string.")
+
+    # Removing stop words from the text
+    return ' '.join([word for word in text.split() if word not in stop_words])
+
+
+def remove_numbers(text):
+    """Remove numbers from a text string"""
+    return re.sub(r'\d+', '', text)
+
+
+def remove_emojis(text):
+    """Remove emojis from a text string"""
+    return EMOJI_PATTERN.sub(r'', text)
+
+
+def handle_whitespace(text):
+    """Handle excessive whitespace"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def lemmitization(text):
+    """Lemmitize text"""
+    return ' '.join([lemmatizer.lemmatize(word) for word in text.split()])
+
+
+def stemminization(text):
+    """Stem text"""
+    return ' '.join([stemmer.stem(word) for word in text.split()])
+
+
+def clean_text_reference(text):
+    text = text.lower()
+    text = remove_urls(text)
+    text = remove_mentions_hashtags(text)
+    text = remove_punctuations(text)
+    text = remove_stopwords(text)
+    text = remove_numbers(text)
+    text = remove_emojis(text)
+    text = handle_whitespace(text)
+    text = lemmitization(text)
+    text = stemminization(text)
+    return text
+
+
+# ---------------------------------------------------------------------------------------
+# batch implementation
+
+@lru_cache(maxsize=1 << 20)
+def clean_token(token):
+    """
+    Everything clean_text does after punctuation removal, applied to a single
+    whitespace-separated token. Stopword removal, number/emoji removal,
+    lemmatization and stemming never look across token boundaries, so each
+    distinct token only has to go through them once per process.
+    """
+    if token in stop_words:
+        return ''
+    token = NUMBERS_EMOJIS_PATTERN.sub('', token)
+    if not token:
+        return ''
+    return ' '.join([stemmer.stem(word) for word in lemmatizer.lemmatize(token).split()])
+
+
+def clean_series(texts):
+    """
+    Clean a Series of review strings. Produces exactly the same output as
+    applying clean_text_reference row by row.
+    """
+    # the regex passes run vectorized over the whole column
+    texts = (
+        texts.str.lower()
+             .str.replace(URL_PATTERN, '', regex=True)
+             .str.replace(MENTION_PATTERN, '', regex=True)
+             .str.translate(PUNCTUATION_TABLE)
+    )
+
+    # the per-token steps go through the memoized clean_token
+    return pd.Series([' '.join([cleaned for cleaned in map(clean_token, text.split()) if cleaned])
+                      for text in texts], index=texts.index, dtype=object)
+
+
+def clean_text(text):
+    # single review version of clean_series
+    return clean_series(pd.Series([text]))[0]
+
+
+def _clean_chunk(texts):
+    # worker entry point, receives and returns plain lists to keep pickling cheap
+    return clean_series(pd.Series(texts, dtype=object)).tolist()
+
+
+def clean_comments(comments, n_jobs=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Batch API for the preprocessing step: clean a column of raw comments,
+    spreading chunks across a process pool when there is more than one chunk.
+    n_jobs defaults to the number of cores.
+    """
+    comments = comments.astype(str)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1 or len(comments) <= chunksize:
+        return clean_series(comments)
+
+    chunks = [comments.iloc[start:start + chunksize].tolist()
+              for start in range(0, len(comments), chunksize)]
+    cleaned = []
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        for result in executor.map(_clean_chunk, chunks):
+            cleaned.extend(result)
+    return pd.Series(cleaned, index=comments.index, dtype=object)
+
+
+def benchmark(comments, n_jobs=None):
+    # compare the notebook's per-row apply with the batch engine
+    comments = comments.astype(str)
+
+    start = time.perf_counter()
+    expected = comments.apply(clean_text_reference)
+    reference_time = time.perf_counter() - start
+
+    clean_token.cache_clear()
+    start = time.perf_counter()
+    cleaned = clean_comments(comments, n_jobs=n_jobs)
+    batch_time = time.perf_counter() - start
+
+    mismatches = int((cleaned != expected).sum())
+    print('rows:       {:,}'.format(len(comments)))
+    print('notebook:   {:,.0f} reviews/sec'.format(len(comments) / reference_time))
+    print('batch:      {:,.0f} reviews/sec ({:.1f}x)'.format(
+        len(comments) / batch_time, reference_time / batch_time))
+    print('mismatches: {}'.format(mismatches))
+    return mismatches
+
+
+if __name__ == '__main__':
+    # python text_cleaning.py [reviews.csv] [rows] [n_jobs]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'Dataset/Cleaned Data/reviews.csv'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    jobs = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    df = pd.read_csv(source, encoding='latin1', usecols=['comments'], nrows=rows)
+    sys.exit(1 if benchmark(df['comments'], n_jobs=jobs) else 0)
@@ -0,0 +1,47 @@
+import pandas as pd
+
+# granularity name -> pandas period frequency
+GRANULARITIES = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+
+# how bucket labels are shown on the chart axes, keyed by period frequency
+LABEL_FORMATS = {'D': '%Y-%m-%d', 'W': '%Y-%m-%d', 'M': '%Y-%m', 'Y': '%Y', 'A': '%Y'}
+
+
+def parse_dates(dates):
+    # parse the date column once, leaves already parsed columns alone
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    return pd.to_datetime(dates, format='%Y-%m-%d')
+
+
+def bucket_counts(df, granularity='month'):
+    """
+    Review counts per time bucket in one groupby/unstack pass. Returns a
+    DataFrame indexed by period with one column per sentiment and a 'total'
+    column (which also counts reviews without a sentiment). The caller's
+    DataFrame is not modified.
+    """
+    periods = parse_dates(df['date']).dt.to_period(GRANULARITIES[granularity]).rename('period')
+    sentiment = df['sentiment'].astype(object).rename('sentiment')
+
+    counts = sentiment.groupby([periods, sentiment], dropna=False).size().unstack(fill_value=0)
+    counts = counts.loc[counts.index.notna()]
+    counts['total'] = counts.sum(axis=1)
+    counts = counts.loc[:, counts.columns.notna()]
+    counts.columns = counts.columns.astype(str)
+    counts.columns.name = None
+    return counts.sort_index()
+
+
+def rollup(counts, granularity):
+    # re-bucket counts to a coarser granularity, e.g. daily -> monthly
+    freq = GRANULARITIES[granularity]
+    return counts.groupby(counts.index.asfreq(freq)).sum().rename_axis('period')
+
+
+def bucket_labels(index):
+    # axis labels for a PeriodIndex, formatted once per bucket rather than per row
+    if not isinstance(index, pd.PeriodIndex):
+        return index
+    fmt = LABEL_FORMATS[index.freqstr[0]]
+    return index.start_time.strftime(fmt)
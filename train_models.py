@@ -0,0 +1,181 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import joblib
+import pandas as pd
+from sklearn.ensemble import AdaBoostClassifier, GradientBoostingClassifier, RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+
+import reviews_io
+
+# candidate name -> (estimator factory, file name in Models/), as in 2_machineLearning
+CANDIDATES = {
+    'logistic_regression': (LogisticRegression, 'logistic_regression_model.pkl'),
+    'ada_boost': (AdaBoostClassifier, 'ada_boost_model.pkl'),
+    'k_neighbors': (KNeighborsClassifier, 'k_neighbors_model.pkl'),
+    'decision_tree': (DecisionTreeClassifier, 'decision_tree_model.pkl'),
+    'random_forest': (RandomForestClassifier, 'random_forest_model.pkl'),
+    'gradient_boosting': (GradientBoostingClassifier, 'gradient_boosting_model.pkl'),
+    'c_support_vector': (SVC, 'c_support_vector_model.pkl'),
+}
+
+DEFAULT_TIME_BUDGET = 3600
+
+
+def prepare_features(df, data_dir):
+    """
+    Fit the TF-IDF matrix once and dump the split to data_dir. Workers load
+    it with mmap_mode='r', so every process shares the same read-only pages
+    instead of holding its own copy.
+    """
+    vectorizer = TfidfVectorizer()
+    X = vectorizer.fit_transform(df['cleaned_comments'])
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, df['sentiment'].astype(str), test_size=0.2, random_state=42)
+    # sorted up front: SVC sorts the indices of its input in place, which
+    # fails on the read-only memory map
+    X_train.sort_indices()
+    X_test.sort_indices()
+    path = os.path.join(data_dir, 'split.joblib')
+    joblib.dump((X_train, X_test, y_train.to_numpy(), y_test.to_numpy()), path)
+    return vectorizer, path
+
+
+def train_one(name, data_path, output_dir, results):
+    # worker process: fit, time, score and save one candidate
+    try:
+        row = _train(name, data_path, output_dir)
+    except Exception as e:
+        row = {'model': name, 'status': 'failed', 'error': '{}: {}'.format(type(e).__name__, e)}
+    results.put(row)
+
+
+def _train(name, data_path, output_dir):
+    X_train, X_test, y_train, y_test = joblib.load(data_path, mmap_mode='r')
+    factory, file_name = CANDIDATES[name]
+    model = factory()
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prediction = model.predict(X_test)
+    predict_time = time.perf_counter() - start
+
+    model_path = os.path.join(output_dir, file_name)
+    joblib.dump(model, model_path)
+
+    return {
+        'model': name,
+        'status': 'ok',
+        'fit_sec': fit_time,
+        'predict_rows_per_sec': X_test.shape[0] / predict_time if predict_time else float('inf'),
+        'size_mb': os.path.getsize(model_path) / 2 ** 20,
+        'accuracy': accuracy_score(y_test, prediction),
+        'precision': precision_score(y_test, prediction, average='weighted', zero_division=0),
+        'recall': recall_score(y_test, prediction, average='weighted', zero_division=0),
+        'f1': f1_score(y_test, prediction, average='weighted', zero_division=0),
+    }
+
+
+def run_bakeoff(data_path, names, output_dir, n_jobs, time_budget):
+    """
+    Train the candidates concurrently, at most n_jobs at a time. A candidate
+    still running after time_budget seconds is terminated and reported as a
+    timeout.
+    """
+    results = multiprocessing.Queue()
+    pending = list(names)
+    running = {}
+    rows = {}
+
+    while pending or running:
+        while pending and len(running) < n_jobs:
+            name = pending.pop(0)
+            process = multiprocessing.Process(target=train_one, name=name,
+                                              args=(name, data_path, output_dir, results))
+            process.start()
+            running[name] = (process, time.monotonic())
+
+        time.sleep(0.2)
+        while not results.empty():
+            row = results.get()
+            rows[row['model']] = row
+
+        for name, (process, started) in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                del running[name]
+            elif time.monotonic() - started > time_budget:
+                process.terminate()
+                process.join()
+                del running[name]
+                rows[name] = {'model': name, 'status': 'timeout'}
+
+    # collect results that arrived after their process had exited
+    while not results.empty():
+        row = results.get()
+        rows[row['model']] = row
+    for name in names:
+        rows.setdefault(name, {'model': name, 'status': 'failed', 'error': 'worker exited without a result'})
+
+    return pd.DataFrame([rows[name] for name in names])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train and compare the sentiment classifiers')
+    parser.add_argument('--models', default=','.join(CANDIDATES),
+                        help='comma separated candidates, from: ' + ', '.join(CANDIDATES))
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--time-budget', type=float, default=DEFAULT_TIME_BUDGET,
+                        help='seconds allowed per model')
+    parser.add_argument('--output-dir', default='Models')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    names = [name for name in args.models.split(',') if name]
+    unknown = set(names) - set(CANDIDATES)
+    if unknown:
+        raise SystemExit('unknown models: ' + ', '.join(sorted(unknown)))
+    # every pickle in the output directory must be fitted on the vectorizer
+    # published with it, so a subset run may not leave older ones behind
+    stale = [name for name, (_, file_name) in CANDIDATES.items()
+             if name not in names and os.path.exists(os.path.join(args.output_dir, file_name))]
+    if stale:
+        raise SystemExit('{} also holds {}, fitted on the current vectorizer: retrain them too '
+                         '(--models) or write this run to its own --output-dir'.format(
+                             args.output_dir, ', '.join(stale)))
+
+    df = reviews_io.load_reviews(columns=['cleaned_comments', 'sentiment']).dropna()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # the vectorizer and models are written to a run directory next to the
+    # output and only moved over the old pickles once every candidate has
+    # trained, so Models/ never mixes vocabularies or holds a half-written
+    # pickle from a worker killed by the time budget
+    with tempfile.TemporaryDirectory() as data_dir, \
+            tempfile.TemporaryDirectory(prefix='.run-', dir=args.output_dir) as run_dir:
+        vectorizer, data_path = prepare_features(df, data_dir)
+        joblib.dump(vectorizer, os.path.join(run_dir, 'tfidf_vectorizer.pkl'))
+        table = run_bakeoff(data_path, names, run_dir, args.jobs, args.time_budget)
+        succeeded = (table['status'] == 'ok').all()
+        if succeeded:
+            for file_name in os.listdir(run_dir):
+                os.replace(os.path.join(run_dir, file_name), os.path.join(args.output_dir, file_name))
+
+    table.to_csv(os.path.join(args.output_dir, 'model_comparison.csv'), index=False)
+    print(table.round(4).to_string(index=False))
+    if not succeeded:
+        raise SystemExit('not every model trained, {} was left unchanged'.format(args.output_dir))
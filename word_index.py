@@ -0,0 +1,170 @@
+import hashlib
+import os
+import string
+import sys
+from collections import Counter, defaultdict
+
+import joblib
+import pandas as pd
+
+import reviews_io
+
+# English stopwords, loaded on first use by _stop_words() so importing
+# this module stays cheap
+_STOPWORDS = None
+
+PUNCTUATION_TABLE = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+
+csv_file = 'Dataset/Cleaned Data/reviews.csv'
+index_file = 'Dataset/Aggregates/word_index.pkl'
+
+# bump this whenever the pickled layout of WordIndex changes
+INDEX_VERSION = 1
+
+
+def _stop_words():
+    global _STOPWORDS
+    if _STOPWORDS is None:
+        from nltk.corpus import stopwords
+        _STOPWORDS = set(stopwords.words('english'))
+    return _STOPWORDS
+
+
+def count_words(texts):
+    """
+    Count non-stopword words in an iterable of comments: lowercased,
+    punctuation replaced by spaces, split on whitespace. Same words as
+    charts.top_words used to produce, without exploding into one row per
+    token.
+    """
+    stop_words = _stop_words()
+    counts = Counter()
+    for text in texts:
+        if isinstance(text, str):
+            counts.update(word for word in text.lower().translate(PUNCTUATION_TABLE).split()
+                          if word not in stop_words)
+    return counts
+
+
+def _head_digest(path):
+    # hash of the start of the file, unchanged when rows are only appended
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(reviews_io.FINGERPRINT_BLOCK)).hexdigest()
+
+
+class WordIndex:
+    """
+    Word counts over cleaned_comments, globally and per sentiment. Built by
+    streaming over the reviews and merging per-chunk Counters, and kept up
+    to date by adding new reviews as they arrive.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.version = INDEX_VERSION
+        self.counts = Counter()
+        self.sentiment_counts = defaultdict(Counter)
+        self.n_reviews = 0
+        # which prefix of which csv has been indexed, for incremental updates
+        self.source = None
+        self.source_head = None
+        self.source_size = 0
+
+    def add_reviews(self, comments, sentiments=None):
+        # fold a batch of reviews (two aligned Series/lists) into the index
+        comments = list(comments)
+        if sentiments is None:
+            self.counts.update(count_words(comments))
+        else:
+            by_sentiment = defaultdict(list)
+            for text, sentiment in zip(comments, sentiments):
+                by_sentiment[sentiment].append(text)
+            for sentiment, texts in by_sentiment.items():
+                counts = count_words(texts)
+                self.counts.update(counts)
+                if not pd.isna(sentiment):
+                    self.sentiment_counts[str(sentiment)].update(counts)
+        self.n_reviews += len(comments)
+
+    @property
+    def data_version(self):
+        # identifies the indexed data, for keying caches built from it
+        return '{}-{}-{}'.format((self.source_head or '')[:12], self.source_size, self.n_reviews)
+
+    def add_frame(self, df):
+        self.add_reviews(df['cleaned_comments'], df['sentiment'] if 'sentiment' in df else None)
+
+    def top(self, n=100, sentiment=None):
+        # top-n lookup as a Series indexed by word
+        counts = self.counts if sentiment is None else self.sentiment_counts.get(sentiment, Counter())
+        top = counts.most_common(n)
+        return pd.Series([count for _, count in top], index=[word for word, _ in top],
+                         name='count', dtype='int64')
+
+    def update_from_csv(self, source=csv_file, chunksize=reviews_io.DEFAULT_CHUNKSIZE):
+        """
+        Bring the index up to date with source. Rows appended since the last
+        update are streamed in; if the file was rewritten the index starts
+        over. Returns the number of reviews added.
+        """
+        size = os.path.getsize(source)
+        head = _head_digest(source)
+        if source != self.source or head != self.source_head or size < self.source_size:
+            self.reset()
+        elif size == self.source_size:
+            return 0
+
+        # continue reading where the previous update stopped
+        added = 0
+        columns = ['cleaned_comments', 'sentiment']
+        header = list(pd.read_csv(source, nrows=0).columns)
+        usecols, dtypes = reviews_io.csv_columns(source, columns)
+        with open(source, 'rb') as f:
+            if self.source_size:
+                f.seek(self.source_size)
+                reader = pd.read_csv(f, header=None, names=header, usecols=usecols, dtype=dtypes,
+                                     chunksize=chunksize)
+            else:
+                reader = pd.read_csv(f, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+            for chunk in reader:
+                self.add_frame(chunk)
+                added += len(chunk)
+
+        self.source = source
+        self.source_head = head
+        self.source_size = size
+        return added
+
+    def save(self, path=index_file):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # per-process tmp file, concurrent saves never write into the same one
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=index_file):
+        # returns None when there is no usable index at path
+        if not os.path.exists(path):
+            return None
+        index = joblib.load(path)
+        if getattr(index, 'version', None) != INDEX_VERSION:
+            return None
+        return index
+
+
+def load_or_build(source=csv_file, path=index_file):
+    # load the persisted index and fold in any reviews appended to source
+    index = WordIndex.load(path) or WordIndex()
+    if index.update_from_csv(source) or not os.path.exists(path):
+        index.save(path)
+    return index
+
+
+if __name__ == '__main__':
+    # python word_index.py [reviews.csv]
+    word_idx = load_or_build(sys.argv[1] if len(sys.argv) > 1 else csv_file)
+    print('{:,} reviews indexed, {:,} distinct words'.format(word_idx.n_reviews, len(word_idx.counts)))
+    print(word_idx.top(20).to_string())